@@ -0,0 +1,85 @@
+"""Measure the allocator churn of the engine with and without the reused batch buffers.
+
+    python -m benchmarks.allocations --dataset german-credit --rows 2000 --batch-size 128
+
+A warm-up call fills the buffers of the thread, then a call is run under tracemalloc for each
+setting of the 'reuse_buffers' config. The churn of a batch is the peak of the traced (Python
+and numpy) memory above the memory at its start, so the sum over the batches approximates the
+memory allocated by the job. Torch allocations are not traced.
+"""
+import argparse
+import json
+import timeit
+import tracemalloc
+
+from cf_ml.cf_engine import CFEnginePytorch
+from cf_ml.utils.instrument import MemoryCollector
+
+from benchmarks.suites import ENGINE_CONFIG, cleanup, load_dataset, load_model
+
+
+def measure_allocations(dataset, rows, batch_size, num, reuse):
+    """Run a job under tracemalloc.
+
+    Returns:
+        A dict with the time, the number of batches, the buffer allocations, and the total and
+        per-batch churn in bytes.
+    """
+    data = load_dataset(dataset)
+    model = load_model(dataset)
+    X = data.get_subset(preprocess=False)[data.features]
+    X = X.sample(rows, replace=rows > len(X), random_state=0)
+    collector = MemoryCollector()
+    engine = CFEnginePytorch(data, model, dict(ENGINE_CONFIG, batch_size=batch_size,
+                                               reuse_buffers=reuse), collector=collector)
+    setting = {'num': num, 'seed': 0}
+    engine.generate_counterfactual_examples(X.iloc[:batch_size], setting, verbose=False)
+
+    tracemalloc.start()
+    try:
+        start = timeit.default_timer()
+        engine.generate_counterfactual_examples(X, setting, verbose=False)
+        seconds = timeit.default_timer() - start
+    finally:
+        tracemalloc.stop()
+    counters = collector.records[-1]['counters']
+    return {'reuse_buffers': reuse, 'seconds': seconds, 'batches': counters['batches'],
+            'buffer_allocations': counters.get('buffer_allocations', 0),
+            'churn': counters['traced_batch_peak'],
+            'churn_per_batch': counters['traced_batch_peak'] / counters['batches']}
+
+
+def get_run_args():
+    parser = argparse.ArgumentParser(description="Measure the allocator churn of the engine "
+                                                 "with and without the reused batch buffers.")
+    parser.add_argument('--dataset', default='german-credit', type=str)
+    parser.add_argument('--rows', default=2000, type=int)
+    parser.add_argument('--batch-size', default=128, type=int)
+    parser.add_argument('--num', default=3, type=int)
+    parser.add_argument('--output', default=None, type=str,
+                        help="The path to store the results as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = get_run_args()
+    results = []
+    try:
+        for reuse in (False, True):
+            result = measure_allocations(args.dataset, args.rows, args.batch_size, args.num,
+                                         reuse)
+            print("reuse_buffers={reuse_buffers}: {seconds:.2f}s, {batches} batches, "
+                  "{buffer_allocations} buffer allocations, churn {churn_mb:.1f}MB "
+                  "({batch_mb:.2f}MB per batch)".format(
+                      churn_mb=result['churn'] / 2 ** 20,
+                      batch_mb=result['churn_per_batch'] / 2 ** 20, **result))
+            results.append(result)
+    finally:
+        cleanup()
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
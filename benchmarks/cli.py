@@ -0,0 +1,44 @@
+import argparse
+import sys
+
+from .runner import run_benchmarks, save_results, load_results, compare_results, \
+    print_comparison
+from .suites import build_benchmarks, cleanup
+
+
+def get_run_args():
+    parser = argparse.ArgumentParser(description="Benchmark the DECE engine, dataset transforms "
+                                                 "and API.")
+    parser.add_argument('--profile', default='quick', choices=['quick', 'full'],
+                        help="The set of benchmark cases to run")
+    parser.add_argument('--filter', default=None, type=str,
+                        help="Only run the cases whose name contains the given string")
+    parser.add_argument('--output', default='bench_results.json', type=str,
+                        help="The path to store the results")
+    parser.add_argument('--baseline', default=None, type=str,
+                        help="The path of the baseline results to compare with")
+    parser.add_argument('--threshold', default=0.2, type=float,
+                        help="The allowed relative slowdown against the baseline")
+    parser.add_argument('--memory-threshold', default=None, type=float,
+                        help="The allowed relative increase of peak memory against the baseline")
+    return parser.parse_args()
+
+
+def main():
+    args = get_run_args()
+    try:
+        results = run_benchmarks(build_benchmarks(args.profile), pattern=args.filter)
+    finally:
+        cleanup()
+    save_results(results, args.output)
+
+    if args.baseline is not None:
+        comparison = compare_results(results, load_results(args.baseline), args.threshold,
+                                     memory_threshold=args.memory_threshold)
+        print_comparison(comparison)
+        if any(entry['regression'] for entry in comparison):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import gc
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+
+def _max_rss():
+    """Get the peak resident set size of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure(fn, repeat=3, warmup=1, trace_memory=True):
+    """Time a function and record its peak memory usage.
+
+    Args:
+        fn: callable without arguments, the code to measure.
+        repeat: number, the number of timed runs.
+        warmup: number, the number of untimed runs before the timed ones.
+        trace_memory: boolean, whether to trace the peak of python (incl. numpy) allocations
+            in an extra run, which is not timed since tracing slows the code down.
+
+    Returns:
+        A dict of the timing statistics in seconds and the peak memory in bytes.
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        checkpoint = timeit.default_timer()
+        fn()
+        times.append(timeit.default_timer() - checkpoint)
+
+    result = {'repeat': repeat, 'mean': statistics.mean(times), 'median': statistics.median(times),
+              'min': min(times), 'max': max(times)}
+
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            _, result['peak_memory'] = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    result['max_rss'] = _max_rss()
+    return result
+
+
+class Benchmark:
+    """A benchmark case, i.e. a setup function and a parameter grid.
+
+    Args:
+        name: str, the name of the benchmark.
+        setup: callable, receives the parameters and returns the function to measure.
+        params: list of dicts, the parameter grid; each dict is one measured case.
+        repeat: number, the number of timed runs of each case.
+    """
+
+    def __init__(self, name, setup, params=None, repeat=3):
+        self.name = name
+        self.setup = setup
+        self.params = params if params is not None else [{}]
+        self.repeat = repeat
+
+    @staticmethod
+    def case_name(name, params):
+        if len(params) == 0:
+            return name
+        return "{}[{}]".format(name, ','.join('{}={}'.format(k, v) for k, v in params.items()))
+
+
+def run_benchmarks(benchmarks, pattern=None, verbose=True):
+    """Run benchmarks and collect the results.
+
+    Args:
+        benchmarks: list of Benchmark.
+        pattern: str or None, only run the cases whose name contains the pattern.
+        verbose: boolean, whether to log information.
+
+    Returns:
+        A dict with the environment meta information and the results of all cases.
+    """
+    results = {}
+    for bench in benchmarks:
+        for params in bench.params:
+            case = Benchmark.case_name(bench.name, params)
+            if pattern is not None and pattern not in case:
+                continue
+            fn = bench.setup(**params)
+            result = measure(fn, repeat=bench.repeat)
+            results[case] = {'params': params, **result}
+            if verbose:
+                print("{}: median {:.4f}s, min {:.4f}s, peak memory {:.1f}MB".format(
+                    case, result['median'], result['min'], result.get('peak_memory', 0) / 2 ** 20))
+    return {'meta': environment_meta(), 'results': results}
+
+
+def environment_meta():
+    meta = {'timestamp': datetime.now().isoformat(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+    try:
+        import numpy
+        import pandas
+        import torch
+        meta.update(numpy=numpy.__version__, pandas=pandas.__version__, torch=torch.__version__,
+                    torch_threads=torch.get_num_threads())
+    except ImportError:
+        pass
+    return meta
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline, threshold=0.2, metric='median', memory_threshold=None):
+    """Compare results against a baseline.
+
+    Args:
+        results: dict, the current results from run_benchmarks.
+        baseline: dict, the baseline results from run_benchmarks.
+        threshold: number, the allowed relative slowdown, e.g. 0.2 means 20% slower.
+        metric: str, the timing statistic to compare.
+        memory_threshold: number or None, the allowed relative increase of the peak memory.
+            None means the same as threshold.
+
+    Returns:
+        A list of dicts, one per case measured in both, with the ratios and a regression flag.
+    """
+    if memory_threshold is None:
+        memory_threshold = threshold
+    comparison = []
+    for case, result in results['results'].items():
+        if case not in baseline['results']:
+            continue
+        base = baseline['results'][case]
+        time_ratio = result[metric] / base[metric] if base[metric] > 0 else float('inf')
+        entry = {'case': case, 'time': result[metric], 'baseline_time': base[metric],
+                 'time_ratio': time_ratio, 'regression': time_ratio > 1 + threshold}
+        if result.get('peak_memory') and base.get('peak_memory'):
+            memory_ratio = result['peak_memory'] / base['peak_memory']
+            entry['memory_ratio'] = memory_ratio
+            entry['regression'] = entry['regression'] or memory_ratio > 1 + memory_threshold
+        comparison.append(entry)
+    return comparison
+
+
+def print_comparison(comparison):
+    for entry in comparison:
+        print("{} {}: {:.4f}s vs {:.4f}s ({:+.1f}%){}".format(
+            'REGRESSION' if entry['regression'] else 'ok        ', entry['case'], entry['time'],
+            entry['baseline_time'], (entry['time_ratio'] - 1) * 100,
+            ', memory {:+.1f}%'.format((entry['memory_ratio'] - 1) * 100)
+            if 'memory_ratio' in entry else ''))
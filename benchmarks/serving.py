@@ -0,0 +1,166 @@
+"""Measure the requests per second of the single-process server and the pre-forked workers.
+
+    python -m benchmarks.serving --workers 1 2 4 --clients 8 --duration 10
+
+Each server runs in a forked process, and the given number of clients send requests to one
+endpoint for a fixed duration. Workers 0 is the threaded single-process server (as app.run).
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import timeit
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from werkzeug.serving import make_server
+
+from server.app import create_app
+from server.prefork import PreforkServer, thread_budget
+
+from benchmarks.suites import ENGINE_CONFIG, QUERY_INSTANCE, cleanup, load_model, model_root
+
+ENDPOINTS = {
+    'predict': lambda query: {'queryInstance': query},
+    'counterfactuals': lambda query: {'queryInstance': query, 'cfNum': 3},
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(app, port, workers):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    try:
+        if workers == 0:
+            app.registry.after_fork()
+            make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+        else:
+            PreforkServer(app, '127.0.0.1', port, workers).serve_forever()
+    finally:
+        os._exit(0)
+
+
+def _wait_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url + '/api/health') as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+    raise TimeoutError("The server at {} is not ready.".format(url))
+
+
+def _post(url, body):
+    request = urllib.request.Request(url, data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def load_test(url, body, clients, duration):
+    """Send requests from several client threads for a fixed duration.
+
+    Returns:
+        A dict with the number of requests and errors, the requests per second, and the
+        median and 95th percentile latencies in milliseconds.
+    """
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    deadline = timeit.default_timer() + duration
+
+    def client(i):
+        while True:
+            start = timeit.default_timer()
+            if start > deadline:
+                return
+            try:
+                _post(url, body)
+            except (urllib.error.URLError, ConnectionError):
+                errors[i] += 1
+                continue
+            latencies[i].append(timeit.default_timer() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timeit.default_timer() - start
+    latencies = np.concatenate([np.asarray(lat) for lat in latencies]) * 1000
+    return {'requests': len(latencies), 'errors': sum(errors),
+            'rps': len(latencies) / elapsed,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else None}
+
+
+def benchmark_serving(dataset, endpoint, workers_list, clients, duration):
+    """Run the load test against a server for each number of workers."""
+    load_model(dataset)
+    app = create_app(dict(DATASET=dataset, MODEL='MLP', MODEL_ROOT=model_root(),
+                          ENGINE_CONFIG=ENGINE_CONFIG))
+    body = json.dumps(ENDPOINTS[endpoint](QUERY_INSTANCE[dataset])).encode()
+    results = []
+    for workers in workers_list:
+        port = _free_port()
+        url = 'http://127.0.0.1:{}'.format(port)
+        pid = _start_server(app, port, workers)
+        try:
+            _wait_ready(url)
+            result = load_test('{}/api/{}'.format(url, endpoint), body, clients, duration)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        result.update(workers=workers,
+                      threads_per_worker=thread_budget(workers) if workers > 0 else None)
+        print("workers={workers}: {rps:.1f} req/s, p50={p50_ms:.1f}ms, p95={p95_ms:.1f}ms, "
+              "errors={errors}".format(**result))
+        results.append(result)
+    return results
+
+
+def get_run_args():
+    parser = argparse.ArgumentParser(description="Measure the requests per second of the "
+                                                 "single-process and pre-forked servers.")
+    parser.add_argument('--dataset', default='diabetes', type=str)
+    parser.add_argument('--endpoint', default='predict', choices=list(ENDPOINTS))
+    parser.add_argument('--workers', default=[0, 1, 2, 4], type=int, nargs='+',
+                        help="The numbers of workers to compare, 0 for the single-process "
+                             "server")
+    parser.add_argument('--clients', default=8, type=int)
+    parser.add_argument('--duration', default=10, type=float,
+                        help="The duration of each load test in seconds")
+    parser.add_argument('--output', default=None, type=str,
+                        help="The path to store the results as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = get_run_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    try:
+        results = benchmark_serving(args.dataset, args.endpoint, args.workers, args.clients,
+                                    args.duration)
+    finally:
+        cleanup()
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
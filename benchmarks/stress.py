@@ -0,0 +1,171 @@
+"""Drive the engine and the r-counterfactuals cache from many threads and processes at once.
+
+    python -m benchmarks.stress --threads 8 --processes 4
+
+The threads generate seeded counterfactual examples with per-call configs while another
+thread keeps updating the engine config, and check that the results equal the ones of a
+sequential run. The processes share one model directory and concurrently save and load
+r-counterfactuals, then the cache index (meta.json) is checked for lost or corrupted entries.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cf_ml.cf_engine import CFEnginePytorch
+from cf_ml.model import PytorchModelManager
+
+from benchmarks.suites import ENGINE_CONFIG, load_dataset
+
+
+def _engine(dataset_name, model_root):
+    dataset = load_dataset(dataset_name)
+    model = PytorchModelManager(dataset, root_dir=model_root)
+    model.load_model()
+    return dataset, CFEnginePytorch(dataset, model, ENGINE_CONFIG)
+
+
+def _queries(dataset, n):
+    data = dataset.get_subset(preprocess=False)
+    instances = data.sample(n, replace=True, random_state=0)[dataset.features]
+    return [(instances.iloc[[i]], {'num': 2, 'seed': i}) for i in range(n)]
+
+
+def stress_threads(dataset_name, model_root, threads, queries):
+    """Generate seeded counterfactual examples from several threads while the engine config
+    is updated concurrently, and compare them with a sequential run.
+
+    Returns:
+        A dict with the numbers of queries and mismatches, and the elapsed seconds.
+    """
+    dataset, engine = _engine(dataset_name, model_root)
+    call_config = {'max_iter': ENGINE_CONFIG['max_iter'], 'lr': 0.01}
+    items = _queries(dataset, queries)
+
+    def run(item):
+        X, setting = item
+        return engine.generate_counterfactual_examples(X, setting, verbose=False,
+                                                       config=call_config).all.values
+
+    expected = [run(item) for item in items]
+
+    stop = threading.Event()
+
+    def update_config():
+        rng = np.random.default_rng(0)
+        while not stop.is_set():
+            engine.update_config({'max_iter': int(rng.integers(1, 50)), 'lr': rng.random()})
+
+    updater = threading.Thread(target=update_config, daemon=True)
+    updater.start()
+    start = timeit.default_timer()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(run, items))
+    elapsed = timeit.default_timer() - start
+    stop.set()
+    updater.join()
+
+    mismatches = sum(not np.array_equal(result, expect)
+                     for result, expect in zip(results, expected))
+    return {'queries': len(items), 'mismatches': mismatches, 'seconds': elapsed}
+
+
+def _subset_ranges(dataset, n):
+    feature = dataset.numerical_features[0]
+    info = dataset.description[feature]
+    edges = np.linspace(info['min'], info['max'], n + 1)
+    return [{feature: {'min': float(low), 'max': float(high)}}
+            for low, high in zip(edges[:-1], edges[1:])]
+
+
+def _process_worker(dataset_name, model_root, worker, ranges, rounds):
+    dataset, engine = _engine(dataset_name, model_root)
+    for _ in range(rounds):
+        for subset_range in ranges[worker::2] + ranges:
+            engine.generate_r_counterfactuals(subset_range, use_cache=True, cache=True,
+                                              verbose=False)
+
+
+def stress_processes(dataset_name, model_root, processes, ranges_num, rounds=1):
+    """Generate and cache r-counterfactuals of overlapping subsets from several processes
+    sharing one model directory, and check the cache index afterwards.
+
+    Returns:
+        A dict with the numbers of expected and indexed settings, the numbers of missing and
+        unreadable subset files, and the elapsed seconds.
+    """
+    dataset, engine = _engine(dataset_name, model_root)
+    ranges = _subset_ranges(dataset, ranges_num)
+    ctx = multiprocessing.get_context('spawn')
+    start = timeit.default_timer()
+    workers = [ctx.Process(target=_process_worker,
+                           args=(dataset_name, model_root, worker % 2, ranges, rounds))
+               for worker in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = timeit.default_timer() - start
+
+    model_dir = engine._dir_manager._dir
+    with open(os.path.join(model_dir, 'meta.json')) as f:
+        cf_setting = json.load(f)['cf_setting']
+    missing, unreadable = 0, 0
+    for index in range(len(cf_setting)):
+        path = os.path.join(model_dir, 'subset_{}.csv'.format(index))
+        if not os.path.exists(path):
+            missing += 1
+            continue
+        try:
+            pd.read_csv(path)
+        except Exception:
+            unreadable += 1
+    # one setting per subset and distinct range of the released features
+    expected = sum(len({json.dumps({k: v for k, v in subset_range.items() if k != feature},
+                                   sort_keys=True) for feature in dataset.features})
+                   for subset_range in ranges)
+    return {'expected_settings': expected, 'settings': len(cf_setting), 'missing': missing,
+            'unreadable': unreadable, 'failed_workers': sum(w.exitcode != 0 for w in workers),
+            'seconds': elapsed}
+
+
+def get_run_args():
+    parser = argparse.ArgumentParser(description="Stress the engine and the r-counterfactuals "
+                                                 "cache with concurrent threads and processes.")
+    parser.add_argument('--dataset', default='diabetes', type=str)
+    parser.add_argument('--threads', default=8, type=int)
+    parser.add_argument('--queries', default=32, type=int)
+    parser.add_argument('--processes', default=4, type=int)
+    parser.add_argument('--subsets', default=4, type=int,
+                        help="The number of subsets cached by the processes")
+    return parser.parse_args()
+
+
+def main():
+    args = get_run_args()
+    model_root = tempfile.mkdtemp(prefix='dece-stress-')
+    model = PytorchModelManager(load_dataset(args.dataset), root_dir=model_root)
+    model.train(epoch=5, batch_size=256, verbose=False)
+    model.save_model()
+
+    threads = stress_threads(args.dataset, model_root, args.threads, args.queries)
+    print("threads: {}".format(threads))
+    processes = stress_processes(args.dataset, model_root, args.processes, args.subsets)
+    print("processes: {}".format(processes))
+
+    if threads['mismatches'] > 0 or processes['failed_workers'] > 0 or \
+            processes['settings'] != processes['expected_settings'] or \
+            processes['missing'] > 0 or processes['unreadable'] > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import functools
+import shutil
+import tempfile
+
+from cf_ml.dataset import load_diabetes_dataset, load_german_credit_dataset, \
+    load_synthetic_dataset
+from cf_ml.model import PytorchModelManager, SklearnModelManager
+from cf_ml.cf_engine import CFEngineGenetic, CFEnginePytorch
+
+from benchmarks.runner import Benchmark
+
+# The engine runs with fewer iterations than DEFAULT_CONFIG so that a case takes seconds.
+ENGINE_CONFIG = {'min_iter': 100, 'max_iter': 300, 'project_frequency': 100}
+
+# the temporary directory of the benchmark models, created on first use
+_model_root = None
+
+QUERY_INSTANCE = {
+    'diabetes': [6, 148, 72, 35, 0, 33.6, 0.627, 50],
+    'german-credit': [67, 'male', '2', 'own', 'unknown', 'little', 1169, 6, 'radio/TV'],
+}
+
+
+def model_root():
+    """Get the temporary directory of the benchmark models, which is created on first use."""
+    global _model_root
+    if _model_root is None:
+        _model_root = tempfile.mkdtemp(prefix='dece-bench-')
+    return _model_root
+
+
+def cleanup():
+    """Remove the temporary directory of the benchmark models and forget the loaded models."""
+    global _model_root
+    load_model.cache_clear()
+    load_sklearn_model.cache_clear()
+    if _model_root is not None:
+        shutil.rmtree(_model_root, ignore_errors=True)
+        _model_root = None
+
+
+@functools.lru_cache(maxsize=None)
+def load_dataset(name):
+    """Load a bundled dataset by name, or a synthetic variant named '<base>@<rows>' or
+    '<base>@<rows>x<features>'."""
+    if '@' in name:
+        base, size = name.split('@')
+        n, _, n_features = size.partition('x')
+        return load_synthetic_dataset(base, int(n), int(n_features) if n_features else None)
+    if name == 'diabetes':
+        return load_diabetes_dataset()
+    elif name == 'german-credit':
+        return load_german_credit_dataset()
+    else:
+        raise NotImplementedError
+
+
+@functools.lru_cache(maxsize=None)
+def load_model(dataset_name, epoch=5):
+    """Train a model on a dataset for a few epochs and store it in a temporary directory."""
+    model = PytorchModelManager(load_dataset(dataset_name), root_dir=model_root())
+    model.train(epoch=epoch, batch_size=256, verbose=False)
+    model.save_model()
+    return model
+
+
+@functools.lru_cache(maxsize=None)
+def load_sklearn_model(dataset_name):
+    """Fit a gradient-boosted trees model on a dataset and store it in a temporary directory."""
+    model = SklearnModelManager(load_dataset(dataset_name), root_dir=model_root())
+    model.train(verbose=False)
+    model.save_model()
+    return model
+
+
+def _sample(dataset, rows):
+    data = dataset.get_subset(preprocess=False)
+    return data.sample(min(rows, len(data)), replace=False, random_state=0)
+
+
+def bench_preprocess(dataset='diabetes', rows=1000):
+    dataset = load_dataset(dataset)
+    X = _sample(dataset, rows)[dataset.features]
+    return lambda: dataset.preprocess_X(X)
+
+
+def bench_inverse_preprocess(dataset='diabetes', rows=1000):
+    dataset = load_dataset(dataset)
+    X = dataset.preprocess_X(_sample(dataset, rows)[dataset.features])
+    return lambda: dataset.inverse_preprocess_X(X)
+
+
+def bench_counterfactuals(dataset='diabetes', rows=64, num=1, k=-1, batch_size=1024):
+    data = load_dataset(dataset)
+    engine = CFEnginePytorch(data, load_model(dataset),
+                             {**ENGINE_CONFIG, 'batch_size': batch_size})
+    X = _sample(data, rows)[data.features]
+    return lambda: engine.generate_counterfactual_examples(X, setting={'num': num, 'k': k},
+                                                           verbose=False)
+
+
+def bench_genetic_counterfactuals(dataset='diabetes', model='GBT', rows=64, num=1, k=-1):
+    data = load_dataset(dataset)
+    manager = load_sklearn_model(dataset) if model == 'GBT' else load_model(dataset)
+    engine = CFEngineGenetic(data, manager, ENGINE_CONFIG)
+    X = _sample(data, rows)[data.features]
+    return lambda: engine.generate_counterfactual_examples(X, setting={'num': num, 'k': k},
+                                                           verbose=False)
+
+
+def bench_r_counterfactuals(dataset='diabetes'):
+    data = load_dataset(dataset)
+    engine = CFEnginePytorch(data, load_model(dataset), ENGINE_CONFIG)
+    feature = data.numerical_features[0]
+    info = data.description[feature]
+    subset_range = {feature: {'min': info['min'], 'max': (info['min'] + info['max']) / 2}}
+    return lambda: engine.generate_r_counterfactuals(subset_range, use_cache=False, cache=False,
+                                                     verbose=False)
+
+
+def bench_report(dataset='diabetes', rows=1000):
+    data = load_dataset(dataset)
+    model = load_model(dataset)
+    instances = _sample(data, rows)
+    return lambda: model.report(instances[data.features], instances[data.target])
+
+
+def bench_evaluate(dataset='diabetes'):
+    model = load_model(dataset)
+    return lambda: model.evaluate('train')
+
+
+def bench_api(endpoint='predict', dataset='diabetes'):
+    from server.app import create_app
+
+    load_model(dataset)
+    app = create_app(dict(DATASET=dataset, MODEL='MLP', MODEL_ROOT=model_root(),
+                          ENGINE_CONFIG=ENGINE_CONFIG))
+    client = app.test_client()
+    query = QUERY_INSTANCE[dataset]
+
+    if endpoint == 'data':
+        return lambda: client.get('/api/data')
+    elif endpoint == 'data_meta':
+        return lambda: client.get('/api/data_meta')
+    elif endpoint == 'predict':
+        return lambda: client.post('/api/predict', json={'queryInstance': query})
+    elif endpoint == 'counterfactuals':
+        return lambda: client.post('/api/counterfactuals',
+                                   json={'queryInstance': query, 'cfNum': 3})
+    elif endpoint == 'r_counterfactuals':
+        data = load_dataset(dataset)
+        feature = data.numerical_features[0]
+        info = data.description[feature]
+        filters = [{'name': feature, 'extent': [info['min'], (info['min'] + info['max']) / 2]}]
+        return lambda: client.post('/api/r_counterfactuals', json={'filters': filters})
+    else:
+        raise NotImplementedError
+
+
+def bench_predict(dataset='diabetes', rows=1000, precision=None):
+    data = load_dataset(dataset)
+    load_model(dataset)
+    model = PytorchModelManager(data, root_dir=model_root(), inference_precision=precision)
+    model.load_model()
+    X = data.preprocess_X(_sample(data, rows)[data.features]).values
+    return lambda: model.predict(X)
+
+
+def build_benchmarks(profile='quick'):
+    """Build the benchmark cases.
+
+    Args:
+        profile: 'quick' or 'full'. The quick profile runs on the bundled datasets and a small
+            synthetic variant, the full profile also on synthetic variants up to 1M rows and
+            with hundreds of features.
+    """
+    datasets = ['diabetes', 'german-credit', 'diabetes@10000']
+    large_datasets = ['diabetes@10000']
+    sizes = [100, 1000]
+    if profile == 'full':
+        datasets += ['diabetes@1000000', 'german-credit@100000x200']
+        large_datasets += ['diabetes@1000000', 'german-credit@100000x200']
+        sizes += [10000, 100000]
+    elif profile != 'quick':
+        raise ValueError("Unknown benchmark profile: {}".format(profile))
+
+    transform_params = [{'dataset': d, 'rows': r} for d in datasets for r in sizes]
+    cf_params = [{'dataset': d, 'rows': 64, 'num': num, 'k': k, 'batch_size': 1024}
+                 for d in ['diabetes', 'german-credit'] for num in [1, 4] for k in [-1, 2]]
+    cf_params += [{'dataset': d, 'rows': rows, 'num': 1, 'k': -1, 'batch_size': batch_size}
+                  for d in large_datasets for rows in sizes for batch_size in [256, 1024]]
+    endpoints = ['data', 'data_meta', 'predict', 'counterfactuals', 'r_counterfactuals']
+
+    return [
+        Benchmark('preprocess_X', bench_preprocess, transform_params),
+        Benchmark('inverse_preprocess_X', bench_inverse_preprocess, transform_params),
+        Benchmark('generate_counterfactual_examples', bench_counterfactuals, cf_params,
+                  repeat=1),
+        Benchmark('genetic_counterfactual_examples', bench_genetic_counterfactuals,
+                  [{'dataset': d, 'model': m, 'rows': 64, 'num': num, 'k': k}
+                   for d in ['diabetes', 'german-credit'] for m in ['GBT', 'MLP']
+                   for num in [1, 4] for k in [-1, 2]], repeat=1),
+        Benchmark('generate_r_counterfactuals', bench_r_counterfactuals,
+                  [{'dataset': d} for d in ['diabetes', 'german-credit']], repeat=1),
+        Benchmark('report', bench_report, transform_params),
+        Benchmark('predict', bench_predict, [{**params, 'precision': precision}
+                                             for params in transform_params
+                                             for precision in [None, 'int8', 'bfloat16']]),
+        Benchmark('evaluate', bench_evaluate, [{'dataset': d} for d in datasets]),
+        Benchmark('api', bench_api, [{'endpoint': e, 'dataset': d} for e in endpoints
+                                     for d in ['diabetes', 'german-credit']]),
+    ]
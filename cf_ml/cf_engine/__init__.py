@@ -1,2 +1,5 @@
-from cf_ml.cf_engine.counterfactual import CounterfactualExample, CounterfactualExampleBySubset
+from cf_ml.cf_engine.counterfactual import CounterfactualExample, CounterfactualExampleBySubset, \
+    SpilledCounterfactualExample
 from cf_ml.cf_engine.engine import CFEnginePytorch, DEFAULT_SETTING
+from cf_ml.cf_engine.genetic import CFEngineGenetic
+from cf_ml.cf_engine.summary import summarize_counterfactuals, summarize_r_counterfactuals
@@ -0,0 +1,94 @@
+import json
+import os
+import platform
+import threading
+
+from cf_ml.utils.dir_manager import atomic_write
+
+CANDIDATES = (16, 64, 256, 1024, 4096)
+
+
+class BatchSizeTuner:
+    """A class to choose the batch size of the engine from the throughput (rows per second) and
+    the peak memory measured on a few candidate batch sizes.
+
+    The results are cached per key (see key), and persisted to a JSON file if a path is given.
+
+    Args:
+        path: str or None, the JSON file to persist the tuned batch sizes.
+        candidates: list, the candidate batch sizes in ascending order.
+    """
+
+    def __init__(self, path=None, candidates=CANDIDATES):
+        self._path = path
+        self._candidates = sorted(candidates)
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except ValueError:
+                self._entries = {}
+
+    @staticmethod
+    def key(fingerprint, num):
+        """Get the cache key of a model (by its fingerprint) and num on this host."""
+        return '{}-{}-{}-{}'.format(platform.node(), os.cpu_count(), fingerprint, num)
+
+    def get(self, key, rows):
+        """Get the tuned entry of a key, or None if it has not been tuned for a job of the given
+        number of rows: when the best measured batch size was the largest one measured, and
+        larger candidates fit the job now."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        measured = max(c['batch_size'] for c in entry['candidates'])
+        if entry['batch_size'] == measured and entry.get('limited') is None and \
+                self._admissible(rows)[-1] > measured:
+            return None
+        return entry
+
+    def _admissible(self, rows):
+        candidates = [c for c in self._candidates if c <= rows]
+        return candidates if candidates else self._candidates[:1]
+
+    def tune(self, key, rows, measure, memory_limit=None):
+        """Measure the candidate batch sizes up to the number of rows and cache the best one.
+
+        Args:
+            key: str, the cache key.
+            rows: number, the number of rows of the job.
+            measure: callable, receives a batch size and returns (seconds, peak memory in
+                bytes) of one batch.
+            memory_limit: number or None, the maximal peak memory of a batch. Larger batch sizes
+                are not measured once a batch exceeds it.
+
+        Returns:
+            A dict with the batch size, its rows per second and peak memory, and the
+            measurements of all candidates.
+        """
+        results = []
+        limited = None
+        for batch_size in self._admissible(rows):
+            seconds, peak = measure(batch_size)
+            results.append({'batch_size': batch_size, 'rows_per_second': batch_size / seconds,
+                            'peak_memory': peak})
+            if memory_limit is not None and peak > memory_limit:
+                limited = memory_limit
+                break
+        fitting = [r for r in results if memory_limit is None or r['peak_memory'] <= memory_limit]
+        best = max(fitting or results[:1], key=lambda r: r['rows_per_second'])
+        entry = {**best, 'limited': limited, 'candidates': results}
+        with self._lock:
+            self._entries[key] = entry
+            if self._path is not None:
+                content = json.dumps(self._entries)
+
+                def write(path):
+                    with open(path, 'w') as f:
+                        f.write(content)
+
+                atomic_write(self._path, write)
+        return entry
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+class BufferPool:
+    """A class to reuse the arrays of the engine across batches.
+
+    Each buffer is identified by a name, and is allocated for the largest batch requested so
+    far. A request returns a view of the first rows of the buffer, so that the steady state of a
+    long job, where all batches but the last have the same size, does no large allocations.
+    The float32 buffers are shared with torch by torch.from_numpy without a copy.
+
+    A pool must not be shared by concurrent calls: the engine keeps one per thread.
+
+    Args:
+        reuse: boolean, whether to reuse the buffers. If False, every request allocates a new
+            array, which is the behavior without a pool.
+    """
+
+    def __init__(self, reuse=True):
+        self.reuse = reuse
+        self._buffers = {}
+        self.allocations = 0
+        self.allocated_bytes = 0
+
+    def get(self, name, shape, dtype=np.float32):
+        """Get an uninitialized array of the given shape and dtype.
+
+        Args:
+            name: str, the name of the buffer. The array returned by the previous request of
+                the same name is overwritten by the next user of the buffer.
+            shape: tuple, the shape of the array, the first dimension is the number of rows.
+            dtype: np.dtype, the dtype of the array.
+
+        Returns:
+            A C-contiguous np.ndarray.
+        """
+        shape = tuple(shape)
+        buffer = self._buffers.get(name) if self.reuse else None
+        if buffer is None or buffer.dtype != dtype or buffer.shape[1:] != shape[1:] \
+                or len(buffer) < shape[0]:
+            buffer = np.empty(shape, dtype=dtype)
+            self.allocations += 1
+            self.allocated_bytes += buffer.nbytes
+            if self.reuse:
+                self._buffers[name] = buffer
+        return buffer[:shape[0]]
+
+    @property
+    def nbytes(self):
+        """The memory held by the pool in bytes."""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self):
+        """Release the buffers."""
+        self._buffers = {}
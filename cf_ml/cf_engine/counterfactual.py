@@ -1,3 +1,7 @@
+import os
+import tempfile
+import weakref
+
 import pandas as pd
 
 
@@ -32,6 +36,72 @@ class CounterfactualExample:
         return self._cfs.loc[index, :]
 
 
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class SpilledCounterfactualExample(CounterfactualExample):
+    """A class to store counterfactual examples in pickle files instead of memory.
+
+    The examples are stored in parts, which are read back on each access of all, valid or
+    invalid, once per access. valid and invalid filter the parts one at a time, and parts
+    reads them back one at a time. The files are removed with the object.
+
+    Args:
+        data_meta: dict, the meta of the dataset.
+        cfs: pd.DataFrame or None, the counterfactual examples.
+        spill_dir: str or None, the directory of the files, the temporary directory if None.
+    """
+
+    def __init__(self, data_meta, cfs=None, spill_dir=None):
+        self._spill_dir = spill_dir
+        self._paths = []
+        weakref.finalize(self, _remove_files, self._paths)
+        super(SpilledCounterfactualExample, self).__init__(data_meta, cfs)
+
+    def append(self, cfs):
+        """Store a part of the counterfactual examples."""
+        fd, path = tempfile.mkstemp(prefix='cfs-', suffix='.pkl', dir=self._spill_dir)
+        os.close(fd)
+        self._paths.append(path)
+        cfs.to_pickle(path)
+
+    def parts(self):
+        """Iterate over the stored parts of the counterfactual examples."""
+        for path in self._paths:
+            yield pd.read_pickle(path)
+
+    def _concat(self, parts):
+        parts = list(parts)
+        if len(parts) == 0:
+            return pd.DataFrame(columns=self._features + [self._target, self._prediction])
+        return pd.concat(parts) if len(parts) > 1 else parts[0]
+
+    @property
+    def _cfs(self):
+        return self._concat(self.parts())
+
+    @property
+    def valid(self):
+        # filter each part as it is read instead of reading all parts for each comparison
+        return self._concat(part[part[self._target] == part[self._prediction]]
+                            for part in self.parts())
+
+    @property
+    def invalid(self):
+        return self._concat(part[part[self._target] != part[self._prediction]]
+                            for part in self.parts())
+
+    @_cfs.setter
+    def _cfs(self, cfs):
+        _remove_files(self._paths)
+        del self._paths[:]
+        if len(cfs) > 0:
+            self.append(cfs)
+
+
 class CounterfactualExampleBySubset:
     """A class to store counterfactual examples to a subset of instances"""
 
@@ -2,14 +2,27 @@ import numpy as np
 import pandas as pd
 from scipy.special import softmax
 import timeit
-import math
 import copy
+import contextlib
+import functools
+import inspect
+import threading
+import tracemalloc
+from types import MappingProxyType
 
 import torch
 from torch import nn
 import torch.optim as optim
 
-from cf_ml.cf_engine import CounterfactualExample, CounterfactualExampleBySubset
+from cf_ml.cf_engine import CounterfactualExample, CounterfactualExampleBySubset, \
+    SpilledCounterfactualExample
+from cf_ml.cf_engine.autotune import BatchSizeTuner, CANDIDATES
+from cf_ml.cf_engine.buffers import BufferPool
+from cf_ml.cf_engine.compiled import compile_step
+from cf_ml.utils.instrument import make_instrument, NULL_INSTRUMENT
+from cf_ml.utils.memory import available_memory, current_rss, peak_rss, reset_peak_rss, \
+    PEAK_RSS_LOCK
+from cf_ml.utils.profiler import Profiler
 
 DEFAULT_SETTING = {
     'k': -1,
@@ -32,9 +45,89 @@ DEFAULT_CONFIG = {
     'batch_size': 1024,
     'loss_diff': 1e-5,
     "refine_with_topk": -1,
-    'perturbation': 'unit'
+    'perturbation': 'unit',
+    'profile': False,
+    'compile_step': False,
+    'memory_budget': None,
+    'spill_dir': None,
+    'reuse_buffers': True
 }
 
+# the estimated number of float32 copies of an expanded row alive while a batch is optimized
+# (originals, counterfactuals, gradients, masks, bounds and the frames of the refinement)
+ROW_COPIES = 16
+
+# the number of iterations of the trial batches which measure the throughput of a batch size
+TUNING_ITER = 20
+
+# with a memory budget, the number of instances of the first batch, on which the memory of an
+# instance is measured before larger batches run
+PROBE_ROWS = 64
+
+
+def profiled(method):
+    """Profile an engine method if the 'profile' config, or the 'config' argument of the call,
+    sets it."""
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        config = signature.bind(self, *args, **kwargs).arguments.get('config')
+        with self._pinned_config(config) as pinned:
+            if not pinned['profile']:
+                return method(self, *args, **kwargs)
+            with Profiler(self._dir_manager.profile_dir, method.__name__):
+                return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class _Reports:
+    """The reports of the batches of a call. With a memory budget, they are spilled to a
+    cf_engine.SpilledCounterfactualExample whenever the reports in memory exceed half of it,
+    and the result of the call stays on disk.
+
+    Args:
+        data_meta: dict, the meta of the dataset.
+        budget: number or None, the memory budget of the call in bytes.
+        spill_dir: str or None, the directory of the spilled reports.
+        instrument: utils.instrument.Instrument, counts the spills.
+    """
+
+    def __init__(self, data_meta, budget=None, spill_dir=None, instrument=NULL_INSTRUMENT):
+        self._data_meta = data_meta
+        self._budget = budget
+        self._spill_dir = spill_dir
+        self._instrument = instrument
+        self._reports = []
+        self._bytes = 0
+        self._spilled = None
+
+    def append(self, report):
+        self._reports.append(report)
+        if self._budget is None:
+            return
+        self._bytes += int(report.memory_usage(deep=True).sum())
+        if self._bytes > self._budget / 2:
+            self._spill()
+
+    def _spill(self):
+        if self._spilled is None:
+            self._spilled = SpilledCounterfactualExample(self._data_meta,
+                                                         spill_dir=self._spill_dir)
+        self._spilled.append(pd.concat(self._reports))
+        self._reports, self._bytes = [], 0
+        self._instrument.count('spills')
+
+    def result(self):
+        """Get the counterfactual examples of the call, which are on disk if any report has
+        been spilled."""
+        if self._spilled is None:
+            return CounterfactualExample(self._data_meta, pd.concat(self._reports))
+        if self._reports:
+            self._spill()
+        return self._spilled
+
 
 class CFEnginePytorch:
     """A class to generate counterfactual examples.
@@ -53,16 +146,37 @@ class CFEnginePytorch:
             project_frequency: number, frequency of applying tensor clipping and reloading 
                 in the optimization procedure;
             post_steps: number, the number of maximal iterations in the refinement procedure;
-            batch_size: number, the size of the mini-batch;
+            batch_size: number or 'auto', the number of instances of the mini-batch. 'Auto' picks
+                the batch size with the best throughput among a few candidates, measured on the
+                first instances once per model and num (see autotune.BatchSizeTuner), and
+                halves it when the available memory runs low;
             loss_diff: number, the minimal loss difference for an early stop of the optimization;
             refine_with_topk: number, the number of features to update in one iteration 
                 in the refinement procedure.
             perturbation: 'unit', 'random' or 'none', method used to perturb the dummy features. 
+            profile: boolean, whether to store a torch.profiler trace and a cProfile dump of each
+                call in the profile directory of the model.
+            compile_step: False or 'script' (or True), whether to run each optimization step
+                (forward, loss, masked gradient and update) as one module compiled by
+                torch.jit.script, see compiled.compile_step.
+            memory_budget: number or None, the memory budget of a call in bytes. Half of it
+                bounds the batch size by the footprint of a row, estimated and then measured on
+                a first batch of PROBE_ROWS instances. The finished counterfactual examples are
+                spilled to disk when they exceed the other half, and the call then returns a
+                cf_engine.SpilledCounterfactualExample;
+            spill_dir: str or None, the directory of the spilled counterfactual examples, the
+                temporary directory if None;
+            reuse_buffers: boolean, whether to fill the batch arrays (original instances,
+                targets and initial counterfactual examples) in buffers reused across batches
+                and calls of a thread, see buffers.BufferPool.
+        collector: utils.instrument.Collector or None, the collector of the per-phase timing and
+            counters of each run. None disables the instrumentation.
     """
 
-    def __init__(self, dataset, model_manager, config=None):
+    def __init__(self, dataset, model_manager, config=None, collector=None):
         self._dataset = dataset
         self._mm = model_manager
+        self._collector = collector
         self._dir_manager = self._mm.dir_manager
         self._desc = self._dataset.description
         self._data_meta = self._dir_manager.dataset_meta
@@ -72,7 +186,14 @@ class CFEnginePytorch:
         self._columns = self._features + [self._target, self._prediction]
         if config is None:
             config = DEFAULT_CONFIG
-        self._config = {**DEFAULT_CONFIG, **config}
+        self._base_config = MappingProxyType({**DEFAULT_CONFIG, **config})
+        self._call = threading.local()
+        self._compiled_steps = {}
+        self._compile_lock = threading.Lock()
+        self._tuner = BatchSizeTuner(self._dir_manager.tuning_path)
+
+        self._num_mask = self._gradient_mask(self._dataset.numerical_features)
+        self._cat_mask = self._gradient_mask(self._dataset.categorical_features)
 
         self._index_of_num_features = [i for i, f in enumerate(self._dataset.features) if
                                        self._dataset.is_num(f)]
@@ -85,10 +206,34 @@ class CFEnginePytorch:
             [min_scales[col] if col in min_scales else 0 for col in self._dataset.features])
 
     def update_config(self, new_config):
-        self._config = {**self._config, **new_config}
-
+        """Replace the engine config. Running calls keep the config they started with."""
+        self._base_config = MappingProxyType({**self._base_config, **new_config})
+
+    @property
+    def config(self):
+        return dict(self._base_config)
+
+    @property
+    def _config(self):
+        """The config of the running call in this thread, or the engine config."""
+        config = getattr(self._call, 'config', None)
+        return config if config is not None else self._base_config
+
+    @contextlib.contextmanager
+    def _pinned_config(self, config=None):
+        """Pin the config of a call in this thread, with optional overrides, so that the call
+        is not affected by concurrent update_config calls."""
+        previous = getattr(self._call, 'config', None)
+        base = previous if previous is not None else self._base_config
+        self._call.config = MappingProxyType({**base, **config}) if config else base
+        try:
+            yield self._call.config
+        finally:
+            self._call.config = previous
+
+    @profiled
     def generate_r_counterfactuals(self, subset_range=None, use_cache=True, cache=True,
-                                   verbose=True):
+                                   verbose=True, config=None):
         """Generate r-counterfactuals (subgroup counterfactuals).
 
         Args:
@@ -97,17 +242,57 @@ class CFEnginePytorch:
             use_cache: boolean, whether to use the cached the r-counterfactuals if exists.
             cache: boolean, whether to restore the r-counterfactuals.
             verbose: boolean, whether to log information.
+            config: dict or None, the config of this call, which overrides the engine config.
 
         Returns:
             A cf_engine.CounterfactualExampleBySubset object storing r-counterfactuals.
         """
         subset_range = subset_range if subset_range is not None else {}
-        cf_range = copy.deepcopy(subset_range)
         subset = self._dataset.get_subset(filters=subset_range, preprocess=False)
-        X = subset[self._dataset.features]
 
         r_counterfactuals = CounterfactualExampleBySubset(self._data_meta, subset_range, subset)
-        for feature in self._dataset.features:
+        with self._pinned_config(config) as pinned_config:
+            budget, spill_dir = pinned_config['memory_budget'], pinned_config['spill_dir']
+        held = 0
+        for feature, subset_cf in self.iter_r_counterfactuals(subset_range, use_cache, cache,
+                                                              verbose, subset, config=config):
+            # with a memory budget, the subsets are kept on disk once they exceed half of it
+            if budget is not None and not isinstance(subset_cf, SpilledCounterfactualExample):
+                held += int(subset_cf.all.memory_usage(deep=True).sum())
+                if held > budget / 2:
+                    subset_cf = SpilledCounterfactualExample(self._data_meta, subset_cf.all,
+                                                             spill_dir)
+            r_counterfactuals.append_counterfactuals(feature, subset_cf)
+        return r_counterfactuals
+
+    def iter_r_counterfactuals(self, subset_range=None, use_cache=True, cache=True,
+                               verbose=True, subset=None, features=None, config=None):
+        """Generate r-counterfactuals (subgroup counterfactuals) feature by feature.
+
+        Args:
+            subset_range: dict, keys are feature names and values are the min/max/(allowed) 
+                categories of the counterfactual examples' feature values.
+            use_cache: boolean, whether to use the cached the r-counterfactuals if exists.
+            cache: boolean, whether to restore the r-counterfactuals.
+            verbose: boolean, whether to log information.
+            subset: pd.DataFrame or None, the instances in the subset if already selected.
+            features: list or None, the features whose range is released, all if None.
+            config: dict or None, the config of this call, which overrides the engine config.
+
+        Yields:
+            (feature, cf_engine.CounterfactualExample) for each feature, where the range of
+            the feature is released.
+        """
+        # the config is pinned when the generator starts, not at each feature
+        with self._pinned_config(config) as pinned_config:
+            config = dict(pinned_config)
+        subset_range = subset_range if subset_range is not None else {}
+        cf_range = copy.deepcopy(subset_range)
+        if subset is None:
+            subset = self._dataset.get_subset(filters=subset_range, preprocess=False)
+        X = subset[self._dataset.features]
+
+        for feature in (features if features is not None else self._dataset.features):
             by_feature_cf_range = {k: v for k, v in cf_range.items() if k != feature}
             if use_cache and self._dir_manager.include_setting(subset_range, by_feature_cf_range):
                 subset_cf = CounterfactualExample(self._data_meta,
@@ -119,16 +304,16 @@ class CFEnginePytorch:
                         len(subset_cf.valid) / len(subset_cf.all)))
             else:
                 subset_cf = self.generate_counterfactual_examples(X, setting={
-                    'cf_range': by_feature_cf_range}, verbose=verbose)
+                    'cf_range': by_feature_cf_range}, verbose=verbose, config=config)
 
             if cache:
                 self._dir_manager.save_subset_cf(subset_range, by_feature_cf_range, subset_cf.all)
 
-            r_counterfactuals.append_counterfactuals(feature, subset_cf)
-        return r_counterfactuals
+            yield feature, subset_cf
 
+    @profiled
     def generate_counterfactual_examples(self, X, setting=None, preprocess=True,
-                                         verbose=True):
+                                         verbose=True, config=None):
         """Generate counterfactual explanations to the given preprocessed data.
 
         Args:
@@ -143,61 +328,166 @@ class CFEnginePytorch:
                 desired_class: list, np.array, or 'opposite', target classes of the counterfactual 
                     examples. 'Opposite' means that the target classes are the opposite ones to 
                     the predictions from the original instances in a bi-classification problem.
+                seed: number (optional), the seed of the random initialization, which makes
+                    the counterfactual examples deterministic.
             verbose: boolean, whether to log information.
+            config: dict or None, the config of this call, which overrides the engine config.
 
         Returns:
             A cf_engine.CounterfactualExample object storing counterfactual examples.
         """
+        with self._pinned_config(config):
+            return self._generate_counterfactual_examples(X, setting, preprocess, verbose)
+
+    def resolve_batch_size(self, X, setting=None, preprocess=True, config=None):
+        """Get the number of instances of the mini-batches of a call: the configured batch
+        size, or the tuned one if it is 'auto' (tuned on X if it has not been yet), bounded by
+        the memory budget.
+
+        Args:
+            X: pd.DataFrame data-input-like, feature values of the target data
+            setting: dict, see generate_counterfactual_examples.
+            preprocess: boolean, whether to preprocess the target data
+            config: dict or None, the config of the call, which overrides the engine config.
+
+        Returns:
+            A number.
+        """
+        if setting is None:
+            setting = DEFAULT_SETTING
+        with self._pinned_config(config):
+            if preprocess and self._config['batch_size'] == 'auto':
+                X = self._dataset.preprocess_X(X)
+            return self._batch_size(X, setting)[0]
+
+    def _batch_size(self, X, setting, instrument=NULL_INSTRUMENT):
+        """Get the batch size of a call, and the estimated memory of an instance in bytes
+        (None if neither the batch size is tuned nor the memory is budgeted)."""
+        batch_size = self._config['batch_size']
+        row_bytes = None
+        if batch_size == 'auto':
+            with instrument.phase('autotune'):
+                batch_size, row_bytes = self._auto_batch_size(X, setting)
+            instrument.tag(batch_size=batch_size)
+        budget = self._config['memory_budget']
+        if budget is not None:
+            if row_bytes is None:
+                row_bytes = self._row_footprint(setting.get('num', DEFAULT_SETTING['num']))
+            batch_size = max(1, min(batch_size, int(budget / 2 // row_bytes)))
+            instrument.tag(batch_size=batch_size)
+        return batch_size, row_bytes
+
+    def _generate_counterfactual_examples(self, X, setting, preprocess, verbose):
         if setting is None:
             setting = DEFAULT_SETTING
         batch_size = self._config["batch_size"]
         n = setting.get('num', DEFAULT_SETTING['num'])
         k = setting.get('k', DEFAULT_SETTING['k'])
+        # the trial batches of the batch size tuner are not recorded
+        collector = None if getattr(self._call, 'tuning', False) else self._collector
+        instrument = make_instrument(collector, 'generate_counterfactual_examples',
+                                     num=n, k=k, batch_size=batch_size)
 
-        if preprocess:
-            X = self._dataset.preprocess_X(X)
+        with instrument.phase('preprocess'):
+            if preprocess:
+                X = self._dataset.preprocess_X(X)
 
         data_num = len(X)
-        if_sparse = self._if_sparse(setting)
-        weights = self._feature_weights()
-        min_values = self._generate_min_array(setting)
-        max_values = self._generate_max_array(setting)
-        reports = []
+        instrument.tag(rows=data_num)
+        batch_size, row_bytes = self._batch_size(X, setting, instrument)
+        budget = self._config['memory_budget']
+        # each call has its own generator, never the global np.random state
+        rng = np.random.default_rng(setting.get('seed'))
+        with instrument.phase('mask'):
+            if_sparse = self._if_sparse(setting)
+            weights = self._feature_weights()
+            min_values = self._generate_min_array(setting)
+            max_values = self._generate_max_array(setting)
+            # the gradient mask of the setting, replaced per batch if sparsity is required
+            setting_mask = self._gradient_mask_by_setting(setting)
+        pool = self._buffer_pool()
+        allocations = pool.allocations
+        # the allocations of a batch are measured if tracemalloc is tracing
+        trace = instrument.enabled and tracemalloc.is_tracing()
+        X_values = X.values
+        reports = _Reports(self._data_meta, budget, self._config['spill_dir'], instrument)
+        job_rss = current_rss()
+
+        def sample_rss(peak):
+            rss = current_rss()
+            return peak if rss is None or peak is None else max(peak, rss)
 
         # start generating
-        for batch_num in range(math.ceil(data_num / batch_size)):
+        batch_num, start_id = 0, 0
+        while start_id < data_num:
             checkpoint = timeit.default_timer()
-            start_id = batch_num * batch_size
-            end_id = min(batch_num * batch_size + batch_size, len(X))
-
-            # generate the gradient mask according the setting
-            mask = self._gradient_mask_by_setting(setting)
+            if row_bytes is not None:
+                batch_size = self._shrink_batch_size(batch_size, row_bytes, instrument)
+            # with a budget, the memory of an instance is measured on a small first batch
+            rows = min(batch_size, PROBE_ROWS) if budget is not None and batch_num == 0 \
+                else batch_size
+            end_id = min(start_id + rows, data_num)
+            batch_rss = current_rss()
+            batch_peak = batch_rss
+            if trace:
+                tracemalloc.reset_peak()
+                traced = tracemalloc.get_traced_memory()[0]
+            mask = setting_mask
 
             # init counterfactual values and targets
-            original_X = self._expand_array(X.iloc[start_id: end_id].values, setting)
-            targets = self._target_array(original_X, setting)
+            with instrument.phase('preprocess'):
+                original_X = self._expand_array(X_values[start_id: end_id], setting, pool)
+                targets = self._target_array(original_X, setting, pool)
+                instrument.count('forward')
 
             # STEP-0: select top-k important features and update the mask if sparsity is required
             if if_sparse:
-                inited_cfs = self._init_cfs(original_X, setting, mask)
-                cfs, _, loss, iter = self._optimize(inited_cfs, original_X, targets, mask, n,
-                                                    weights, min_values, max_values)
-                top_k_features = self._topk_features(cfs, original_X, k)
-                # update the mask with the top-k important feaures
-                mask = np.array(
-                    [self._gradient_mask_by_setting(setting, top_k) for top_k in top_k_features])
+                with instrument.phase('topk'):
+                    inited_cfs = self._init_cfs(original_X, setting, mask, rng, pool)
+                    cfs, _, loss, iter = self._optimize(inited_cfs, original_X, targets, mask, n,
+                                                        weights, min_values, max_values,
+                                                        instrument)
+                    top_k_features = self._topk_features(cfs, original_X, k)
+                    # update the mask with the top-k important feaures
+                    mask = np.array(
+                        [self._gradient_mask_by_setting(setting, top_k)
+                         for top_k in top_k_features])
 
             # STEP-1: optimize the counterfactual examples
-            inited_cfs = self._init_cfs(original_X, setting, mask)
-            cfs, _, loss, iter = self._optimize(inited_cfs, original_X, targets, mask, n, weights,
-                                                min_values, max_values)
+            with instrument.phase('optimize'):
+                inited_cfs = self._init_cfs(original_X, setting, mask, rng, pool)
+                cfs, _, loss, iter = self._optimize(inited_cfs, original_X, targets, mask, n,
+                                                    weights, min_values, max_values, instrument)
+                del inited_cfs
+            batch_peak = sample_rss(batch_peak)
 
             # STEP-2: refine counterfactual examples
-            cfs = self._refine(cfs, original_X, targets, mask, n, weights, min_values, max_values)
+            with instrument.phase('refine'):
+                cfs = self._refine(cfs, original_X, targets, mask, n, weights, min_values,
+                                   max_values, instrument=instrument)
+            batch_peak = sample_rss(batch_peak)
 
             # generate report (features, target, predictions) for counterfactual examples
-            report = self._mm.report(x=cfs, y=targets, preprocess=False)
+            with instrument.phase('report'):
+                report = self._mm.report(x=cfs, y=targets, preprocess=False, exact=True)
+                instrument.count('forward')
+            batch_peak = sample_rss(batch_peak)
+            del original_X, targets, cfs
+            # the finished examples are spilled when they exceed half of the budget
             reports.append(report)
+            if batch_peak is not None:
+                job_rss = max(job_rss, batch_peak)
+                if budget is not None:
+                    batch_size, row_bytes = self._bound_batch_size(
+                        batch_size, row_bytes, (batch_peak - batch_rss) / (end_id - start_id),
+                        budget, instrument)
+            if instrument.enabled:
+                instrument.count('batches')
+                if trace:
+                    instrument.count('traced_batch_peak',
+                                     tracemalloc.get_traced_memory()[1] - traced)
+                instrument.count('converged',
+                                 (report[self._target] == report[self._prediction]).sum())
 
             if verbose:
                 valid_rate = (report[self._target] == report[self._prediction]).sum() / len(report)
@@ -205,8 +495,121 @@ class CFEnginePytorch:
                       "validation rate: {:.3f}".format(end_id, data_num, batch_num,
                                                        timeit.default_timer() - checkpoint,
                                                        loss, iter, valid_rate))
+            batch_num, start_id = batch_num + 1, end_id
+
+        with instrument.phase('report'):
+            counterfactuals = reports.result()
+        del reports
+        # the peak RSS of the job is sampled after the phases of each batch; both figures are
+        # of the whole process, including the jobs running concurrently
+        instrument.tag(peak_rss=job_rss, max_rss=peak_rss())
+        instrument.count('buffer_allocations', pool.allocations - allocations)
+        if verbose and job_rss is not None:
+            print("Peak RSS: {:.1f}MB".format(job_rss / 2 ** 20))
+        instrument.finish()
+        return counterfactuals
+
+    def _buffer_pool(self):
+        """Get the buffer pool of the calls in this thread, or a pool which does not reuse
+        its buffers if the 'reuse_buffers' config is off."""
+        if not self._config['reuse_buffers']:
+            return BufferPool(reuse=False)
+        pool = getattr(self._call, 'buffers', None)
+        if pool is None:
+            pool = self._call.buffers = BufferPool()
+        return pool
+
+    def _row_footprint(self, num):
+        """Estimate the memory of an instance in a batch in bytes."""
+        return num * len(self._dataset.dummy_features) * 4 * ROW_COPIES
+
+    def _auto_batch_size(self, X, setting):
+        """Get the tuned batch size of a job, and tune it on the first instances of X if it has
+        not been tuned for the model and num.
 
-        return CounterfactualExample(self._data_meta, pd.concat(reports))
+        Returns:
+            A tuple of (batch size, measured peak memory per instance or None).
+        """
+        if len(X) <= CANDIDATES[0]:
+            return len(X), None
+        key = self._tuner.key(self._mm.fingerprint(), setting.get('num', DEFAULT_SETTING['num']))
+        entry = self._tuner.get(key, len(X))
+        if entry is None:
+            available = available_memory()
+            entry = self._tuner.tune(key, len(X),
+                                     lambda batch_size: self._measure_batch(X, setting,
+                                                                            batch_size),
+                                     memory_limit=available // 2 if available else None)
+        return entry['batch_size'], entry['peak_memory'] / entry['batch_size']
+
+    def _measure_batch(self, X, setting, batch_size):
+        """Run a trial batch, and measure its time with TUNING_ITER iterations and its peak
+        memory with two iterations. The torch allocations are not traced by tracemalloc, so
+        the peak is the larger of the growth of the peak resident set size, where it can be
+        reset, and the peak of the traced Python and numpy allocations."""
+        rows = X.iloc[np.arange(batch_size) % len(X)]
+        setting = {**setting, 'seed': 0}
+        config = {'batch_size': batch_size, 'min_iter': TUNING_ITER, 'max_iter': TUNING_ITER,
+                  'project_frequency': TUNING_ITER, 'post_steps': 1}
+        # the trial batches use their own buffers, released with them, so that the pool of the
+        # job does not keep the buffers of the largest candidate
+        buffers = getattr(self._call, 'buffers', None)
+        self._call.tuning = True
+        self._call.buffers = BufferPool()
+        try:
+            with self._pinned_config(config):
+                start = timeit.default_timer()
+                self._generate_counterfactual_examples(rows, setting, False, False)
+                seconds = timeit.default_timer() - start
+
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            # the peak RSS is process-wide, so concurrent measurements are serialized; the
+            # allocations of other threads still count towards it
+            try:
+                with PEAK_RSS_LOCK:
+                    base_rss = current_rss()
+                    rss = base_rss is not None and reset_peak_rss()
+                    with self._pinned_config({**config, 'min_iter': 2, 'max_iter': 2,
+                                              'project_frequency': 2}):
+                        self._generate_counterfactual_examples(rows, setting, False, False)
+                    peak = tracemalloc.get_traced_memory()[1] - base
+                    if rss:
+                        peak = max(peak, peak_rss() - base_rss)
+            finally:
+                if started:
+                    tracemalloc.stop()
+        finally:
+            self._call.tuning = False
+            self._call.buffers = buffers
+        return seconds, peak
+
+    @staticmethod
+    def _bound_batch_size(batch_size, row_bytes, measured, budget, instrument=NULL_INSTRUMENT):
+        """Bound the batch size by half of the budget, once the measured growth of the
+        resident memory of a batch per instance exceeds the estimated memory of an instance.
+
+        Returns:
+            A tuple of (batch size, memory of an instance in bytes).
+        """
+        if measured <= row_bytes:
+            return batch_size, row_bytes
+        bounded = max(1, min(batch_size, int(budget / 2 // measured)))
+        if bounded < batch_size:
+            instrument.tag(batch_size=bounded)
+        return bounded, measured
+
+    def _shrink_batch_size(self, batch_size, row_bytes, instrument=NULL_INSTRUMENT):
+        """Halve the batch size until a batch takes at most half of the available memory."""
+        available = available_memory()
+        while available is not None and batch_size > 1 and row_bytes * batch_size * 2 > available:
+            batch_size //= 2
+            instrument.count('batch_shrinks')
+        return batch_size
 
     def _gradient_mask(self, changeable_attr):
         """Generate boolean mask array from a list of changeable attributes."""
@@ -295,52 +698,64 @@ class CFEnginePytorch:
             raise NotImplementedError
         return weights
 
-    def _target_array(self, original_X, setting):
+    def _target_array(self, original_X, setting, pool=None):
         """Generate the target array of counterfactual examples."""
         target = setting.get('desired_class', DEFAULT_SETTING['desired_class'])
 
         if isinstance(target, str) and target == 'opposite':
-            original_X = torch.from_numpy(original_X).float()
-            pred = self._mm.forward(original_X).detach().numpy()
-            pred = pred > (0.5 - 1e-6)
-            target = np.logical_not(pred).astype(int)
+            pool = pool if pool is not None else BufferPool(reuse=False)
+            target = pool.get('targets', (len(original_X), len(self._dataset.dummy_target)))
+            self._mm.predict(original_X, output='proba', out=target, exact=True)
+            # the opposite of the predicted class, in place
+            np.greater(target, 0.5 - 1e-6, out=target)
+            np.subtract(1, target, out=target)
 
         elif isinstance(target, list):
             target = np.array(target)
 
         return target
 
-    def _init_cfs(self, X, setting, mask=None):
+    def _init_cfs(self, X, setting, mask=None, rng=None, pool=None):
         """Initialize counterfactual examples with random perturbation."""
+        if rng is None:
+            rng = np.random.default_rng()
         if mask is None:
             mask = self._gradient_mask_by_setting(setting)
+        pool = pool if pool is not None else BufferPool(reuse=False)
 
-        num_mask = self._gradient_mask(self._dataset.numerical_features) * mask
-        cat_mask = self._gradient_mask(self._dataset.categorical_features) * mask
+        num_mask = self._num_mask * mask
+        cat_mask = self._cat_mask * mask
 
         # add random perturbations to numerical features
-        cfs = pd.DataFrame(X, columns=self._dataset.dummy_features)
-        cfs += num_mask * np.random.rand(*cfs.shape) * 0.1
+        cfs = pool.get('cfs', X.shape)
+        np.copyto(cfs, X)
+        noise = rng.random(out=pool.get('noise', X.shape, np.float64))
+        noise *= num_mask
+        noise *= 0.1
+        cfs += noise
 
         # assign random values to categorical dummy features
         if self._config["perturbation"] == 'unit':
-            cfs -= cat_mask * cfs
-            cfs += cat_mask * np.ones((cfs.shape[0], cat_mask.shape[-1])) * 0.5
+            cfs *= 1 - cat_mask
+            cfs += cat_mask * 0.5
         elif self._config["perturbation"] == 'random':
-            cfs -= cat_mask * cfs
-            cfs += softmax(np.random.rand(cfs.shape[0], cat_mask.shape[-1]), axis=1)
+            cfs *= 1 - cat_mask
+            cfs += softmax(rng.random(out=noise), axis=1)
         elif self._config["perturbation"] == 'none':
             pass
         else:
             raise NotImplementedError
 
-        return cfs.values
+        return cfs
 
-    def _expand_array(self, array, setting):
+    def _expand_array(self, array, setting, pool=None):
         """Expand an array n times. n is the number of the counterfactual examples 
         for each instance."""
         n = setting.get('num', DEFAULT_SETTING['num'])
-        return np.repeat(array, n, axis=0)
+        pool = pool if pool is not None else BufferPool(reuse=False)
+        expanded = pool.get('original_X', (len(array) * n, array.shape[1]))
+        expanded.reshape(len(array), n, -1)[...] = array[:, np.newaxis, :]
+        return expanded
 
     def _topk_features(self, cfs, original_X, k):
         """Get the name of top-k features according to normalized difference from their 
@@ -360,9 +775,12 @@ class CFEnginePytorch:
         return np.array(self._dataset.features)[index_mat]
 
     def _optimize(self, cfs, original_X, target, mask, num, weights=None, min_values=None,
-                  max_values=None):
+                  max_values=None, instrument=NULL_INSTRUMENT):
         """Optimize the counterfactual examples according a mixed loss function 
         through a gradient-based optimizer."""
+        if self._config['compile_step']:
+            return self._optimize_compiled(cfs, original_X, target, mask, num, weights,
+                                           min_values, max_values, instrument)
         cfs = torch.from_numpy(cfs).float()
         cfs.requires_grad = True
         original_X = torch.from_numpy(original_X).float()
@@ -397,18 +815,79 @@ class CFEnginePytorch:
             loss.backward()
             optimizer.step()
 
+            instrument.count('iterations')
+
             if self._stopable(iter, pred, target, stored_loss - loss):
                 break
 
             if iter % self._config["project_frequency"] == 0:
-                cfs.data = self._clip_tensor(cfs.data, min_values, max_values)
-                cfs.data = self._reload_tensor(cfs.data)
+                with instrument.phase('projection'):
+                    cfs.data = self._clip_tensor(cfs.data, min_values, max_values)
+                    cfs.data = self._reload_tensor(cfs.data)
+                instrument.count('projections')
 
             stored_loss = loss.clone()
 
+        instrument.count('forward', iter + 1)
+        instrument.count('backward', iter + 1)
         cfs.data = self._clip_tensor(cfs.data, min_values, max_values)
         return cfs.detach().numpy(), pred.detach().numpy(), loss.detach().numpy(), iter
 
+    def _compiled_step(self):
+        """Get the compiled optimization step of the model, which is compiled once."""
+        mode = self._config['compile_step']
+        mode = 'script' if mode is True else mode
+        with self._compile_lock:
+            step = self._compiled_steps.get(mode)
+            if step is None:
+                self._mm.model.eval()
+                step = self._compiled_steps[mode] = compile_step(self._mm.model, mode)
+        return step
+
+    def _optimize_compiled(self, cfs, original_X, target, mask, num, weights=None,
+                           min_values=None, max_values=None, instrument=NULL_INSTRUMENT):
+        """Optimize the counterfactual examples as _optimize, with one compiled call per
+        iteration and the constant tensors allocated once."""
+        step = self._compiled_step()
+        config = self._config
+        if config["max_iter"] <= 0:
+            raise ValueError("The maximum iteration should greater than 0.")
+
+        cfs = torch.from_numpy(cfs).float().requires_grad_()
+        original_X = torch.from_numpy(original_X).float()
+        target = torch.from_numpy(target).float()
+        mask = torch.from_numpy(np.asarray(mask)).float()
+        weights = torch.from_numpy(weights).float() if weights is not None \
+            else torch.ones(cfs.shape[1])
+        if min_values is not None:
+            min_values = torch.from_numpy(min_values).float()
+        if max_values is not None:
+            max_values = torch.from_numpy(max_values).float()
+        step_args = (original_X, target, mask, weights, float(config['lr']),
+                     float(config['validity_weight']), float(config['proximity_weight']),
+                     float(config['diversity_weight']), int(num))
+
+        stored_loss = 0
+        for iter in range(config["max_iter"]):
+            pred, loss = step(cfs, *step_args)
+            instrument.count('iterations')
+
+            if self._stopable(iter, pred, target, stored_loss - loss):
+                break
+
+            if iter % config["project_frequency"] == 0:
+                with instrument.phase('projection'):
+                    cfs.data = self._clip_tensor(cfs.data, min_values, max_values)
+                    cfs.data = self._reload_tensor(cfs.data)
+                instrument.count('projections')
+
+            stored_loss = loss
+
+        instrument.count('forward', iter + 1)
+        instrument.count('backward', iter + 1)
+        cfs.data = self._clip_tensor(cfs.data, min_values, max_values)
+        return cfs.detach().numpy(), pred.numpy(), loss.numpy(), iter
+
     def _loss(self, cfs, original_X, pred, target, criterion, num, weights=None):
         """A mixed loss function"""
         # prediction loss
@@ -521,9 +1000,13 @@ class CFEnginePytorch:
         return gradient, pred
 
     def _refine(self, cfs, original_X, targets, mask, num, weights=None, min_values=None,
-                max_values=None, verbose=True):
-        """Refine the counterfactual examples."""
-        numerical_feature_mask = self._gradient_mask(self._dataset.numerical_features)
+                max_values=None, verbose=True, instrument=NULL_INSTRUMENT):
+        """Refine the counterfactual examples.
+
+        Returns:
+            A float32 np.ndarray of the refined counterfactual examples.
+        """
+        numerical_feature_mask = self._num_mask
         if weights is not None:
             weights = torch.from_numpy(weights).float()
         inv_cfs = self._dataset.inverse_preprocess_X(cfs)
@@ -535,9 +1018,12 @@ class CFEnginePytorch:
         criterion = nn.MarginRankingLoss(reduction='sum')
 
         for _ in range(self._config["post_steps"]):
-            cfs.data = torch.from_numpy(self._dataset.preprocess_X(inv_cfs).values).float()
+            cfs.data.copy_(torch.from_numpy(self._preprocess_float32(inv_cfs)))
 
             grad, pred = self._get_gradient(cfs, original_X, targets, criterion, num, weights)
+            instrument.count('forward')
+            instrument.count('backward')
+            instrument.count('refine_steps')
 
             if self._check_valid(pred, targets):
                 break
@@ -568,7 +1054,11 @@ class CFEnginePytorch:
             inv_cfs[self._dataset.numerical_features] += inv_updates[:,
                                                          self._index_of_num_features]
 
-        return self._dataset.preprocess_X(inv_cfs)
+        return self._preprocess_float32(inv_cfs)
+
+    def _preprocess_float32(self, X):
+        """Preprocess feature values into a float32 array, the dtype of the search."""
+        return self._dataset.preprocess_X(X).values.astype(np.float32)
 
     def _inverse_updates(self, cfs, updates, min_values=None, max_values=None, preprocess=True):
         process = self._dataset.preprocess_X
@@ -0,0 +1,310 @@
+import timeit
+
+import numpy as np
+
+from cf_ml.cf_engine.engine import CFEnginePytorch, DEFAULT_SETTING, PROBE_ROWS, _Reports
+from cf_ml.utils.instrument import make_instrument, NULL_INSTRUMENT
+from cf_ml.utils.memory import current_rss
+
+GENETIC_CONFIG = {
+    'population': 64,
+    'elites': 16,
+    'generations': 100,
+    'patience': 10,
+    'mutation_rate': 0.2,
+    'mutation_scale': 0.1,
+    'batch_size': 256
+}
+
+# the estimated number of float32 copies of the population of an instance alive during a
+# generation (parents, the two crossover operands, children, the next population and the
+# float64 mutation noise)
+POPULATION_COPIES = 8
+
+
+class CFEngineGenetic(CFEnginePytorch):
+    """A class to generate counterfactual examples by a genetic search, which only needs the
+    predicted probabilities of the model: it explains non-differentiable models, e.g. a
+    model.SklearnModelManager, as well as torch models.
+
+    Each instance has a population of candidates. At each generation, the candidates of all
+    instances of a batch are scored by one predict call, the best ones (elites) are kept, and
+    the others are replaced by the crossover of two elites with random mutations. The setting
+    (k, num, cf_range, changeable_attr, desired_class) has the same meaning as for
+    CFEnginePytorch, and so have the r-counterfactuals.
+
+    Args:
+        dataset: dataset.Dataset, target dataset.
+        model_manager: model.ModelManager, target model, with predict.
+        config: dict, the config of CFEnginePytorch, of which feature_weights, validity_weight,
+            proximity_weight, diversity_weight, loss_diff, batch_size, memory_budget, spill_dir
+            and profile are used ('auto' batch sizes are not tuned, a batch holds all the
+            instances), and
+            population: number, the number of candidates of each instance;
+            elites: number, the number of candidates of each instance kept at each generation;
+            generations: number, the maximal number of generations;
+            patience: number, stop when the best score of no instance of the batch has improved
+                by loss_diff for the given number of generations;
+            mutation_rate: number, the probability to mutate each changeable feature of a
+                candidate;
+            mutation_scale: number, the standard deviation of the mutations of the normalized
+                numerical features.
+        collector: utils.instrument.Collector or None, the collector of the per-phase timing and
+            counters of each run. None disables the instrumentation.
+    """
+
+    def __init__(self, dataset, model_manager, config=None, collector=None):
+        super(CFEngineGenetic, self).__init__(dataset, model_manager,
+                                              {**GENETIC_CONFIG, **(config or {})}, collector)
+        dummy_features = self._dataset.dummy_features
+        # the dummy columns of each feature, and the feature of each dummy column
+        self._groups = [np.array([dummy_features.index(d)
+                                  for d in self._dataset.get_dummy_columns(f)])
+                        for f in self._dataset.features]
+        self._group_of = np.zeros(len(dummy_features), dtype=np.int64)
+        for i, group in enumerate(self._groups):
+            self._group_of[group] = i
+        self._group_matrix = np.eye(len(self._groups), dtype=np.float32)[self._group_of]
+        # the normalization (value * unit + offset) and the precision of the numerical features
+        self._num_columns = np.array([dummy_features.index(f)
+                                      for f in self._dataset.numerical_features], dtype=np.int64)
+        offsets = np.array([float(self._dataset.normalize_feature(f, 0).iloc[0])
+                            for f in self._dataset.numerical_features])
+        self._units = np.array([float(self._dataset.normalize_feature(f, 1).iloc[0])
+                                for f in self._dataset.numerical_features]) - offsets
+        self._offsets = offsets
+        self._precisions = np.array([self._desc[f]['scale']
+                                     for f in self._dataset.numerical_features])
+
+    def _auto_batch_size(self, X, setting):
+        """The genetic search is not tuned, an 'auto' batch holds all the instances."""
+        return len(X), None
+
+    def _row_footprint(self, num):
+        """Estimate the memory of an instance in a batch in bytes, from its population."""
+        return self._config['population'] * len(self._dataset.dummy_features) * 4 * \
+            POPULATION_COPIES
+
+    def _generate_counterfactual_examples(self, X, setting, preprocess, verbose):
+        if setting is None:
+            setting = DEFAULT_SETTING
+        n = setting.get('num', DEFAULT_SETTING['num'])
+        k = setting.get('k', DEFAULT_SETTING['k'])
+        instrument = make_instrument(self._collector, 'generate_counterfactual_examples',
+                                     engine='genetic', num=n, k=k,
+                                     batch_size=self._config['batch_size'])
+
+        with instrument.phase('preprocess'):
+            if preprocess:
+                X = self._dataset.preprocess_X(X)
+            X = np.ascontiguousarray(X.values, dtype=np.float32)
+
+        data_num = len(X)
+        instrument.tag(rows=data_num)
+        batch_size, row_bytes = self._batch_size(X, setting, instrument)
+        budget = self._config['memory_budget']
+        rng = np.random.default_rng(setting.get('seed'))
+        with instrument.phase('mask'):
+            weights = self._feature_weights().astype(np.float32)
+            mask = self._gradient_mask_by_setting(setting)
+            min_values = self._generate_min_array(setting).astype(np.float32)
+            max_values = self._generate_max_array(setting).astype(np.float32)
+            max_changes = k if self._if_sparse(setting) else None
+        pool = self._buffer_pool()
+        reports = _Reports(self._data_meta, budget, self._config['spill_dir'], instrument)
+
+        batch_num, start_id = 0, 0
+        while start_id < data_num:
+            checkpoint = timeit.default_timer()
+            # with a budget, the memory of an instance is measured on a small first batch
+            rows = min(batch_size, PROBE_ROWS) if budget is not None and batch_num == 0 \
+                else batch_size
+            end_id = min(start_id + rows, data_num)
+            batch_rss = current_rss()
+            original_X = X[start_id: end_id]
+            with instrument.phase('preprocess'):
+                targets = np.broadcast_to(self._target_array(original_X, setting, pool),
+                                          (len(original_X), len(self._dataset.dummy_target)))
+                instrument.count('forward')
+
+            with instrument.phase('search'):
+                population, scores, generations = self._search(
+                    original_X, targets, mask, weights, min_values, max_values, max_changes,
+                    rng, instrument)
+                cfs = self._select(population, scores, n, weights)
+                del population, scores
+            # the peak of a batch is sampled at the end of the search, the largest phase
+            batch_peak = current_rss()
+
+            # the values are decoded and encoded again as the refinement does
+            with instrument.phase('report'):
+                cfs = self._preprocess_float32(self._dataset.inverse_preprocess_X(cfs))
+                report = self._mm.report(x=cfs, y=np.repeat(targets, n, axis=0),
+                                         preprocess=False, exact=True)
+                instrument.count('forward')
+            reports.append(report)
+            instrument.count('batches')
+            if budget is not None and batch_rss is not None and batch_peak is not None:
+                batch_size, row_bytes = self._bound_batch_size(
+                    batch_size, row_bytes, (batch_peak - batch_rss) / (end_id - start_id),
+                    budget, instrument)
+
+            if verbose:
+                valid_rate = (report[self._target] == report[self._prediction]).sum() / len(report)
+                print("[{}/{}]  Epoch-{}, time cost: {:.3f}s, generations: {}, "
+                      "validation rate: {:.3f}".format(end_id, data_num, batch_num,
+                                                       timeit.default_timer() - checkpoint,
+                                                       generations, valid_rate))
+            batch_num, start_id = batch_num + 1, end_id
+
+        with instrument.phase('report'):
+            counterfactuals = reports.result()
+        instrument.finish()
+        return counterfactuals
+
+    def _search(self, original_X, targets, mask, weights, min_values, max_values,
+                max_changes=None, rng=None, instrument=NULL_INSTRUMENT):
+        """Run the genetic search of a batch.
+
+        Returns:
+            A tuple of (the candidates of shape (#instances, population, #dummy features), their
+            scores of shape (#instances, population), the number of generations).
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        config = self._config
+        size, elites = config['population'], min(config['elites'], config['population'])
+        if config['generations'] <= 0:
+            raise ValueError("The number of generations should greater than 0.")
+        original = original_X[:, np.newaxis, :]
+
+        # the initial candidates are mutations of the instances within the ranges, where the
+        # original categories excluded by cf_range are always replaced
+        banned = self._cat_mask * (max_values <= 0)
+        force = (original_X * banned) @ self._group_matrix > 0
+        population = np.clip(np.repeat(original, size, axis=1), min_values, max_values)
+        population = self._round(self._mutate(population, mask, min_values, max_values, rng,
+                                              force))
+        population = self._limit_changes(population, original, weights, max_changes, rng)
+        scores = self._score(population, original, targets, weights)
+        instrument.count('forward')
+
+        best, stale, generations = scores.min(axis=1), 0, 1
+        while generations < config['generations']:
+            generations += 1
+            order = np.argsort(scores, axis=1, kind='stable')[:, :elites]
+            parents = np.take_along_axis(population, order[:, :, np.newaxis], axis=1)
+            parent_scores = np.take_along_axis(scores, order, axis=1)
+
+            # uniform crossover of two elites, feature by feature, and mutations
+            rows = np.arange(len(population))[:, np.newaxis]
+            first = parents[rows, rng.integers(0, elites, (len(population), size - elites))]
+            second = parents[rows, rng.integers(0, elites, (len(population), size - elites))]
+            take = rng.random(first.shape[:2] + (len(self._groups),)) < 0.5
+            children = np.where(take[..., self._group_of], first, second)
+            children = self._round(self._mutate(children, mask, min_values, max_values, rng))
+            children = self._limit_changes(children, original, weights, max_changes, rng)
+
+            population = np.concatenate([parents, children], axis=1)
+            scores = np.concatenate(
+                [parent_scores, self._score(children, original, targets, weights)], axis=1)
+            instrument.count('forward')
+            instrument.count('generations')
+
+            current = scores.min(axis=1)
+            if (best - current > config['loss_diff']).any():
+                stale = 0
+            else:
+                stale += 1
+                if stale >= config['patience']:
+                    break
+            best = np.minimum(best, current)
+        return population, scores, generations
+
+    def _mutate(self, candidates, mask, min_values, max_values, rng, force=None):
+        """Mutate the changeable features of candidates of shape (#instances, #candidates,
+        #dummy features) in place: the numerical features with a gaussian noise, and the
+        categorical features by drawing one of their allowed categories. The features where
+        force (of shape (#instances, #features)) is set are mutated in all candidates."""
+        rate = self._config['mutation_rate']
+        scale = self._config['mutation_scale']
+        shape = candidates.shape[:2]
+        for i, (feature, group) in enumerate(zip(self._dataset.features, self._groups)):
+            changed = rng.random(shape) < rate
+            if force is not None:
+                changed |= force[:, i, np.newaxis]
+            if self._dataset.is_num(feature):
+                column = group[0]
+                if mask[column] <= 0:
+                    continue
+                noise = rng.normal(0, scale, shape) * changed
+                candidates[..., column] = np.clip(candidates[..., column] + noise,
+                                                  min_values[column], max_values[column])
+            else:
+                allowed = group[(mask[group] > 0) & (max_values[group] > 0)]
+                if len(allowed) == 0:
+                    continue
+                chosen = allowed[rng.integers(0, len(allowed), shape)]
+                candidates[..., group] *= ~changed[..., np.newaxis]
+                index = np.nonzero(changed)
+                candidates[index + (chosen[index],)] = 1
+        return candidates
+
+    def _round(self, candidates):
+        """Round the numerical features of candidates to their precisions in place, as the
+        inverse preprocessing does, so that the scored candidates are the reported ones."""
+        if len(self._num_columns) == 0:
+            return candidates
+        values = (candidates[..., self._num_columns] - self._offsets) / self._units
+        values = np.round(values / self._precisions) * self._precisions
+        candidates[..., self._num_columns] = values * self._units + self._offsets
+        return candidates
+
+    def _feature_changes(self, candidates, original, weights):
+        """Get the weighted change of each feature of the candidates."""
+        return (np.abs(candidates - original) * weights) @ self._group_matrix
+
+    def _limit_changes(self, candidates, original, weights, max_changes, rng):
+        """Revert all but the max_changes most changed features of each candidate."""
+        if max_changes is None:
+            return candidates
+        changes = self._feature_changes(candidates, original, weights)
+        # random tie-breaking among the changed features
+        changes += (changes > 0) * rng.random(changes.shape, dtype=np.float32) * 1e-6
+        ranks = np.argsort(np.argsort(-changes, axis=-1), axis=-1)
+        keep = ranks < max_changes
+        return np.where(keep[..., self._group_of], candidates, original)
+
+    def _score(self, candidates, original, targets, weights):
+        """Score the candidates by the mixed loss of CFEnginePytorch without the diversity
+        term, with one predict call for all candidates. The candidates whose predicted class
+        is not the target one are penalized by one more unit of validity, so that the valid
+        candidates rank first as the refinement of CFEnginePytorch ensures."""
+        rows, size, dims = candidates.shape
+        proba = self._mm.predict(candidates.reshape(-1, dims), output='proba', exact=True)
+        proba = proba.reshape(rows, size, -1)
+        # MarginRankingLoss(pred, 0.5, target) with a zero margin
+        validity = (np.maximum(0.5 - proba, 0) * targets[:, np.newaxis, :]).sum(axis=-1)
+        validity += proba.argmax(axis=-1) != targets.argmax(axis=-1)[:, np.newaxis]
+        proximity = (np.abs(candidates - original) * weights).sum(axis=-1)
+        return self._config['validity_weight'] * validity + \
+            self._config['proximity_weight'] * proximity
+
+    def _select(self, population, scores, num, weights):
+        """Select num candidates of each instance, the best one first, then the ones with the
+        best score minus the diversity weight times their distance to the selected ones,
+        skipping duplicates.
+
+        Returns:
+            The selected candidates of shape (#instances * num, #dummy features).
+        """
+        rows = np.arange(len(population))
+        scores = scores.astype(np.float64)
+        selected = []
+        for _ in range(num):
+            index = scores.argmin(axis=1)
+            chosen = population[rows, index]
+            selected.append(chosen)
+            distance = (np.abs(population - chosen[:, np.newaxis, :]) * weights).sum(axis=-1)
+            scores = scores - self._config['diversity_weight'] * distance
+            scores[distance < 1e-6] = np.inf
+        return np.stack(selected, axis=1).reshape(-1, population.shape[-1])
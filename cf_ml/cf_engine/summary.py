@@ -0,0 +1,133 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_BINS = 20
+
+
+def feature_bins(dataset, feature, n_bins=DEFAULT_BINS):
+    """Get the bins of a feature from the universal range of the dataset.
+
+    The bin edges of a numerical feature lie on the precision grid of its decile, so that a
+    bin never splits values which are equal at that precision.
+
+    Args:
+        dataset: Dataset, the dataset.
+        feature: str, the name of the feature.
+        n_bins: number, the maximal number of bins of a numerical feature.
+
+    Returns:
+        The bin edges (np.array) of a numerical feature, or the list of categories of a
+        categorical feature.
+    """
+    feature_range = dataset.get_universal_range()[feature]
+    if 'categories' in feature_range:
+        return feature_range['categories']
+    scale = 0.1 ** feature_range['decile']
+    low, high = feature_range['min'], feature_range['max']
+    width = max(math.ceil((high - low) / n_bins), 1)
+    edges = np.arange(low, high + width, width)
+    return np.round(edges * scale, feature_range['decile'])
+
+
+def histogram(values, bins):
+    """Count the values in the given bins (edges or categories)."""
+    if isinstance(bins, list):
+        codes = pd.Categorical(np.asarray(values).astype(str), categories=bins).codes
+        return np.bincount(codes[codes >= 0], minlength=len(bins))
+    values = np.clip(np.asarray(values, dtype=float), bins[0], bins[-1])
+    return np.histogram(values, bins=bins)[0]
+
+
+def transition_matrix(original, counterfactual, categories):
+    """Count the transitions from the original categories (rows) to the counterfactual ones
+    (columns)."""
+    n = len(categories)
+    from_codes = pd.Categorical(np.asarray(original).astype(str), categories=categories).codes
+    to_codes = pd.Categorical(np.asarray(counterfactual).astype(str),
+                              categories=categories).codes
+    known = (from_codes >= 0) & (to_codes >= 0)
+    flat = from_codes[known].astype(np.int64) * n + to_codes[known]
+    return np.bincount(flat, minlength=n * n).reshape(n, n)
+
+
+def _changed(dataset, feature, original, counterfactual):
+    """Get whether the counterfactual values differ from the original ones at the precision of
+    the feature."""
+    if not dataset.is_num(feature):
+        return original.astype(str) != counterfactual.astype(str)
+    scale = 0.1 ** dataset.description[feature]['decile']
+    return np.abs(counterfactual.astype(float) - original.astype(float)) >= scale / 2
+
+
+def summarize_counterfactuals(dataset, original_instances, counterfactuals, features=None,
+                              n_bins=DEFAULT_BINS):
+    """Aggregate the counterfactual examples of a set of instances.
+
+    The counterfactual examples are aligned with the original instances by position: the
+    examples of an instance are consecutive, as generated by the engine.
+
+    Args:
+        dataset: Dataset, the dataset.
+        original_instances: pd.DataFrame, the feature values of the original instances.
+        counterfactuals: CounterfactualExample, the counterfactual examples.
+        features: list or None, the features to summarize, all features if None.
+        n_bins: number, the maximal number of bins of a numerical feature.
+
+    Returns:
+        A dict with the numbers of instances and counterfactual examples, the validity rate,
+        and for each feature: its change frequency and the histograms of the original values,
+        of all counterfactual values and of the valid ones. Categorical features also have the
+        transition matrix between the original and the valid counterfactual categories.
+    """
+    features = features if features is not None else dataset.features
+    cfs = counterfactuals.all
+    n_instances = len(original_instances)
+    num = len(cfs) // n_instances if n_instances > 0 else 1
+    valid = (cfs[dataset.target] == cfs[dataset.prediction]).values
+
+    summary = {'instances': n_instances, 'counterfactuals': len(cfs),
+               'valid_rate': float(valid.mean()) if len(cfs) > 0 else 0.,
+               'features': {}}
+    for feature in features:
+        original = np.repeat(original_instances[feature].values, num)
+        counterfactual = cfs[feature].values
+        bins = feature_bins(dataset, feature, n_bins)
+        changed = _changed(dataset, feature, original, counterfactual)
+        feature_summary = {
+            'bins': bins,
+            'change_rate': float(changed.mean()) if len(cfs) > 0 else 0.,
+            'valid_change_rate': float(changed[valid].mean()) if valid.any() else 0.,
+            'original': histogram(original_instances[feature].values, bins),
+            'counterfactual': histogram(counterfactual, bins),
+            'valid_counterfactual': histogram(counterfactual[valid], bins)}
+        if not dataset.is_num(feature):
+            feature_summary['transitions'] = transition_matrix(original[valid],
+                                                               counterfactual[valid], bins)
+        summary['features'][feature] = feature_summary
+    return summary
+
+
+def summarize_r_counterfactuals(dataset, original_instances, r_counterfactuals, features=None,
+                                n_bins=DEFAULT_BINS):
+    """Aggregate the r-counterfactuals (subgroup counterfactuals) of a subset.
+
+    Args:
+        dataset: Dataset, the dataset.
+        original_instances: pd.DataFrame, the feature values of the instances in the subset.
+        r_counterfactuals: CounterfactualExampleBySubset or an iterable of (feature,
+            CounterfactualExample), the counterfactual examples where the range of each
+            feature is released.
+        features: list or None, the features to summarize in each subset, all if None.
+        n_bins: number, the maximal number of bins of a numerical feature.
+
+    Returns:
+        A dict, key: the released feature, value: the summary of its counterfactual examples
+        (see summarize_counterfactuals).
+    """
+    if hasattr(r_counterfactuals, 'subsets'):
+        r_counterfactuals = r_counterfactuals.subsets.items()
+    return {feature: summarize_counterfactuals(dataset, original_instances, subset_cf,
+                                               features, n_bins)
+            for feature, subset_cf in r_counterfactuals}
@@ -1,2 +1,3 @@
 from cf_ml.dataset.dataset import Dataset
-from cf_ml.dataset.load_dataset import load_diabetes_dataset, load_german_credit_dataset
+from cf_ml.dataset.load_dataset import load_diabetes_dataset, load_german_credit_dataset, \
+    load_csv_dataset, load_synthetic_dataset
@@ -158,8 +158,7 @@ class Dataset:
         cats = self._description[original_column]['categories']
         dummy_col = ['{}_{}'.format(original_column, cat) for cat in cats]
         category_index = data.loc[:, dummy_col].values.argmax(axis=1)
-        category_value = [cats[index] for index in category_index]
-        return category_value
+        return np.array(cats, dtype=object)[category_index]
 
     def _any2df(self, data, columns):
         if isinstance(data, dict):
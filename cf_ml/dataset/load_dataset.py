@@ -26,3 +26,37 @@ def load_diabetes_dataset():
         if type(info['category']) is str:
             info['category'] = info['category'].split(' ')
     return Dataset('diabetes', data_df, description, 'Outcome')
+
+
+def load_csv_dataset(data_dir, target_name, filename='data.csv', name=None):
+    """Load a dataset from a directory with a data file and a description.csv, in which the
+    categories of a categorical attribute are separated by '|'."""
+    data_df = pd.read_csv(os.path.join(data_dir, filename))
+    description = pd.read_csv(os.path.join(data_dir, 'description.csv'),
+                              index_col='name').to_dict('index')
+    for col, info in description.items():
+        description[col] = {k: v for k, v in info.items() if not pd.isna(v)}
+        if isinstance(description[col].get('category'), str):
+            description[col]['category'] = description[col]['category'].split('|')
+    if name is None:
+        name = os.path.basename(os.path.normpath(data_dir))
+    return Dataset(name, data_df, description, target_name)
+
+
+def load_synthetic_dataset(base='diabetes', n=100000, n_features=None, seed=0, **kwargs):
+    """Generate a scaled-up synthetic variant of a sample dataset, with distributions, correlations
+    and class balance fitted from the sample dataset."""
+    from cf_ml.dataset.synthetic import SyntheticDataGenerator, description_from_dataset
+
+    if base == 'diabetes':
+        dataset = load_diabetes_dataset()
+    elif base == 'german-credit':
+        dataset = load_german_credit_dataset()
+    else:
+        raise NotImplementedError
+    generator = SyntheticDataGenerator(description_from_dataset(dataset), dataset.target,
+                                       reference=dataset.data, n_features=n_features, seed=seed,
+                                       **kwargs)
+    name = '{}-synthetic-{}'.format(base, n) if n_features is None else \
+        '{}-synthetic-{}x{}'.format(base, n, n_features)
+    return generator.to_dataset(n, name=name)
@@ -0,0 +1,257 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+from cf_ml.dataset.dataset import Dataset
+
+
+def description_from_dataset(dataset):
+    """Get the raw description (the format accepted by Dataset) of a dataset."""
+    description = {}
+    for col in dataset.columns:
+        info = dataset.description[col]
+        if dataset.is_num(col):
+            description[col] = {'type': 'numerical', 'min': info['min'], 'max': info['max'],
+                                'decile': info['decile']}
+        else:
+            description[col] = {'type': 'categorical', 'category': list(info['categories'])}
+    return description
+
+
+def _nearest_correlation(matrix, eps=1e-6):
+    """Project a symmetric matrix to the closest valid (positive definite) correlation matrix."""
+    matrix = (matrix + matrix.T) / 2
+    eigval, eigvec = np.linalg.eigh(matrix)
+    matrix = eigvec @ np.diag(np.maximum(eigval, eps)) @ eigvec.T
+    std = np.sqrt(np.diag(matrix))
+    return matrix / np.outer(std, std)
+
+
+class SyntheticDataGenerator:
+    """A class to generate synthetic datasets of arbitrary size from a Dataset-style description.
+
+    Feature values are sampled from a Gaussian copula, so that the features are correlated while
+    each of them follows its own marginal distribution. If a reference dataframe is given, the
+    marginals, the correlations and the class balance are fitted from it. Otherwise, numerical
+    features are uniform in [min, max], categories are equally likely and the correlations are
+    drawn at random. The target is predicted by the model if a model manager is given, or
+    otherwise derived from a random linear function of the features.
+
+    Args:
+        description: dict, the description of the columns in the format accepted by Dataset,
+            categorical columns (including the target) should list their 'category'.
+        target_name: str, the name of the target attribute.
+        reference: pandas.DataFrame or None, the data to fit the distributions to.
+        model_manager: model.PytorchModelManager or None, a fitted model to label the data.
+        n_features: number or None, the number of features to generate. Extra features are
+            copies of the described ones named '<feature>_<i>'.
+        class_balance: dict or None, key: target category, value: proportion of the class.
+        correlation: number, the strength of the random correlations without a reference.
+        label_noise: number, the proportion of the labels to be replaced with random classes.
+        seed: number, the random seed.
+    """
+
+    def __init__(self, description, target_name, reference=None, model_manager=None,
+                 n_features=None, class_balance=None, correlation=0.5, label_noise=0.,
+                 seed=0):
+        self._target = target_name
+        self._reference = reference
+        self._model_manager = model_manager
+        self._correlation = correlation
+        self._label_noise = label_noise
+        self._seed = seed
+
+        self._description = {col: dict(info) for col, info in description.items()}
+        for col, info in self._description.items():
+            if info['type'] == 'categorical':
+                if 'category' not in info and reference is not None:
+                    info['category'] = reference[col].astype(str).unique().tolist()
+                if 'category' not in info:
+                    raise ValueError("Categories of attribute {} are required.".format(col))
+                info['category'] = [str(cat) for cat in info['category']]
+            elif info['type'] == 'numerical':
+                if reference is not None:
+                    info.setdefault('min', float(reference[col].min()))
+                    info.setdefault('max', float(reference[col].max()))
+                if 'min' not in info or 'max' not in info:
+                    raise ValueError("Range of attribute {} is required.".format(col))
+                info['decile'] = int(info.get('decile', 0))
+            else:
+                raise ValueError("Illegal description of attribute: {}".format(col))
+
+        base_features = [col for col in self._description if col != self._target]
+        self._sources = {f: f for f in base_features}
+        if n_features is not None and n_features > len(base_features):
+            if model_manager is not None:
+                raise ValueError("Features cannot be added to the data labeled by a model.")
+            for i in range(n_features - len(base_features)):
+                source = base_features[i % len(base_features)]
+                name = "{}_{}".format(source, i // len(base_features) + 1)
+                self._description[name] = dict(self._description[source])
+                self._sources[name] = source
+        self._features = list(self._sources.keys())
+
+        # the target is a dimension of the copula only if it is fitted from the reference
+        self._target_in_copula = reference is not None and model_manager is None \
+            and target_name in reference.columns
+        self._dims = self._features + ([self._target] if self._target_in_copula else [])
+
+        rng = np.random.default_rng([seed, 0])
+        self._quantiles = self._fit_marginals()
+        self._class_balance = self._fit_class_balance(class_balance)
+        correlation = self._fit_correlation(rng)
+        self._cov_factor = np.linalg.cholesky(correlation)
+        self._target_weights = rng.normal(size=len(self._features))
+        n_f = len(self._features)
+        self._score_std = np.sqrt(
+            self._target_weights @ correlation[:n_f, :n_f] @ self._target_weights)
+
+    def _fit_marginals(self):
+        """Get the sorted reference values of numerical columns or the cumulative probabilities
+        of categorical columns."""
+        quantiles = {}
+        for col in self._dims:
+            source = self._sources.get(col, col)
+            info = self._description[col]
+            has_reference = self._reference is not None and source in self._reference.columns
+            if info['type'] == 'numerical':
+                quantiles[col] = np.sort(self._reference[source].values.astype(float)) \
+                    if has_reference else None
+            else:
+                if has_reference:
+                    freq = self._reference[source].astype(str).value_counts(normalize=True)
+                    probs = np.array([freq.get(cat, 0) for cat in info['category']])
+                else:
+                    probs = np.ones(len(info['category']))
+                quantiles[col] = np.cumsum(probs / probs.sum())
+        return quantiles
+
+    def _fit_class_balance(self, class_balance):
+        categories = self._description[self._target]['category']
+        if class_balance is not None:
+            probs = np.array([class_balance.get(cat, 0) for cat in categories], dtype=float)
+        elif self._reference is not None and self._target in self._reference.columns:
+            freq = self._reference[self._target].astype(str).value_counts(normalize=True)
+            probs = np.array([freq.get(cat, 0) for cat in categories], dtype=float)
+        else:
+            probs = np.ones(len(categories))
+        return probs / probs.sum()
+
+    def _fit_correlation(self, rng):
+        """Fit the correlation matrix of the copula from the normal scores of the reference,
+        or draw a random one."""
+        if self._reference is None:
+            loadings = rng.normal(size=(len(self._dims), 2)) * self._correlation
+            return _nearest_correlation(loadings @ loadings.T + np.eye(len(self._dims)))
+
+        scores = []
+        for source in [self._sources.get(col, col) for col in self._dims]:
+            values = self._reference[source]
+            if self._description[source]['type'] == 'categorical':
+                order = {cat: i for i, cat in enumerate(self._description[source]['category'])}
+                values = values.astype(str).map(order)
+            ranks = values.rank(method='average').values
+            scores.append(ndtri((ranks - 0.5) / len(ranks)))
+        correlation = np.nan_to_num(np.corrcoef(np.array(scores)))
+        # copies of a feature are correlated with the others as loosely as half of the source
+        for i, col in enumerate(self._dims):
+            if self._sources.get(col, col) != col:
+                correlation[i, :] *= 0.5
+                correlation[:, i] *= 0.5
+        np.fill_diagonal(correlation, 1)
+        return _nearest_correlation(correlation)
+
+    def _sample_column(self, col, u):
+        info = self._description[col]
+        if info['type'] == 'categorical':
+            index = np.minimum(np.searchsorted(self._quantiles[col], u, side='right'),
+                               len(info['category']) - 1)
+            return np.array(info['category'], dtype=object)[index]
+
+        sorted_values = self._quantiles[col]
+        if sorted_values is None:
+            values = info['min'] + u * (info['max'] - info['min'])
+        else:
+            grid = (np.arange(len(sorted_values)) + 0.5) / len(sorted_values)
+            values = np.interp(u, grid, sorted_values)
+        scale = 0.1 ** info['decile']
+        values = np.clip(np.round(values / scale) * scale, info['min'], info['max'])
+        return values.astype(int) if info['decile'] == 0 else values
+
+    def _label(self, data, z, rng):
+        categories = np.array(self._description[self._target]['category'], dtype=object)
+        if self._model_manager is not None:
+            dataset = self._model_manager.dataset
+            labels = self._model_manager.predict(dataset.preprocess_X(data[dataset.features]),
+                                                 output='label')
+        elif self._target_in_copula:
+            return data[self._target].values
+        else:
+            # assign the classes to the quantiles of a noisy linear score
+            score = z[:, :len(self._features)] @ self._target_weights
+            score = score + rng.normal(size=len(score)) * self._score_std * 0.5
+            thresholds = ndtri(np.cumsum(self._class_balance)[:-1]) * self._score_std * \
+                np.sqrt(1.25)
+            labels = categories[np.searchsorted(thresholds, score)]
+
+        if self._label_noise > 0:
+            noisy = rng.random(len(labels)) < self._label_noise
+            labels = labels.copy()
+            labels[noisy] = rng.choice(categories, size=noisy.sum(), p=self._class_balance)
+        return labels
+
+    def iter_chunks(self, n, chunk_size=100000):
+        """Generate the data in chunks of pandas.DataFrame. The data is reproducible from the
+        seed and the chunk size."""
+        for chunk_id, start in enumerate(range(0, n, chunk_size)):
+            rng = np.random.default_rng([self._seed, chunk_id + 1])
+            size = min(chunk_size, n - start)
+            z = rng.standard_normal((size, len(self._dims))) @ self._cov_factor.T
+            u = ndtr(z)
+            data = pd.DataFrame({col: self._sample_column(col, u[:, i])
+                                 for i, col in enumerate(self._dims)},
+                                index=pd.RangeIndex(start, start + size))
+            data[self._target] = self._label(data, z, rng)
+            yield data[self._features + [self._target]]
+
+    def generate(self, n, chunk_size=100000):
+        """Generate n rows of synthetic data in a pandas.DataFrame."""
+        return pd.concat(self.iter_chunks(n, chunk_size))
+
+    def to_dataset(self, n, name='synthetic', chunk_size=100000, split_rate=0.8):
+        """Generate n rows of synthetic data in a dataset.Dataset."""
+        return Dataset(name, self.generate(n, chunk_size), self.description, self._target,
+                       split_rate=split_rate)
+
+    def save(self, n, data_dir, filename='data.csv', chunk_size=100000):
+        """Generate n rows of synthetic data and write them chunk by chunk to a directory with
+        a description.csv, which can be loaded by load_dataset.load_csv_dataset."""
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        data_path = os.path.join(data_dir, filename)
+        for chunk_id, data in enumerate(self.iter_chunks(n, chunk_size)):
+            data.to_csv(data_path, mode='w' if chunk_id == 0 else 'a', header=chunk_id == 0,
+                        index=False)
+
+        rows = []
+        for col, info in self.description.items():
+            row = {'name': col, **info}
+            if 'category' in info:
+                row['category'] = '|'.join(info['category'])
+            rows.append(row)
+        pd.DataFrame(rows).set_index('name').to_csv(os.path.join(data_dir, 'description.csv'))
+        return data_path
+
+    @property
+    def description(self):
+        return {col: self._description[col] for col in self._features + [self._target]}
+
+    @property
+    def features(self):
+        return self._features
+
+    @property
+    def target(self):
+        return self._target
@@ -1 +1 @@
-from cf_ml.model.model_manager import PytorchModelManager
+from cf_ml.model.model_manager import ModelManager, PytorchModelManager, SklearnModelManager
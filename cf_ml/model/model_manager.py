@@ -1,4 +1,7 @@
+import copy
+import hashlib
 import os
+import pickle
 from abc import ABC, abstractmethod
 import numpy as np
 import pandas as pd
@@ -6,15 +9,22 @@ import pandas as pd
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data import TensorDataset
 import torch.optim as optim
+from sklearn.metrics import confusion_matrix, f1_score, roc_auc_score
 
-from cf_ml.utils import DirectoryManager
+from cf_ml.utils import DirectoryManager, dataset_fingerprint, model_fingerprint, \
+    combine_fingerprints
+
+INFERENCE_PRECISIONS = ('int8', 'bfloat16')
 
 OUTPUT_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'output')
 
 
 class ModelManager(ABC):
+    """The interface of the model managers. The reports are built from predict on the
+    preprocessed feature values, with the _dataset, _features, _target, _prediction and
+    _classes attributes set by the subclasses."""
 
     @abstractmethod
     def load_model(self):
@@ -24,6 +34,10 @@ class ModelManager(ABC):
     def forward(self, x):
         return
 
+    @abstractmethod
+    def predict(self, x, output='class', out=None, batch_size=None, exact=False):
+        return
+
     @abstractmethod
     def evaluate(self):
         return
@@ -32,6 +46,82 @@ class ModelManager(ABC):
     def save_model(self):
         return
 
+    def _prediction_buffer(self, n, output, out=None):
+        """Get the array of the predictions of n rows, or check the preallocated one."""
+        if output == 'proba':
+            shape, dtype = (n, len(self._target)), np.float32
+        elif output in ('class', 'label'):
+            shape, dtype = (n,), np.int64
+        else:
+            raise ValueError("Unknown output: {}.".format(output))
+        if out is None:
+            return np.empty(shape, dtype=dtype)
+        if out.shape != shape or out.dtype != dtype:
+            raise ValueError("The output buffer should be a {} array of shape {}.".format(
+                np.dtype(dtype), shape))
+        return out
+
+    def report(self, x, y=None, preprocess=True, exact=False):
+        """Generate the report from the feature values and target values (optional). 
+        The report includes (features, target, prediction). With exact, the prediction is
+        made by the float model even if the manager has an inference precision."""
+        if preprocess:
+            x = self._dataset.preprocess_X(x)
+            if y is not None:
+                y = self._dataset.preprocess_y(y)
+
+        if isinstance(x, pd.DataFrame):
+            x = x[self._features].values
+        elif isinstance(x, torch.Tensor):
+            x = x.detach().numpy()
+        if isinstance(y, pd.DataFrame):
+            y = y[self._target].values
+
+        # the categories are decoded by lookup from the argmax of the one-hot values
+        report_df = self._dataset.inverse_preprocess_X(x)
+        report_df[self._dataset.target] = self._classes[np.asarray(y).argmax(axis=1)] \
+            if y is not None else self._classes[0]
+        report_df = report_df[self._dataset.columns]
+        report_df[self._prediction] = self.predict(x, output='label', exact=exact)
+
+        return report_df
+
+    def report_on_instance(self, index):
+        """Generate the report to an instance in the dataset. 
+        The report includes (features, target, prediction)."""
+        instances = self._dataset.get_subset(index=index, preprocess=False)
+        report_df = self.report(instances[self._dataset.features], instances[self._dataset.target])
+        report_df[self._dataset.features] = instances[self._dataset.features]
+        report_df[self._dataset.target] = instances[self._dataset.target]
+        return report_df.set_index(instances.index)
+
+    def _metric(self, metric, target, proba):
+        """Compute a metric from the one-hot targets and the predicted probabilities."""
+        if isinstance(target, torch.Tensor):
+            target = target.numpy()
+        target_class = target.argmax(axis=1)
+        pred_class = proba.argmax(axis=1)
+        labels = np.arange(proba.shape[1])
+        if metric == 'accuracy':
+            return float((target_class == pred_class).mean())
+        elif metric == 'f1':
+            return float(f1_score(target_class, pred_class, labels=labels,
+                                  average='binary' if len(labels) == 2 else 'macro',
+                                  zero_division=0))
+        elif metric == 'auc':
+            # one-vs-rest AUC averaged over the classes present in the targets
+            present = [c for c in labels if 0 < (target_class == c).sum() < len(target_class)]
+            if len(present) == 0:
+                return float('nan')
+            if len(labels) == 2:
+                return float(roc_auc_score(target_class == 1, proba[:, 1]))
+            return float(np.mean([roc_auc_score(target_class == c, proba[:, c])
+                                  for c in present]))
+        elif metric == 'confusion_matrix':
+            return confusion_matrix(target_class, pred_class, labels=labels)
+        else:
+            raise NotImplementedError
+
 
 class MLP(nn.Module):
 
@@ -72,16 +162,32 @@ class PytorchModelManager(ModelManager):
         model_name: str, name of the model.
         root_dir: str, the path of the directory to store the model and relative information.
         model: a torch model or None, if model is none, a new MLP (#f, 60, 30, #c) will be created.
+        use_cache: boolean, whether to reuse the preprocessed data and the prediction reports
+            cached in the model directory. The cache is rebuilt when the data, the description
+            or the model weights change.
+        inference_precision: str or None, 'int8' to predict with a copy of the model whose
+            linear layers are dynamically quantized, 'bfloat16' to predict with a bfloat16 copy,
+            or None to predict with the float model. The copy is only used by the inference
+            paths (predict, report, save_reports), the gradients of the counterfactual search
+            are computed on the float model.
     """
 
-    def __init__(self, dataset, model_name='MLP', root_dir=OUTPUT_ROOT, model=None):
+    def __init__(self, dataset, model_name='MLP', root_dir=OUTPUT_ROOT, model=None,
+                 use_cache=False, inference_precision=None):
+        if inference_precision is not None and inference_precision not in INFERENCE_PRECISIONS:
+            raise ValueError("The inference precision should be one of {}.".format(
+                INFERENCE_PRECISIONS))
         self._dataset = dataset
         self._name = model_name
         self._dir_manager = DirectoryManager(self._dataset, model_name, root=root_dir)
+        self._use_cache = use_cache
+        self._data_fingerprint = dataset_fingerprint(self._dataset) if use_cache else None
 
         self._features = self._dataset.dummy_features
         self._target = self._dataset.dummy_target
         self._prediction = "{}_pred".format(self._dataset.target)
+        self._classes = np.array(self._dataset.description[self._dataset.target]['categories'],
+                                 dtype=object)
 
         if model is None:
             self._model = MLP(feature_num=len(self._features),
@@ -89,85 +195,202 @@ class PytorchModelManager(ModelManager):
         else:
             self._model = model
 
-        train_X = torch.from_numpy(
-            self.dataset.get_train_X().values).float()
-        train_y = torch.from_numpy(
-            self.dataset.get_train_y().values).float()
-        test_X = torch.from_numpy(
-            self.dataset.get_test_X().values).float()
-        test_y = torch.from_numpy(
-            self.dataset.get_test_y().values).float()
+        train_X = self._preprocessed_tensor('train_X', self.dataset.get_train_X)
+        train_y = self._preprocessed_tensor('train_y', self.dataset.get_train_y)
+        test_X = self._preprocessed_tensor('test_X', self.dataset.get_test_X)
+        test_y = self._preprocessed_tensor('test_y', self.dataset.get_test_y)
 
         self.train_dataset = TensorDataset(train_X, train_y)
         self.test_dataset = TensorDataset(test_X, test_y)
 
         self._train_accuracy = None
         self._test_accuracy = None
+        self._fingerprint = None
+        self._inference_precision = inference_precision
+        self._inference_model = None
+
+    def _preprocessed_tensor(self, name, preprocess):
+        """Get a float tensor of preprocessed data. With caching, the tensor shares memory
+        with a memory-mapped .npy file in the model directory."""
+        if not self._use_cache:
+            return torch.from_numpy(preprocess().values).float()
+        array = self._dir_manager.cache.get_or_create(
+            name, self._data_fingerprint, lambda: preprocess().values.astype(np.float32))
+        return torch.from_numpy(array)
+
+    def report_fingerprint(self):
+        """Get a digest of the data and the model weights, which identifies the model outputs.
+        """
+        if self._data_fingerprint is None:
+            self._data_fingerprint = dataset_fingerprint(self._dataset)
+        return combine_fingerprints(self._data_fingerprint, self.fingerprint())
+
+    def fingerprint(self):
+        """Get a digest of the model weights."""
+        if self._fingerprint is None:
+            self._fingerprint = model_fingerprint(self._model)
+        return self._fingerprint
+
+    @property
+    def nbytes(self):
+        """The memory in bytes of the model weights, their reduced-precision copy and the
+        preprocessed train and test tensors."""
+        tensors = list(self.train_dataset.tensors) + list(self.test_dataset.tensors)
+        for model in (self._model, self._inference_model):
+            if model is not None:
+                for value in model.state_dict().values():
+                    # the weights of dynamically quantized layers are packed into tuples
+                    tensors.extend(value if isinstance(value, tuple) else [value])
+        return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
 
     def load_model(self):
         """Load model states."""
         self._dir_manager.load_meta()
         self._model.load_state_dict(self._dir_manager.load_pytorch_model_state())
+        self._fingerprint = None
+        self._inference_model = None
 
     def forward(self, x):
         """Get the forward results to the given data."""
-        self._model.eval()
+        if self._model.training:
+            self._model.eval()
         return self._model(x)
 
-    def report(self, x, y=None, preprocess=True):
-        """Generate the report from the feature values and target values (optional). 
-        The report includes (features, target, prediction)."""
-        if preprocess:
-            x = self._dataset.preprocess_X(x)
-            if y is not None:
-                y = self._dataset.preprocess_y(y)
-
+    def _as_tensor(self, x):
         if isinstance(x, pd.DataFrame):
             x = x[self._features].values
         if isinstance(x, np.ndarray):
-            x = torch.from_numpy(x).float()
-
-        pred = self.forward(x).detach().numpy()
-        if y is None:
-            y = np.zeros(pred.shape)
-
-        report_df = self._dataset.inverse_preprocess(np.concatenate((x, y), axis=1))
-        report_df[self._prediction] = self._dataset.inverse_preprocess_y(pred)
+            return torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+        return x.float()
 
-        return report_df
-
-    def report_on_instance(self, index):
-        """Generate the report to an instance in the dataset. 
-        The report includes (features, target, prediction)."""
-        instances = self._dataset.get_subset(index=index, preprocess=False)
-        report_df = self.report(instances[self._dataset.features], instances[self._dataset.target])
-        report_df[self._dataset.features] = instances[self._dataset.features]
-        report_df[self._dataset.target] = instances[self._dataset.target]
-        return report_df.set_index(instances.index)
+    def _get_inference_model(self):
+        """Get the reduced-precision copy of the model, which is built once per weights."""
+        model = self._inference_model
+        if model is None:
+            model = copy.deepcopy(self._model).eval()
+            if self._inference_precision == 'int8':
+                model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear},
+                                                               dtype=torch.qint8)
+            else:
+                model = model.to(torch.bfloat16)
+            self._inference_model = model
+        return model
+
+    def predict(self, x, output='class', out=None, batch_size=None, exact=False):
+        """Predict preprocessed feature values without tracking gradients.
+
+        Args:
+            x: np.ndarray, torch.Tensor or pd.DataFrame, the preprocessed feature values.
+            output: str, 'class' for the class indices, 'proba' for the class probabilities,
+                or 'label' for the target categories.
+            out: np.ndarray or None, a preallocated array to write the result into, of shape
+                (#rows, #classes) and dtype float32 for 'proba', or of shape (#rows,) and dtype
+                int64 for 'class'.
+            batch_size: number or None, the number of rows of each forward pass, all rows at
+                once if None.
+            exact: boolean, whether to predict with the float model even if the manager has
+                an inference precision.
+
+        Returns:
+            The predictions as np.ndarray.
+        """
+        x = self._as_tensor(x)
+        n = len(x)
+        out = self._prediction_buffer(n, output, out)
+
+        step = batch_size if batch_size is not None else max(n, 1)
+        if self._inference_precision is None or exact:
+            model, dtype = self._model, torch.float32
+            if model.training:
+                model.eval()
+        else:
+            model = self._get_inference_model()
+            dtype = torch.bfloat16 if self._inference_precision == 'bfloat16' else torch.float32
+        with torch.inference_mode():
+            for start in range(0, n, step):
+                pred = model(x[start: start + step].to(dtype))
+                if output != 'proba':
+                    pred = pred.argmax(axis=1)
+                torch.from_numpy(out[start: start + step]).copy_(pred)
+
+        if output == 'label':
+            return self._classes[out]
+        return out
 
     # TODO: remove this function in the later version.
-    def train(self, batch_size=32, epoch=40, lr=0.002, verbose=True, save_result=True):
-        """Train the model with an RMS optimizer."""
-        dataset = self.train_dataset
-        data_loader = DataLoader(
-            dataset=dataset, batch_size=batch_size, shuffle=True)
+    def train(self, batch_size=64, epoch=40, lr=0.002, verbose=True, save_result=True,
+              patience=5, metric='auc', validation_split=0.1, num_threads=None):
+        """Train the model with an RMS optimizer.
+
+        Args:
+            batch_size: number, the number of rows of each step.
+            epoch: number, the maximal number of epochs.
+            lr: number, the learning rate.
+            verbose: boolean, whether to print the loss and the validation score of each epoch.
+            save_result: boolean, whether to store the accuracies in the model meta.
+            patience: number or None, stop when the validation metric has not improved for
+                the given number of epochs and restore the best weights, or train for all
+                epochs if None.
+            metric: str, the validation metric of early stopping, see evaluate.
+            validation_split: number, the ratio of the training rows held out for early
+                stopping.
+            num_threads: number or None, the number of torch threads used during training.
+        """
+        X, y = self.train_dataset.tensors
+        valid_X, valid_y = None, None
+        if patience is not None:
+            # hold out a fixed part of the training rows for validation
+            index = torch.randperm(len(X), generator=torch.Generator().manual_seed(0))
+            valid_num = max(1, int(len(X) * validation_split))
+            valid_X, valid_y = X[index[:valid_num]], y[index[:valid_num]]
+            X, y = X[index[valid_num:]], y[index[valid_num:]]
 
         criterion = nn.BCELoss()
         optimizer = optim.RMSprop(self._model.parameters(), lr=lr)
-        for e in range(epoch):
-            self._model.train()
-
-            for x, target in data_loader:
-                optimizer.zero_grad()
-
-                pred = self._model(x)
-                loss = criterion(pred, target)
-                loss.backward()
-                optimizer.step()
-
-            if verbose:
-                print("Epoch: {}, loss={:.3f}, train_accuracy={:.3f}, test_accuracy={:.3f}".format(
-                    e, loss, self.evaluate('train'), self.evaluate('test')))
+        self._fingerprint = None
+        self._inference_model = None
+        default_threads = torch.get_num_threads()
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        best_score, best_state, stale = None, None, 0
+        try:
+            for e in range(epoch):
+                self._model.train()
+                # batches are sliced from the stored tensors by a shuffled index
+                index = torch.randperm(len(X))
+                for start in range(0, len(X), batch_size):
+                    batch = index[start: start + batch_size]
+                    optimizer.zero_grad()
+
+                    pred = self._model(X[batch])
+                    loss = criterion(pred, y[batch])
+                    loss.backward()
+                    optimizer.step()
+
+                if patience is None:
+                    if verbose:
+                        print("Epoch: {}, loss={:.3f}".format(e, loss))
+                else:
+                    score = self._metric(metric, valid_y,
+                                         self.predict(valid_X, output='proba', exact=True))
+                    if verbose:
+                        print("Epoch: {}, loss={:.3f}, validation_{}={:.3f}".format(
+                            e, loss, metric, score))
+                    if best_score is None or score > best_score:
+                        best_score, stale = score, 0
+                        best_state = {k: v.clone() for k, v in self._model.state_dict().items()}
+                    else:
+                        stale += 1
+                        if stale >= patience:
+                            if verbose:
+                                print("Early stopping at epoch {}, best validation {}={:.3f}"
+                                      .format(e, metric, best_score))
+                            break
+        finally:
+            torch.set_num_threads(default_threads)
+        if best_state is not None:
+            self._model.load_state_dict(best_state)
+        self._model.eval()
 
         if save_result:
             self._train_accuracy = float(self.evaluate('train'))
@@ -175,34 +398,51 @@ class PytorchModelManager(ModelManager):
             self._dir_manager.update_model_meta(train_accuracy=self._train_accuracy,
                                                 test_accuracy=self._test_accuracy)
 
-    def evaluate(self, dataset='test', metric='accuracy', batch_size=128):
-        """Evaluate the model from either the training dataset or testing dataset 
-        with the given metrics."""
+    def evaluate(self, dataset='test', metric='accuracy', batch_size=4096):
+        """Evaluate the (float) model from either the training dataset or testing dataset 
+        with the given metrics.
+
+        Args:
+            dataset: str, 'train' or 'test'.
+            metric: str or list, 'accuracy', 'f1', 'auc' (the one-vs-rest ROC AUC), or
+                'confusion_matrix' (rows: targets, columns: predictions), or a list of them.
+            batch_size: number, the number of rows of each forward pass.
+
+        Returns:
+            The value of the metric, or a dict of the values of the listed metrics.
+        """
         if dataset == 'test':
-            data_loader = DataLoader(
-                dataset=self.test_dataset, batch_size=batch_size, shuffle=True)
+            X, y = self.test_dataset.tensors
         elif dataset == 'train':
-            data_loader = DataLoader(
-                dataset=self.train_dataset, batch_size=batch_size, shuffle=True)
+            X, y = self.train_dataset.tensors
         else:
             raise ValueError("{} should be either 'train' or 'test'".format(dataset))
 
-        target_class = np.array([])
-        pred_class = np.array([])
+        proba = self.predict(X, output='proba', batch_size=batch_size, exact=True)
+        if isinstance(metric, str):
+            return self._metric(metric, y, proba)
+        return {m: self._metric(m, y, proba) for m in metric}
 
-        self._model.eval()
-
-        for x, target in data_loader:
-            pred = self._model(x)
-            pred = pred.argmax(axis=1).numpy()
-            target = target.argmax(axis=1).numpy()
-            target_class = np.concatenate((target_class, target))
-            pred_class = np.concatenate((pred_class, pred))
+    def validate_inference_model(self, dataset='test'):
+        """Compare the reduced-precision copy of the model with the float model.
 
-        if metric == 'accuracy':
-            return (target_class == pred_class).mean()
+        Returns:
+            A dict with the accuracies of the float model and of the copy, their difference
+            (copy - float), and the rate of rows where both predict the same class.
+        """
+        if dataset == 'test':
+            X, y = self.test_dataset.tensors
+        elif dataset == 'train':
+            X, y = self.train_dataset.tensors
         else:
-            raise NotImplementedError
+            raise ValueError("{} should be either 'train' or 'test'".format(dataset))
+        target = y.numpy().argmax(axis=1)
+        exact = self.predict(X, exact=True)
+        reduced = self.predict(X)
+        accuracy, float_accuracy = (reduced == target).mean(), (exact == target).mean()
+        return {'precision': self._inference_precision, 'float_accuracy': float(float_accuracy),
+                'accuracy': float(accuracy), 'accuracy_delta': float(accuracy - float_accuracy),
+                'agreement': float((reduced == exact).mean())}
 
     def save_model(self):
         """Save the model states."""
@@ -210,13 +450,232 @@ class PytorchModelManager(ModelManager):
         self._dir_manager.save_pytorch_model_state(self._model.state_dict())
 
     def save_reports(self):
-        """a tmp implemetation"""
+        """Save the reports on the whole dataset, the training dataset, and the test dataset.
+        With caching, the reports are only rebuilt when the cached predictions are out of date."""
+        report_names = ['dataset', 'train_dataset', 'test_dataset']
+        if not self._use_cache:
+            self.dir_manager.save_prediction(
+                self.report_on_instance('all'), 'dataset')
+            self.dir_manager.save_prediction(
+                self.report_on_instance('train'), 'train_dataset')
+            self.dir_manager.save_prediction(
+                self.report_on_instance('test'), 'test_dataset')
+            return
+
+        fingerprint = self.report_fingerprint()
+        if self._inference_precision is not None:
+            fingerprint = combine_fingerprints(fingerprint, self._inference_precision)
+        cache = self._dir_manager.cache
+        if cache.contains('pred_dataset', fingerprint) and \
+                all(self._dir_manager.has_prediction(name) for name in report_names):
+            return
+
+        # predict the whole dataset once and split the report into train and test
+        instances = self._dataset.get_subset(index='all', preprocess=False)
+        X = cache.get_or_create('X_all', self._data_fingerprint,
+                                lambda: self._dataset.preprocess_X(
+                                    instances[self._dataset.features]).values.astype(np.float32))
+        pred = self.predict(X, output='proba')
+        cache.save('pred_dataset', pred, fingerprint)
+
+        report_df = instances[self._dataset.columns].copy()
+        report_df[self._prediction] = self._classes[pred.argmax(axis=1)]
+        self.dir_manager.save_prediction(report_df, 'dataset')
         self.dir_manager.save_prediction(
-            self.report_on_instance('all'), 'dataset')
+            report_df.loc[self._dataset.get_train_X(preprocess=False).index], 'train_dataset')
         self.dir_manager.save_prediction(
-            self.report_on_instance('train'), 'train_dataset')
+            report_df.loc[self._dataset.get_test_X(preprocess=False).index], 'test_dataset')
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def dataset(self):
+        return self._dataset
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def inference_precision(self):
+        return self._inference_precision
+
+    @property
+    def train_accuracy(self):
+        return self._train_accuracy
+
+    @property
+    def test_accuracy(self):
+        return self._test_accuracy
+
+    @property
+    def dir_manager(self):
+        return self._dir_manager
+
+
+class SklearnModelManager(ModelManager):
+    """A class to store, train, evaluate, and apply a scikit-learn classifier, or any model
+    with fit and predict_proba (e.g. a pipeline or gradient-boosted trees), on the
+    preprocessed feature values.
+
+    The model is not differentiable: forward returns the probabilities without gradients, and
+    the counterfactual examples are searched by cf_engine.CFEngineGenetic.
+
+    Args:
+        dataset: dataset.Dataset, the target dataset.
+        model_name: str, name of the model.
+        root_dir: str, the path of the directory to store the model and relative information.
+        model: a classifier with fit and predict_proba or None, if model is none, a new
+            sklearn.ensemble.HistGradientBoostingClassifier will be created.
+    """
+
+    def __init__(self, dataset, model_name='GBT', root_dir=OUTPUT_ROOT, model=None):
+        self._dataset = dataset
+        self._name = model_name
+        self._dir_manager = DirectoryManager(self._dataset, model_name, root=root_dir)
+        self._features = self._dataset.dummy_features
+        self._target = self._dataset.dummy_target
+        self._prediction = "{}_pred".format(self._dataset.target)
+        self._classes = np.array(self._dataset.description[self._dataset.target]['categories'],
+                                 dtype=object)
+
+        if model is None:
+            from sklearn.ensemble import HistGradientBoostingClassifier
+            model = HistGradientBoostingClassifier()
+        self._model = model
+
+        # the targets are the class indices of the one-hot target columns
+        self._train_X = self._as_array(self.dataset.get_train_X())
+        self._train_y = self.dataset.get_train_y()[self._target].values.argmax(axis=1)
+        self._test_X = self._as_array(self.dataset.get_test_X())
+        self._test_y = self.dataset.get_test_y()[self._target].values.argmax(axis=1)
+
+        self._train_accuracy = None
+        self._test_accuracy = None
+        self._fingerprint = None
+        self._data_fingerprint = None
+
+    def report_fingerprint(self):
+        """Get a digest of the data and the model, which identifies the model outputs."""
+        if self._data_fingerprint is None:
+            self._data_fingerprint = dataset_fingerprint(self._dataset)
+        return combine_fingerprints(self._data_fingerprint, self.fingerprint())
+
+    def fingerprint(self):
+        """Get a digest of the pickled model."""
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha1(pickle.dumps(self._model)).hexdigest()
+        return self._fingerprint
+
+    def load_model(self):
+        """Load the pickled model."""
+        self._dir_manager.load_meta()
+        self._model = self._dir_manager.load_pickled_model()
+        self._fingerprint = None
+
+    def forward(self, x):
+        """Get the probabilities of the given data as a tensor, which does not track
+        gradients."""
+        return torch.from_numpy(self.predict(x, output='proba'))
+
+    def _as_array(self, x):
+        if isinstance(x, pd.DataFrame):
+            x = x[self._features].values
+        elif isinstance(x, torch.Tensor):
+            x = x.detach().numpy()
+        return np.ascontiguousarray(x, dtype=np.float32)
+
+    def predict(self, x, output='class', out=None, batch_size=None, exact=False):
+        """Predict preprocessed feature values by predict_proba.
+
+        Args:
+            x: np.ndarray, torch.Tensor or pd.DataFrame, the preprocessed feature values.
+            output: str, 'class' for the class indices, 'proba' for the class probabilities,
+                or 'label' for the target categories.
+            out: np.ndarray or None, a preallocated array to write the result into, of shape
+                (#rows, #classes) and dtype float32 for 'proba', or of shape (#rows,) and dtype
+                int64 for 'class'.
+            batch_size: number or None, the number of rows of each predict_proba call, all rows
+                at once if None.
+            exact: boolean, unused, the model is always applied as is.
+
+        Returns:
+            The predictions as np.ndarray.
+        """
+        x = self._as_array(x)
+        n = len(x)
+        out = self._prediction_buffer(n, output, out)
+        proba = out if output == 'proba' else np.empty((n, len(self._target)), np.float32)
+
+        # the columns of predict_proba are the classes seen in fit
+        classes = self._model.classes_
+        step = batch_size if batch_size is not None else max(n, 1)
+        for start in range(0, n, step):
+            pred = self._model.predict_proba(x[start: start + step])
+            if len(classes) == len(self._target):
+                proba[start: start + step] = pred
+            else:
+                proba[start: start + step] = 0
+                proba[start: start + step, classes] = pred
+
+        if output == 'proba':
+            return out
+        np.argmax(proba, axis=1, out=out)
+        if output == 'label':
+            return self._classes[out]
+        return out
+
+    def train(self, verbose=True, save_result=True, **fit_params):
+        """Fit the model on the training dataset.
+
+        Args:
+            verbose: boolean, whether to print the accuracies.
+            save_result: boolean, whether to store the accuracies in the model meta.
+            fit_params: the keyword arguments of the fit method of the model.
+        """
+        self._model.fit(self._train_X, self._train_y, **fit_params)
+        self._fingerprint = None
+
+        if verbose:
+            print("train_accuracy={:.3f}, test_accuracy={:.3f}".format(self.evaluate('train'),
+                                                                     self.evaluate('test')))
+        if save_result:
+            self._train_accuracy = float(self.evaluate('train'))
+            self._test_accuracy = float(self.evaluate('test'))
+            self._dir_manager.update_model_meta(train_accuracy=self._train_accuracy,
+                                                test_accuracy=self._test_accuracy)
+
+    def evaluate(self, dataset='test', metric='accuracy', batch_size=None):
+        """Evaluate the model from either the training dataset or testing dataset with the
+        given metrics, see PytorchModelManager.evaluate."""
+        if dataset == 'test':
+            X, y = self._test_X, self._test_y
+        elif dataset == 'train':
+            X, y = self._train_X, self._train_y
+        else:
+            raise ValueError("{} should be either 'train' or 'test'".format(dataset))
+
+        proba = self.predict(X, output='proba', batch_size=batch_size)
+        target = np.eye(len(self._target))[y]
+        if isinstance(metric, str):
+            return self._metric(metric, target, proba)
+        return {m: self._metric(m, target, proba) for m in metric}
+
+    def save_model(self):
+        """Save the pickled model."""
+        self._dir_manager.init_dir()
+        self._dir_manager.save_pickled_model(self._model)
+
+    def save_reports(self):
+        """Save the reports on the whole dataset, the training dataset, and the test dataset."""
+        report_df = self.report_on_instance('all')
+        self.dir_manager.save_prediction(report_df, 'dataset')
+        self.dir_manager.save_prediction(
+            report_df.loc[self._dataset.get_train_X(preprocess=False).index], 'train_dataset')
         self.dir_manager.save_prediction(
-            self.report_on_instance('test'), 'test_dataset')
+            report_df.loc[self._dataset.get_test_X(preprocess=False).index], 'test_dataset')
 
     @property
     def name(self):
@@ -226,6 +685,14 @@ class PytorchModelManager(ModelManager):
     def dataset(self):
         return self._dataset
 
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def inference_precision(self):
+        return None
+
     @property
     def train_accuracy(self):
         return self._train_accuracy
@@ -1,2 +1,6 @@
+from cf_ml.utils.cache import ArrayCache, dataset_fingerprint, model_fingerprint, \
+    combine_fingerprints
 from cf_ml.utils.dir_manager import DirectoryManager
-from cf_ml.utils.feature_range import unique_range
\ No newline at end of file
+from cf_ml.utils.feature_range import unique_range
+from cf_ml.utils.instrument import Collector, MemoryCollector, JsonLinesCollector, \
+    LoggingCollector, make_collector
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def dataset_fingerprint(dataset):
+    """Get a digest of the data, the description and the train/test split of a dataset."""
+    digest = hashlib.sha1()
+    digest.update(dataset.name.encode())
+    digest.update(json.dumps(dataset.description, sort_keys=True, default=str).encode())
+    digest.update(dataset.target.encode())
+    digest.update(pd.util.hash_pandas_object(dataset.data[dataset.columns], index=True).values
+                  .tobytes())
+    digest.update(np.asarray(dataset.get_train_X(preprocess=False).index).tobytes())
+    return digest.hexdigest()
+
+
+def model_fingerprint(model):
+    """Get a digest of the weights of a torch model."""
+    digest = hashlib.sha1()
+    for name, tensor in sorted(model.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def combine_fingerprints(*fingerprints):
+    """Combine several fingerprints into one."""
+    return hashlib.sha1('-'.join(fingerprints).encode()).hexdigest()
+
+
+class ArrayCache:
+    """A directory of fingerprinted numpy arrays stored as .npy files.
+
+    Each array is stored with the fingerprint of the inputs it was computed from. An array is
+    only returned if its fingerprint matches the requested one, and is memory-mapped so that
+    it can be attached to a tensor without copying.
+
+    Args:
+        cache_dir: str, the path of the directory to store the arrays.
+    """
+
+    def __init__(self, cache_dir):
+        self._dir = cache_dir
+
+    def _array_path(self, name):
+        return os.path.join(self._dir, '{}.npy'.format(name))
+
+    def _fingerprint_path(self, name):
+        return os.path.join(self._dir, '{}.fingerprint'.format(name))
+
+    def get_fingerprint(self, name):
+        """Get the fingerprint of a stored array, or None if the array does not exist."""
+        if not os.path.exists(self._array_path(name)):
+            return None
+        try:
+            with open(self._fingerprint_path(name)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def contains(self, name, fingerprint):
+        """Check whether an array with the given fingerprint is stored."""
+        return self.get_fingerprint(name) == fingerprint
+
+    def load(self, name, fingerprint, mmap_mode='c'):
+        """Load an array if it is stored with the given fingerprint, otherwise return None.
+        The default 'c' (copy-on-write) mode maps the file without copying while keeping
+        the array writable."""
+        if not self.contains(name, fingerprint):
+            return None
+        return np.load(self._array_path(name), mmap_mode=mmap_mode)
+
+    def save(self, name, array, fingerprint):
+        """Store an array with its fingerprint."""
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+        array_path = self._array_path(name)
+        tmp_path = '{}.{}.tmp'.format(array_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        # invalidate the old fingerprint first so that a partial update is never trusted
+        if os.path.exists(self._fingerprint_path(name)):
+            os.remove(self._fingerprint_path(name))
+        os.replace(tmp_path, array_path)
+        with open(self._fingerprint_path(name), 'w') as f:
+            f.write(fingerprint)
+
+    def get_or_create(self, name, fingerprint, create, mmap_mode='c'):
+        """Load an array from the cache, or create, store and load it if it is missing
+        or out of date."""
+        array = self.load(name, fingerprint, mmap_mode)
+        if array is None:
+            self.save(name, create(), fingerprint)
+            array = self.load(name, fingerprint, mmap_mode)
+        return array
+
+    def clear(self):
+        """Remove all stored arrays."""
+        if not os.path.exists(self._dir):
+            return
+        for filename in os.listdir(self._dir):
+            os.remove(os.path.join(self._dir, filename))
+
+    @property
+    def dir(self):
+        return self._dir
@@ -1,18 +1,45 @@
 import os
 import io
 import json
+import pickle
 import shutil
 import collections
-import torch
+import contextlib
+import threading
 import pandas as pd
 import numpy as np
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cf_ml.utils.cache import ArrayCache
 from cf_ml.utils.feature_range import tokenize
+from cf_ml.utils.profiler import list_profiles
 
 OUTPUT_ROOT = os.path.join('../../', os.path.dirname(__file__), 'output')
 
+
+def atomic_write(path, write):
+    """Write a file through a temporary file in the same directory, which then replaces the
+    file, so that readers never see a partially written file."""
+    tmp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 class DirectoryManager:
-    """A class to save and load output files."""
+    """A class to save and load output files.
+
+    The index of the cached r-counterfactuals (meta.json) may be shared by several threads and
+    processes. It is only read and written under a lock (an flock on meta.lock across
+    processes), reloaded when another writer changed it, and replaced atomically.
+    """
 
     def __init__(self, dataset, model_name, root=OUTPUT_ROOT):
         self._root = root
@@ -34,6 +61,11 @@ class DirectoryManager:
                            'test_accuracy': None}
         self._universal_range = self._dataset.get_universal_range()
         self._cf_setting = []
+        self._subset_fingerprint = None
+        self._meta_stamp = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._cache = ArrayCache(os.path.join(self._dir, 'cache'))
     
     @property
     def model_name(self):
@@ -43,26 +75,82 @@ class DirectoryManager:
     def dataset_name(self):
         return self._dataset.name
 
-    def load_meta(self):
-        meta_path = os.path.join(self._dir, 'meta.json')
-        with open(meta_path) as f:
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the lock of the directory, reentrant within a thread."""
+        with self._lock:
+            if self._lock_depth > 0 or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(os.path.join(self._dir, 'meta.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _meta_path(self):
+        return os.path.join(self._dir, 'meta.json')
+
+    def _stat_meta(self):
+        try:
+            stat = os.stat(self._meta_path())
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _refresh_subset_meta(self):
+        """Reload the index of the cached r-counterfactuals if another writer changed it."""
+        stamp = self._stat_meta()
+        if stamp is None or stamp == self._meta_stamp:
+            return
+        with open(self._meta_path()) as f:
             meta_info = json.load(f)
-        self._data_meta = meta_info['data_meta']
-        self._model_meta = meta_info['model_meta']
         self._cf_setting = meta_info['cf_setting']
+        self._subset_fingerprint = meta_info.get('subset_fingerprint')
+        self._meta_stamp = stamp
+
+    def load_meta(self):
+        with self._locked():
+            with open(self._meta_path()) as f:
+                meta_info = json.load(f)
+            self._data_meta = meta_info['data_meta']
+            self._model_meta = meta_info['model_meta']
+            self._cf_setting = meta_info['cf_setting']
+            self._subset_fingerprint = meta_info.get('subset_fingerprint')
+            self._meta_stamp = self._stat_meta()
 
     def update_model_meta(self, **kwargs):
         self._model_meta = {'name': self._model_name, **kwargs}
 
     def save_meta(self):
-        with open(os.path.join(self._dir, 'meta.json'), 'w') as f:
-            f.write(json.dumps({'data_meta': self._data_meta,
-                                'model_meta': self._model_meta, 'cf_setting': self._cf_setting}))
+        with self._locked():
+            self._refresh_subset_meta()
+            self._write_meta()
+
+    def _write_meta(self):
+        content = json.dumps({'data_meta': self._data_meta,
+                              'model_meta': self._model_meta, 'cf_setting': self._cf_setting,
+                              'subset_fingerprint': self._subset_fingerprint})
+
+        def write(path):
+            with open(path, 'w') as f:
+                f.write(content)
+
+        atomic_write(self._meta_path(), write)
+        self._meta_stamp = self._stat_meta()
 
     def _get_model_path(self):
         return os.path.join(self._dir, '{}'.format(self._model_meta['name']))
 
     def save_pytorch_model_state(self, model_state):
+        import torch
         if self._model_meta['test_accuracy'] is not None:
             old_model_path = self._get_model_path()
             if os.path.exists(old_model_path):
@@ -74,9 +162,30 @@ class DirectoryManager:
         self.save_meta()
 
     def load_pytorch_model_state(self):
+        import torch
         model_path = self._get_model_path()
         return torch.load(model_path)
 
+    def save_pickled_model(self, model):
+        if self._model_meta['test_accuracy'] is not None:
+            old_model_path = self._get_model_path()
+            if os.path.exists(old_model_path):
+                os.remove(old_model_path)
+
+        def write(path):
+            with open(path, 'wb') as f:
+                pickle.dump(model, f)
+
+        atomic_write(self._get_model_path(), write)
+        self.save_meta()
+
+    def load_pickled_model(self):
+        with open(self._get_model_path(), 'rb') as f:
+            return pickle.load(f)
+
+    def has_prediction(self, dataset_name='dataset'):
+        return os.path.exists(os.path.join(self._dir, dataset_name+'.csv'))
+
     def save_prediction(self, data_df, dataset_name='dataset'):
         """ a tmp implementation
         :param dataset_name: str, in ['dataset', 'train_dataset', 'test_dataset']
@@ -90,41 +199,62 @@ class DirectoryManager:
         data_df = pd.read_csv(os.path.join(self._dir, dataset_name+'.csv'), index_col=0)
         return data_df
 
+    def list_profiles(self):
+        return list_profiles(self.profile_dir)
+
     def include_setting(self, data_range, feature_range):
         return self.find_setting(data_range, feature_range) > -1
     
     def find_setting(self, data_range, feature_range):
+        with self._locked():
+            self._refresh_subset_meta()
+            cf_setting = list(self._cf_setting)
         index = -1
-        for i, (d, f) in enumerate(self._cf_setting):
-            if tokenize(d, f, self._universal_range) == \
-                    tokenize(data_range, feature_range, self._universal_range):
+        token = tokenize(data_range, feature_range, self._universal_range)
+        for i, (d, f) in enumerate(cf_setting):
+            if tokenize(d, f, self._universal_range) == token:
                 index = i
         return index
 
     def load_subset_cf(self, data_range, feature_range):
-        index = self.find_setting(data_range, feature_range)
-        if index == -1:
-            raise KeyError("Subset does not exist.")
-        cf_path = os.path.join(self._dir, "subset_{}.csv".format(index))
-        return pd.read_csv(cf_path)
+        with self._locked():
+            index = self.find_setting(data_range, feature_range)
+            if index == -1:
+                raise KeyError("Subset does not exist.")
+            cf_path = os.path.join(self._dir, "subset_{}.csv".format(index))
+            return pd.read_csv(cf_path)
 
     def save_subset_cf(self, data_range, feature_range, subset_report):
-        index = self.find_setting(data_range, feature_range)
-        if index == -1:
-            index = len(self._cf_setting)
-            self._cf_setting.append((data_range, feature_range))
-        else:
-            print("Overwrite")
-        cf_path = os.path.join(self._dir, "subset_{}.csv".format(index))
-        subset_report.to_csv(cf_path)
-        self.save_meta()
-
-    def clean_subset_cache(self):
-        for index in range(len(self._cf_setting)):
+        with self._locked():
+            index = self.find_setting(data_range, feature_range)
+            if index == -1:
+                index = len(self._cf_setting)
+                self._cf_setting.append((data_range, feature_range))
+            else:
+                print("Overwrite")
             cf_path = os.path.join(self._dir, "subset_{}.csv".format(index))
-            os.remove(cf_path)
-        self._cf_setting = []
-        self.save_meta()
+            atomic_write(cf_path, subset_report.to_csv)
+            self._write_meta()
+
+    def clean_subset_cache(self, fingerprint=None):
+        """Remove the cached r-counterfactuals. With a fingerprint (of the data and the model),
+        the cache is kept if it was built with the same fingerprint.
+
+        Returns:
+            Whether the cache has been removed.
+        """
+        with self._locked():
+            self._refresh_subset_meta()
+            if fingerprint is not None and fingerprint == self._subset_fingerprint:
+                return False
+            for index in range(len(self._cf_setting)):
+                cf_path = os.path.join(self._dir, "subset_{}.csv".format(index))
+                if os.path.exists(cf_path):
+                    os.remove(cf_path)
+            self._cf_setting = []
+            self._subset_fingerprint = fingerprint
+            self._write_meta()
+            return True
 
     def ensure_dir(self, dir_path=None):
         if dir_path is None:
@@ -146,3 +276,15 @@ class DirectoryManager:
     @property
     def model_meta(self):
         return self._model_meta
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def tuning_path(self):
+        return os.path.join(self._dir, 'batch_size.json')
+
+    @property
+    def profile_dir(self):
+        return os.path.join(self._dir, 'profiles')
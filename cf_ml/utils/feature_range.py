@@ -1,4 +1,5 @@
 import copy
+import hashlib
 import json
 
 
@@ -26,3 +27,10 @@ def tokenize(data_range, feature_range, universal_range):
     feature_range_token = hash(json.dumps(unique_feature_range, sort_keys=True))
     token = (data_range_token << 1) + feature_range_token
     return token
+
+
+def canonical_key(data_range, universal_range):
+    """Get a digest of a range that is stable across processes, unlike the token from tokenize,
+    which relies on the salted built-in hash."""
+    unique_data_range = unique_range(data_range, universal_range)
+    return hashlib.sha1(json.dumps(unique_data_range, sort_keys=True).encode()).hexdigest()
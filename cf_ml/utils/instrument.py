@@ -0,0 +1,192 @@
+import collections
+import contextlib
+import json
+import logging
+import threading
+import timeit
+
+
+class Collector:
+    """The base class of the collectors of instrumentation records.
+
+    A record is a dict with the name of the instrumented run, its tags, the total seconds spent
+    in each phase, the number of times each phase was entered, and the counters.
+    """
+
+    def collect(self, record):
+        raise NotImplementedError
+
+
+class MemoryCollector(Collector):
+    """A collector that aggregates records in memory.
+
+    Args:
+        max_records: number, the number of the latest records to keep.
+    """
+
+    def __init__(self, max_records=1000):
+        self._lock = threading.Lock()
+        self._records = collections.deque(maxlen=max_records)
+        self._runs = collections.Counter()
+        self._phases = {}
+        self._counters = collections.Counter()
+
+    def collect(self, record):
+        with self._lock:
+            self._records.append(record)
+            self._runs[record['name']] += 1
+            for phase, seconds in record['phases'].items():
+                key = '{}.{}'.format(record['name'], phase)
+                stat = self._phases.setdefault(key, {'count': 0, 'total': 0., 'max': 0.})
+                stat['count'] += record['phase_counts'][phase]
+                stat['total'] += seconds
+                stat['max'] = max(stat['max'], seconds)
+            for counter, value in record['counters'].items():
+                self._counters['{}.{}'.format(record['name'], counter)] += value
+
+    def summary(self):
+        """Get the number of runs, the phase statistics and the counter totals."""
+        with self._lock:
+            phases = {key: {**stat, 'mean': stat['total'] / stat['count'] if stat['count'] else 0}
+                      for key, stat in self._phases.items()}
+            return {'runs': dict(self._runs), 'phases': phases, 'counters': dict(self._counters)}
+
+    @property
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+            self._runs.clear()
+            self._phases.clear()
+            self._counters.clear()
+
+
+class JsonLinesCollector(Collector):
+    """A collector that appends each record as a line of JSON to a file.
+
+    Args:
+        path: str, the path of the file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def collect(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            with open(self._path, 'a') as f:
+                f.write(line)
+
+
+class LoggingCollector(Collector):
+    """A collector that writes each record to a logger.
+
+    Args:
+        logger: logging.Logger or None, defaults to the 'cf_ml.instrument' logger.
+        level: number, the logging level.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self._logger = logger if logger is not None else logging.getLogger('cf_ml.instrument')
+        self._level = level
+
+    def collect(self, record):
+        phases = ', '.join('{}={:.3f}s'.format(k, v) for k, v in record['phases'].items())
+        counters = ', '.join('{}={}'.format(k, v) for k, v in record['counters'].items())
+        self._logger.log(self._level, "%s %s | %s | %s", record['name'],
+                         json.dumps(record['tags'], default=str), phases, counters)
+
+
+def make_collector(spec):
+    """Create a collector from a spec: None, 'memory', 'logging', 'jsonl:<path>', or a
+    Collector, which is returned as it is."""
+    if spec is None or isinstance(spec, Collector):
+        return spec
+    if spec == 'memory':
+        return MemoryCollector()
+    if spec == 'logging':
+        return LoggingCollector()
+    if spec.startswith('jsonl:'):
+        return JsonLinesCollector(spec[len('jsonl:'):])
+    raise ValueError("Unknown collector: {}".format(spec))
+
+
+class Instrument:
+    """Timing of phases and counters of one instrumented run.
+
+    Phases can be entered several times, e.g. once per batch, and their time is accumulated.
+    Phases can be nested, in which case the time of the inner phase is also counted in the
+    outer one.
+
+    Args:
+        collector: Collector, the collector to emit the record to.
+        name: str, the name of the run.
+        tags: additional information of the run, e.g. the number of instances.
+    """
+
+    enabled = True
+
+    def __init__(self, collector, name, **tags):
+        self._collector = collector
+        self._name = name
+        self._tags = tags
+        self._phases = collections.OrderedDict()
+        self._phase_counts = collections.Counter()
+        self._counters = collections.Counter()
+        self._start = timeit.default_timer()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        checkpoint = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self._phases[name] = self._phases.get(name, 0.) + timeit.default_timer() - checkpoint
+            self._phase_counts[name] += 1
+
+    def count(self, name, value=1):
+        self._counters[name] += int(value)
+
+    def tag(self, **tags):
+        self._tags.update(tags)
+
+    def finish(self):
+        """Emit the record of the run to the collector."""
+        self._collector.collect({'name': self._name, 'tags': self._tags,
+                                 'total': timeit.default_timer() - self._start,
+                                 'phases': dict(self._phases),
+                                 'phase_counts': dict(self._phase_counts),
+                                 'counters': dict(self._counters)})
+
+
+class _NullInstrument:
+    """An instrument that records nothing, used when instrumentation is disabled."""
+
+    enabled = False
+    _null_context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._null_context
+
+    def count(self, name, value=1):
+        pass
+
+    def tag(self, **tags):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_INSTRUMENT = _NullInstrument()
+
+
+def make_instrument(collector, name, **tags):
+    """Create an instrument for a run, or the null instrument if the collector is None."""
+    if collector is None:
+        return NULL_INSTRUMENT
+    return Instrument(collector, name, **tags)
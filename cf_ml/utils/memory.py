@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The peak resident set size is process-wide: the measurements of its growth hold this lock so
+# that they do not reset each other's peaks.
+PEAK_RSS_LOCK = threading.Lock()
+
+
+def available_memory():
+    """Get the memory available to new allocations in bytes (MemAvailable on Linux), or None
+    if it is unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def current_rss():
+    """Get the resident set size of the process in bytes, or None if it is unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """Get the peak resident set size of the process in bytes, since the start or the last
+    reset_peak_rss, or None if it is unknown."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of the process to the current one (Linux only). The
+    peak is process-wide, so a reset also affects the peaks read by other threads, which
+    should hold PEAK_RSS_LOCK between the reset and the read.
+
+    Returns:
+        True if the peak has been reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,129 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+from datetime import datetime
+
+_active = threading.local()
+# torch.profiler is process-global, only one thread can hold a torch trace session at a time
+_torch_session = threading.Lock()
+
+
+class Profiler:
+    """A class to capture a torch.profiler trace (Chrome trace JSON) and a cProfile dump of a
+    single call.
+
+    The files are named '<timestamp>_<name>.trace.json', '<timestamp>_<name>.pstats' and
+    '<timestamp>_<name>.txt' (the top functions by cumulative time). Profilers do not nest:
+    a profiler started while another one is active in the same thread records nothing. The torch
+    trace is process-global: while another thread holds a trace session, a profiler skips its
+    torch trace with a warning and only captures the cProfile dump.
+
+    Args:
+        output_dir: str, the directory to store the profiles.
+        name: str, the name of the profiled call.
+        torch_trace: boolean, whether to capture a torch.profiler trace.
+        python_profile: boolean, whether to capture a cProfile dump.
+    """
+
+    def __init__(self, output_dir, name, torch_trace=True, python_profile=True):
+        self._output_dir = output_dir
+        self._prefix = '{}_{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+                                      re.sub(r'[^\w\-]', '_', name))
+        self._torch_trace = torch_trace
+        self._python_profile = python_profile
+        self._torch_profiler = None
+        self._cprofile = None
+        self._owner = False
+        self._torch_owner = False
+        self.files = []
+
+    def start(self):
+        if getattr(_active, 'profiling', False):
+            return self
+        _active.profiling = True
+        self._owner = True
+        if self._torch_trace and not _torch_session.acquire(blocking=False):
+            logging.warning("A torch.profiler session is already active, skipping the torch "
+                            "trace of {}.".format(self._prefix))
+        elif self._torch_trace:
+            self._torch_owner = True
+            import torch.profiler
+            try:
+                self._torch_profiler = torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU])
+                self._torch_profiler.__enter__()
+            except Exception:
+                self._torch_profiler = None
+                self._release_torch_session()
+                raise
+        if self._python_profile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def stop(self):
+        """Stop profiling and store the profiles.
+
+        Returns:
+            A list of the paths of the stored files.
+        """
+        if not self._owner:
+            return self.files
+        self._owner = False
+        _active.profiling = False
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._torch_profiler is not None:
+            try:
+                self._torch_profiler.__exit__(None, None, None)
+            finally:
+                self._release_torch_session()
+
+        if not os.path.exists(self._output_dir):
+            os.makedirs(self._output_dir)
+        if self._torch_profiler is not None:
+            path = os.path.join(self._output_dir, self._prefix + '.trace.json')
+            self._torch_profiler.export_chrome_trace(path)
+            self.files.append(path)
+        if self._cprofile is not None:
+            path = os.path.join(self._output_dir, self._prefix + '.pstats')
+            self._cprofile.dump_stats(path)
+            self.files.append(path)
+
+            stream = io.StringIO()
+            pstats.Stats(self._cprofile, stream=stream).sort_stats('cumulative').print_stats(40)
+            path = os.path.join(self._output_dir, self._prefix + '.txt')
+            with open(path, 'w') as f:
+                f.write(stream.getvalue())
+            self.files.append(path)
+        return self.files
+
+    def _release_torch_session(self):
+        if self._torch_owner:
+            self._torch_owner = False
+            _torch_session.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def list_profiles(output_dir):
+    """List the stored profiles, grouped by the profiled call, from the latest."""
+    if not os.path.exists(output_dir):
+        return []
+    profiles = {}
+    for filename in os.listdir(output_dir):
+        prefix = filename.split('.')[0]
+        path = os.path.join(output_dir, filename)
+        profile = profiles.setdefault(prefix, {'id': prefix, 'files': [], 'size': 0,
+                                               'created': os.path.getmtime(path)})
+        profile['files'].append(filename)
+        profile['size'] += os.path.getsize(path)
+    return sorted(profiles.values(), key=lambda p: p['id'], reverse=True)
@@ -1,9 +1,25 @@
+import io
+import json
 import logging
+import os
+
+import numpy as np
+import pandas as pd
 
 from flask.json import JSONEncoder
-from flask import request, jsonify, Blueprint, current_app, Response
+from flask import request, jsonify, Blueprint, current_app, Response, g, send_from_directory, \
+    stream_with_context
+from werkzeug.local import LocalProxy
+
+from cf_ml.utils.feature_range import canonical_key
+from cf_ml.utils.profiler import Profiler
 
-from .helpers import trans_data_meta
+from . import jobs
+from .data_table import FORMATS
+from .encoding import negotiate_encoding, negotiate_format, available_formats, \
+    encode_tables, column_categories, WIRE_FORMATS
+from .helpers import trans_data_meta, trans_filters, trans_setting
+from .response_cache import canonical_digest
 
 api = Blueprint('api', __name__)
 
@@ -52,73 +68,494 @@ class BetterJSONEncoder(JSONEncoder):
 # inject a more powerful jsonEncoder
 api.json_encoder = BetterJSONEncoder
 
+PROFILE_HEADER = 'X-Profile'
+
+
+def _get_serving():
+    context = g.get('serving')
+    return context if context is not None else current_app.context
+
+
+# the serving context (dataset, model, engine...) of the requested dataset/model pair
+serving = LocalProxy(_get_serving)
+
+
+@api.url_value_preprocessor
+def pull_serving_ids(endpoint, values):
+    if values is not None and 'data_id' in values:
+        g.serving_ids = (values.pop('data_id'), values.pop('model_id'))
+
+
+@api.before_request
+def check_ready():
+    """Get the serving context of the requested dataset/model pair, and answer 503 until it
+    is loaded."""
+    if 'serving_ids' in g:
+        try:
+            g.serving = current_app.registry.get(*g.serving_ids)
+        except KeyError as e:
+            raise ApiError(e.args[0], 404)
+    if not request.endpoint.endswith('.get_health') and not serving.ready.is_set():
+        response = jsonify(serving.health())
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+
+@api.teardown_request
+def release_serving(exception):
+    # the context is closed after its last request if it has been evicted meanwhile
+    context = g.pop('serving', None)
+    if context is not None:
+        context.release()
+
+
+@api.route('/health', methods=['GET'])
+def get_health():
+    """Get the readiness of the server, 200 if ready and 503 otherwise."""
+    health = serving.health()
+    return jsonify(health), 200 if health['status'] == 'ready' else 503
+
+
+@api.route('/registry', methods=['GET'])
+def get_registry():
+    return jsonify(current_app.registry.stats())
+
+
+@api.before_request
+def start_profiler():
+    """Profile the request if the server runs in debug mode and the profile header is set."""
+    if current_app.debug and request.headers.get(PROFILE_HEADER):
+        g.profiler = Profiler(serving.dir_manager.profile_dir,
+                              request.endpoint or request.path).start()
+
+
+@api.after_request
+def stop_profiler(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        files = profiler.stop()
+        response.headers[PROFILE_HEADER] = ', '.join(os.path.basename(f) for f in files)
+    return response
+
+
+@api.teardown_request
+def teardown_profiler(exception):
+    # stop the profiler of a request failed with an unhandled exception
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
 
 @api.route('/data_meta', methods=['GET'])
 def get_data_meta():
-    data_meta = trans_data_meta(current_app.dir_manager.dataset_meta)
+    data_meta = trans_data_meta(serving.dir_manager.dataset_meta)
     return jsonify(data_meta)
 
 
 @api.route('/cf_meta', methods=['GET'])
 def get_cf_meta():
-    data_meta = trans_data_meta(current_app.dir_manager.dataset_meta)
+    data_meta = trans_data_meta(serving.dir_manager.dataset_meta)
     return jsonify(data_meta)
 
 
 @api.route('/data', methods=['GET'])
 def get_data():
-    data_df = current_app.dir_manager.load_prediction('dataset')
-    return Response(data_df.to_csv(index=False), mimetype="text/csv")
+    """Get the prediction table.
+
+    Query args:
+        format: 'csv' (default), 'columns' (the column-packed binary format) or 'arrow'.
+        columns: comma-separated names of the columns to include.
+        start, stop: the row range.
+    """
+    table = serving.prediction_table
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ApiError("Unknown format: {}.".format(fmt), 400)
+    columns = request.args.get('columns')
+    columns = columns.split(',') if columns else None
+    start = request.args.get('start', None, type=int)
+    stop = request.args.get('stop', None, type=int)
+    encoding = negotiate_encoding(request.accept_encodings)
+
+    try:
+        body, etag = table.encode(fmt, columns, start, stop, encoding)
+    except KeyError as e:
+        raise ApiError(e.args[0], 400)
+    except ImportError as e:
+        raise ApiError(str(e), 406)
+
+    headers = {'ETag': '"{}"'.format(etag), 'Vary': 'Accept-Encoding',
+               'X-Total-Rows': str(len(table))}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype=FORMATS[fmt], headers=headers)
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    collector = serving.collector
+    if not hasattr(collector, 'summary'):
+        raise ApiError("Metrics are not collected in memory.", 404)
+    return jsonify(collector.summary())
+
+
+@api.route('/profiles', methods=['GET'])
+def get_profiles():
+    return jsonify(serving.dir_manager.list_profiles())
+
+
+@api.route('/profiles/<path:filename>', methods=['GET'])
+def get_profile(filename):
+    return send_from_directory(serving.dir_manager.profile_dir, filename, as_attachment=True)
+
+
+def _wire_format():
+    """Get the wire format of the response, from the 'format' query argument or negotiated
+    from the Accept header."""
+    fmt = request.args.get('format')
+    if fmt is None:
+        try:
+            return negotiate_format(request.accept_mimetypes)
+        except ValueError as e:
+            raise ApiError(str(e), 406)
+    if fmt not in available_formats():
+        raise ApiError("Unsupported format: {}.".format(fmt), 406)
+    return fmt
+
+
+def _encode_frames(fmt, tables, meta=None):
+    """Encode named dataframes in a binary wire format, with dictionary-encoded categorical
+    columns and float32 numerical columns."""
+    categories = column_categories(serving.dataset, tables[0][1].columns)
+    return encode_tables(fmt, tables, categories, meta)
 
 
 @api.route('/r_counterfactuals', methods=['POST'])
 def get_cf_subset():
+    """Get the r-counterfactuals of a subset, as JSON rows by default, or as one table per
+    feature in a binary format if requested (see server/encoding.py)."""
+    request_params = request.get_json()
+    fmt = _wire_format()
+    filters = trans_filters(request_params["filters"], serving.dataset)
+    index = serving.dataset.get_subset(filters=filters, preprocess=False).index.tolist()
+    r_counterfactuals = serving.cf_engine.generate_r_counterfactuals(filters, True, True,
+                                                                     verbose=True)
+    if fmt == 'json':
+        r_counterfactuals_data = [r_counterfactuals.subsets[f].all.values.tolist() for f in
+                                  serving.dataset.features]
+        response = jsonify({'index': index, 'counterfactuals': r_counterfactuals_data})
+    else:
+        tables = [(f, r_counterfactuals.subsets[f].all) for f in serving.dataset.features]
+        response = Response(_encode_frames(fmt, tables, {'index': index}),
+                            mimetype=WIRE_FORMATS[fmt])
+    response.vary.add('Accept')
+    return response
+
+
+def _stream_messages(messages, sse=False):
+    """Encode messages as newline-delimited JSON or as Server-Sent Events."""
+    for message in messages:
+        data = json.dumps(message, cls=BetterJSONEncoder)
+        if sse:
+            yield 'event: {}\ndata: {}\n\n'.format(message['type'], data)
+        else:
+            yield data + '\n'
+
+
+@api.route('/r_counterfactuals/stream', methods=['POST'])
+def stream_cf_subset():
+    """Stream r-counterfactuals as NDJSON, or as Server-Sent Events if requested with
+    'Accept: text/event-stream'. The subset index is sent first, then the counterfactuals of
+    each feature as soon as they are ready, and finally an end message."""
+    request_params = request.get_json()
+    context = serving._get_current_object()
+    filters = trans_filters(request_params["filters"], context.dataset)
+    subset = context.dataset.get_subset(filters=filters, preprocess=False)
+    sse = request.accept_mimetypes.best_match(
+        ['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+
+    def messages():
+        yield {'type': 'index', 'index': subset.index.tolist(),
+               'features': context.dataset.features}
+        for feature, subset_cf in context.cf_engine.iter_r_counterfactuals(filters, True, True,
+                                                                           False, subset):
+            yield {'type': 'counterfactuals', 'feature': feature,
+                   'counterfactuals': subset_cf.all.values.tolist()}
+        yield {'type': 'end'}
+
+    response = Response(stream_with_context(_stream_messages(messages(), sse)),
+                        mimetype='text/event-stream' if sse else 'application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    # disable response buffering of nginx-like proxies
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _request_features(request_params, dataset):
+    features = request_params.get('features', dataset.features)
+    unknown = [f for f in features if f not in dataset.features]
+    if len(unknown) > 0:
+        raise ApiError("Unknown features: {}.".format(unknown), 400)
+    return features
+
+
+@api.route('/r_counterfactuals/summary', methods=['POST'])
+def get_cf_subset_summary():
+    """Get the aggregated r-counterfactuals of a subset: for each released feature, the
+    validity rate, and the change frequencies, histograms and category transitions of the
+    features. The payload size does not depend on the size of the subset."""
+    from cf_ml.cf_engine.summary import summarize_r_counterfactuals, DEFAULT_BINS
+
+    request_params = request.get_json()
+    context = serving._get_current_object()
+    filters = trans_filters(request_params["filters"], context.dataset)
+    features = _request_features(request_params, context.dataset)
+    n_bins = request_params.get('bins', DEFAULT_BINS)
+
+    def compute():
+        subset = context.dataset.get_subset(filters=filters, preprocess=False)
+        r_counterfactuals = context.cf_engine.iter_r_counterfactuals(filters, True, True, False,
+                                                                     subset)
+        summary = summarize_r_counterfactuals(context.dataset, subset, r_counterfactuals,
+                                              features, n_bins)
+        return json.dumps({'instances': len(subset), 'summary': summary},
+                          cls=BetterJSONEncoder)
+
+    return _cached_response([canonical_key(filters, context.dataset.get_universal_range()),
+                             features, n_bins], compute, 'application/json')
+
+
+@api.route('/r_counterfactuals/rows', methods=['POST'])
+def get_cf_subset_rows():
+    """Get the raw r-counterfactuals of a subset where the range of the given features are
+    released, in the format of /r_counterfactuals."""
+    request_params = request.get_json()
+    fmt = _wire_format()
+    context = serving._get_current_object()
+    filters = trans_filters(request_params["filters"], context.dataset)
+    features = _request_features(request_params, context.dataset)
+    subset = context.dataset.get_subset(filters=filters, preprocess=False)
+    tables = [(feature, subset_cf.all) for feature, subset_cf in
+              context.cf_engine.iter_r_counterfactuals(filters, True, True, False, subset,
+                                                       features)]
+    index = subset.index.tolist()
+    if fmt == 'json':
+        response = jsonify({'index': index, 'features': features,
+                            'counterfactuals': [cfs.values.tolist() for _, cfs in tables]})
+    else:
+        response = Response(_encode_frames(fmt, tables, {'index': index}),
+                            mimetype=WIRE_FORMATS[fmt])
+    response.vary.add('Accept')
+    return response
+
+
+def _run_r_counterfactuals_job(context, filters):
+    def run(job):
+        subset = context.dataset.get_subset(filters=filters, preprocess=False)
+        counterfactuals = {}
+        for feature, subset_cf in context.cf_engine.iter_r_counterfactuals(filters, True, True,
+                                                                           False, subset):
+            counterfactuals[feature] = subset_cf.all.values.tolist()
+            job.advance(feature)
+        return {'index': subset.index.tolist(),
+                'counterfactuals': [counterfactuals[f] for f in context.dataset.features]}
+
+    return run
+
+
+@api.route('/r_counterfactuals/jobs', methods=['POST'])
+def submit_cf_subset_job():
+    """Enqueue an r-counterfactuals job. Jobs with the same subset range are deduplicated,
+    and each request gets a subscription token to cancel its interest in the job."""
     request_params = request.get_json()
-    filters = request_params["filters"]
-    num_filters = {f["name"]: {"min": f.get("extent", [0, 0])[0],
-                               "max": f.get("extent", [0, 0])[1]} for f in filters if
-                   current_app.dataset.is_num(f["name"])}
-    cat_filters = {f["name"]: {"categories": [str(cat) for cat in f['categories']] if f[
-                                                                                          'categories'] is not None else 'all'}
-                   for f in filters
-                   if not current_app.dataset.is_num(f["name"])}
-    filters = {**num_filters, **cat_filters}
-    index = current_app.dataset.get_subset(filters=filters).index.tolist()
-    r_counterfactuals = current_app.cf_engine.generate_r_counterfactuals(filters, True, True,
-                                                                         verbose=True)
-    r_counterfactuals_data = [r_counterfactuals.subsets[f].all.values.tolist() for f in
-                              current_app.dataset.features]
-    return jsonify({'index': index, 'counterfactuals': r_counterfactuals_data})
+    context = serving._get_current_object()
+    filters = trans_filters(request_params["filters"], context.dataset)
+    key = canonical_key(filters, context.dataset.get_universal_range())
+    job, token = context.jobs.submit(key, _run_r_counterfactuals_job(context, filters),
+                                     total=len(context.dataset.features))
+    return jsonify({**job.to_dict(), 'subscription': token}), 202
+
+
+def _get_job(job_id):
+    job = serving.jobs.get(job_id)
+    if job is None:
+        raise ApiError("Job {} does not exist.".format(job_id), 404)
+    return job
+
+
+@api.route('/r_counterfactuals/jobs/<job_id>', methods=['GET'])
+def get_cf_subset_job(job_id):
+    return jsonify(_get_job(job_id).to_dict())
+
+
+@api.route('/r_counterfactuals/jobs/<job_id>', methods=['DELETE'])
+def cancel_cf_subset_job(job_id):
+    """Unsubscribe from a job with the 'subscription' token returned on submission. The job
+    is cancelled once all its subscribers have unsubscribed."""
+    _get_job(job_id)
+    token = request.args.get('subscription')
+    if token is None:
+        raise ApiError("The subscription token is required.", 400)
+    return jsonify(serving.jobs.cancel(job_id, token).to_dict())
+
+
+@api.route('/r_counterfactuals/jobs/<job_id>/result', methods=['GET'])
+def get_cf_subset_job_result(job_id):
+    job = _get_job(job_id)
+    if job.status == jobs.DONE:
+        return jsonify(job.result)
+    if job.status == jobs.FAILED:
+        raise ApiError("Job {} failed: {}".format(job_id, job.error), 500)
+    if job.status == jobs.CANCELLED:
+        raise ApiError("Job {} has been cancelled.".format(job_id), 410)
+    raise ApiError("Job {} is {}.".format(job_id, job.status), 409, payload=job.to_dict())
+
+
+def _cached_response(key_parts, compute, mimetype, vary=None):
+    """Get the response body from the response cache, or compute and cache it. The cache key
+    is a canonical digest of the given parts and the model fingerprint."""
+    cache = serving.response_cache
+    if cache is None:
+        response = Response(compute(), mimetype=mimetype)
+        if vary is not None:
+            response.vary.add(vary)
+        return response
+    key = canonical_digest(request.endpoint, serving.model.fingerprint(), *key_parts)
+    body = cache.get(key)
+    if body is None:
+        body = compute()
+        cache.set(key, body)
+        status = 'MISS'
+    else:
+        status = 'HIT'
+    response = Response(body, mimetype=mimetype)
+    response.headers['X-Cache'] = status
+    if vary is not None:
+        response.vary.add(vary)
+    return response
 
 
 @api.route('/predict', methods=['POST'])
 def predict_instance():
     request_params = request.get_json()
     query_instance = request_params['queryInstance']
-    pred = current_app.model.report(x=[query_instance])[current_app.dataset.prediction]
-    return str(pred.values[0])
+
+    def compute():
+        coalescer = serving.coalescers.get('predict')
+        if coalescer is not None:
+            return str(coalescer.submit(query_instance))
+        pred = serving.model.predict(serving.dataset.preprocess_X([query_instance]),
+                                     output='label')
+        return str(pred[0])
+
+    return _cached_response([query_instance], compute, 'text/html')
 
 
 @api.route('/counterfactuals', methods=['GET', 'POST'])
 def get_cf_instance():
     request_params = request.get_json()
     X = request_params['queryInstance']
-    k = request_params.get('k', -1)
-    num = request_params.get('cfNum', 1)
-    attr_mask = request_params.get('attrFlex', None)
-    if attr_mask is not None:
-        changeable_attr = [current_app.dataset.features[i] for i, t in enumerate(attr_mask) if t]
+    setting = trans_setting(request_params, serving.dataset)
+    fmt = _wire_format()
+    # pin the random initialization so that cached answers equal recomputed ones
+    seed = request_params.get('seed', current_app.config.get('RESPONSE_CACHE_SEED'))
+    if seed is not None:
+        setting['seed'] = seed
+
+    def compute():
+        coalescer = serving.coalescers.get('counterfactuals')
+        if coalescer is not None:
+            cfs = coalescer.submit(([X], setting))
+        else:
+            cfs = serving.cf_engine.generate_counterfactual_examples([X], setting).all
+        cfs = cfs[serving.dataset.features + [serving.dataset.prediction]]
+        if fmt == 'json':
+            return json.dumps(cfs.values.tolist(), cls=BetterJSONEncoder)
+        return _encode_frames(fmt, [('counterfactuals', cfs)])
+
+    return _cached_response([X, setting, serving.cf_engine.config, fmt], compute,
+                            WIRE_FORMATS[fmt], vary='Accept')
+
+
+@api.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    if serving.response_cache is None:
+        raise ApiError("The response cache is disabled.", 404)
+    return jsonify(serving.response_cache.stats())
+
+
+def _read_batch_instances():
+    """Read the query instances and their settings of a batch request, from a JSON body with
+    'instances' as a list of rows or a dict of columns, or from an uploaded CSV file."""
+    features = serving.dataset.features
+    if request.mimetype == 'text/csv' or 'file' in request.files:
+        stream = request.files['file'] if 'file' in request.files else io.BytesIO(request.data)
+        instances = pd.read_csv(stream)
+        setting_params = json.loads(request.values.get('setting', '{}'))
+        setting_list = None
     else:
-        changeable_attr = 'all'
-    range_list = request_params.get('attrRange', [])
-    for r in range_list:
-        if 'extent' in r:
-            r['min'], r['max'] = r['extent'][0], r['extent'][1]
-    cf_range = {r["name"]: {**r} for r in range_list}
-
-    setting = {'changeable_attr': changeable_attr, 'cf_range': cf_range,
-               'num': num, 'k': k}
-
-    cfs = current_app.cf_engine.generate_counterfactual_examples([X], setting).all[
-        current_app.dataset.features + [current_app.dataset.prediction]]
-    return jsonify(cfs.values.tolist())
+        request_params = request.get_json()
+        instances = request_params['instances']
+        if isinstance(instances, dict):
+            instances = pd.DataFrame(instances)
+        else:
+            instances = pd.DataFrame(instances, columns=features)
+        setting_params = request_params.get('setting', {})
+        setting_list = request_params.get('settings', None)
+
+    missing = [f for f in features if f not in instances.columns]
+    if len(missing) > 0:
+        raise ApiError("Missing features: {}".format(missing))
+    instances = instances[features].reset_index(drop=True)
+    for f in serving.dataset.categorical_features:
+        instances[f] = instances[f].astype(str)
+    if setting_list is not None and len(setting_list) != len(instances):
+        raise ApiError("The number of settings should match the number of instances.")
+    if setting_list is None:
+        setting_list = [setting_params] * len(instances)
+    settings = [trans_setting({**setting_params, **params}, serving.dataset)
+                for params in setting_list]
+    return instances, settings
+
+
+@api.route('/counterfactuals/batch', methods=['POST'])
+def get_cf_batch():
+    """Generate counterfactual examples for many query instances, with a shared setting or
+    per-instance settings. Instances with the same setting are run in chunks of the engine
+    batch size, and each chunk is streamed back as a line of JSON as soon as it is ready."""
+    context = serving._get_current_object()
+    instances, settings = _read_batch_instances()
+    columns = context.dataset.features + [context.dataset.prediction]
+
+    groups = {}
+    for i, setting in enumerate(settings):
+        groups.setdefault(json.dumps(setting, sort_keys=True, default=str), []).append(i)
+
+    def messages():
+        batches = 0
+        for key, index in groups.items():
+            setting = settings[index[0]]
+            num = setting.get('num', 1)
+            # an 'auto' batch size is resolved to the tuned one
+            batch_size = context.cf_engine.resolve_batch_size(instances.iloc[index], setting)
+            for start in range(0, len(index), batch_size):
+                chunk = index[start: start + batch_size]
+                cfs = context.cf_engine.generate_counterfactual_examples(
+                    instances.iloc[chunk], setting, verbose=False).all[columns]
+                batches += 1
+                yield {'type': 'counterfactuals', 'instances': np.repeat(chunk, num),
+                       'counterfactuals': cfs.values.tolist()}
+        yield {'type': 'end', 'instances': len(instances), 'batches': batches}
+
+    response = Response(stream_with_context(_stream_messages(messages())),
+                        mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api.route('/coalescer/stats', methods=['GET'])
+def get_coalescer_stats():
+    return jsonify({name: coalescer.stats() for name, coalescer in serving.coalescers.items()})
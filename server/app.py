@@ -1,13 +1,12 @@
 import os
+import threading
 from flask import Flask
 from flask_cors import CORS
 
 from .api import api
 from .page import page
-
-from cf_ml.dataset import load_diabetes_dataset, load_german_credit_dataset
-from cf_ml.model import PytorchModelManager
-from cf_ml.cf_engine.engine import CFEnginePytorch
+from .prefork import PreforkServer
+from .registry import Registry, ServingContext
 
 SERVER_ROOT = os.path.dirname(os.path.abspath(os.path.join(__file__, '..')))
 OUTPUT_DIR = os.path.join(SERVER_ROOT, 'client/output')
@@ -16,38 +15,31 @@ STATIC_FOLDER = os.path.join(CLIENT_ROOT, 'static')
 
 
 def create_app(config=None):
-    """Create and configure an instance of the Flask application."""
+    """Create and configure an instance of the Flask application.
+
+    The app serves the DATASET/MODEL pair under /api, and any other pair, loaded on demand by
+    the registry, under /api/<data_id>/<model_id>. With the LAZY_STARTUP config, the default
+    pair is loaded in a background thread, and the API answers 503 until it is ready (see
+    /api/health).
+    """
     app = Flask(__name__, static_folder=CLIENT_ROOT)
 
     if config is not None:
         for key, val in config.items():
             app.config[key] = val
 
-    # load dataset
-    if app.config['DATASET'] == 'diabetes':
-        app.dataset = load_diabetes_dataset()
-    elif app.config['DATASET'] == 'german-credit':
-        app.dataset = load_german_credit_dataset()
+    app.context = ServingContext(app.config['DATASET'], app.config['MODEL'], app.config)
+    app.registry = Registry(app.config, max_entries=app.config.get('REGISTRY_MAX_ENTRIES', 4),
+                            max_bytes=app.config.get('REGISTRY_MAX_BYTES'))
+    app.registry.add(app.context, pinned=True)
+    if app.config.get('LAZY_STARTUP', False):
+        threading.Thread(target=app.context.warm_up, name='warm-up', daemon=True).start()
     else:
-        raise NotImplementedError
-
-    # load model
-    app.model = PytorchModelManager(app.dataset, model_name=app.config['MODEL'])
-    app.dir_manager = app.model.dir_manager
-    try:
-        app.model.load_model()
-    except FileNotFoundError:
-        app.model.train()
-        app.model.save_model()
-
-    app.model.save_reports()
-    app.dir_manager.clean_subset_cache()
-
-    # init engine
-    app.cf_engine = CFEnginePytorch(app.dataset, app.model)
+        app.context.load()
 
     app.register_blueprint(page)
     app.register_blueprint(api, url_prefix='/api')
+    app.register_blueprint(api, url_prefix='/api/<data_id>/<model_id>', name='hosted_api')
     CORS(app, resources={r"/api/*": {"origins": "*"}})
     return app
 
@@ -61,12 +53,74 @@ def add_arguments_server(parser):
     parser.add_argument('--host', default='0.0.0.0', help='The host to run the server')
     parser.add_argument('--port', default=7777, help='The port to run the server')
     parser.add_argument('--debug', action="store_true", help='Run Flask in debug mode')
+    parser.add_argument('--instrument', default=None, type=str,
+                        help="Collect the engine timing and counters: "
+                             "'memory', 'logging' or 'jsonl:<path>'")
+    parser.add_argument('--coalesce-window-ms', default=0, type=float,
+                        help="Coalesce concurrent predict/counterfactuals requests arriving "
+                             "within the window into batches, 0 to disable")
+    parser.add_argument('--coalesce-max-batch', default=64, type=int,
+                        help="The maximal number of rows in a coalesced batch")
+    parser.add_argument('--coalesce-timeout', default=300, type=float,
+                        help="The maximal time in seconds a coalesced request waits for its "
+                             "result")
+    parser.add_argument('--response-cache-size', default=0, type=int,
+                        help="The number of cached predict/counterfactuals responses, "
+                             "0 to disable")
+    parser.add_argument('--response-cache-ttl', default=None, type=float,
+                        help="The time to live of a cached response in seconds")
+    parser.add_argument('--response-cache-dir', default=None, type=str,
+                        help="The directory to persist cached responses")
+    parser.add_argument('--seed', default=None, type=int,
+                        help="The seed of counterfactual generation, which keeps cached "
+                             "responses deterministic")
+    parser.add_argument('--lazy-startup', action="store_true",
+                        help="Load the dataset and the model in the background after the "
+                             "server starts, see /api/health")
+    parser.add_argument('--data-root', default=None, type=str,
+                        help="The directory of the datasets served under "
+                             "/api/<data_id>/<model_id>, besides the sample datasets")
+    parser.add_argument('--registry-max-entries', default=4, type=int,
+                        help="The maximal number of resident dataset/model pairs")
+    parser.add_argument('--registry-max-bytes', default=None, type=int,
+                        help="The maximal memory footprint of the resident dataset/model pairs")
+    parser.add_argument('--inference-precision', default=None, choices=['int8', 'bfloat16'],
+                        help="Predict with a dynamically quantized (int8) or a bfloat16 copy "
+                             "of the model, the counterfactual search keeps the float model")
+    parser.add_argument('--workers', default=0, type=int,
+                        help="Serve from the given number of pre-forked worker processes, which "
+                             "share the loaded dataset and model, 0 to run the Flask server")
+    parser.add_argument('--threads-per-worker', default=None, type=int,
+                        help="The number of torch threads of each worker, the number of cores "
+                             "divided by the number of workers by default")
+    parser.add_argument('--memory-budget', default=None, type=int,
+                        help="The memory budget of a counterfactual job in bytes, which bounds "
+                             "the batch size, larger results are spilled to disk")
 
 
 def start_server(args):
     app = create_app(dict(DATASET=args.dataset, MODEL=args.model, OUTPUT_DIR=OUTPUT_DIR,
-                          STATIC_FOLDER=STATIC_FOLDER))
-
+                          STATIC_FOLDER=STATIC_FOLDER, INSTRUMENT=args.instrument,
+                          COALESCE_WINDOW_MS=args.coalesce_window_ms,
+                          COALESCE_MAX_BATCH=args.coalesce_max_batch,
+                          COALESCE_TIMEOUT=args.coalesce_timeout,
+                          RESPONSE_CACHE_SIZE=args.response_cache_size,
+                          RESPONSE_CACHE_TTL=args.response_cache_ttl,
+                          RESPONSE_CACHE_DIR=args.response_cache_dir,
+                          RESPONSE_CACHE_SEED=args.seed,
+                          # the workers are forked once the dataset and the model are loaded
+                          LAZY_STARTUP=args.lazy_startup and args.workers == 0,
+                          DATA_ROOT=args.data_root,
+                          REGISTRY_MAX_ENTRIES=args.registry_max_entries,
+                          REGISTRY_MAX_BYTES=args.registry_max_bytes,
+                          INFERENCE_PRECISION=args.inference_precision,
+                          ENGINE_CONFIG=dict(memory_budget=args.memory_budget)
+                          if args.memory_budget is not None else None))
+
+    if args.workers > 0:
+        PreforkServer(app, args.host, args.port, args.workers,
+                      threads_per_worker=args.threads_per_worker).serve_forever()
+        return
     app.run(
         debug=args.debug,
         host=args.host,
@@ -0,0 +1,196 @@
+import collections
+import json
+import queue
+import threading
+import timeit
+import concurrent.futures
+
+
+class RequestCoalescer:
+    """A class to coalesce concurrent requests into batches.
+
+    Requests submitted within a small time window, or until the batch is full, are grouped by
+    their key and each group is processed with one call. The results are fanned back out to
+    the waiting requests.
+
+    Args:
+        process: callable, receives a key and a list of items, and returns a list of results
+            in the same order.
+        window: number, the time in seconds to wait for more requests after the first one.
+        max_batch: number, the maximal number of rows in a batch.
+        key: callable or None, maps an item to a hashable key. Only items with the same key are
+            processed together.
+        name: str, the name of the coalescer.
+        timeout: number or None, the maximal time in seconds a request waits for its result.
+    """
+
+    def __init__(self, process, window=0.005, max_batch=64, key=None, name='coalescer',
+                 timeout=None):
+        self._process = process
+        self._window = window
+        self._max_batch = max_batch
+        self._timeout = timeout
+        self._key = key if key is not None else (lambda item: None)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {'batches': 0, 'calls': 0, 'items': 0, 'rows': 0, 'wait': 0.}
+        self._batch_sizes = collections.Counter()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item, rows=1):
+        """Submit an item and wait for its result.
+
+        Args:
+            item: the request item.
+            rows: number, the number of rows of the item, counted against max_batch.
+
+        Raises:
+            RuntimeError: if the coalescer is closed before the item is processed.
+            concurrent.futures.TimeoutError: if the result is not ready within the timeout.
+        """
+        future = concurrent.futures.Future()
+        # closing and submitting are serialized, so no item is queued after the sentinel
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The coalescer is closed.")
+            self._queue.put((item, rows, future, timeit.default_timer()))
+        try:
+            return future.result(self._timeout)
+        except concurrent.futures.TimeoutError:
+            # the item is skipped if it has not been processed yet
+            future.cancel()
+            raise
+
+    def _collect(self):
+        """Block until a request arrives, then collect requests until the window ends or
+        the batch is full."""
+        request = self._queue.get()
+        if request is None:
+            return None, 0
+        batch = [request]
+        rows = request[1]
+        deadline = timeit.default_timer() + self._window
+        while rows < self._max_batch:
+            timeout = deadline - timeit.default_timer()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(request)
+            rows += request[1]
+        return batch, rows
+
+    def _loop(self):
+        while True:
+            batch, rows = self._collect()
+            if batch is None:
+                return
+            start = timeit.default_timer()
+
+            # skip the items whose request has timed out
+            batch = [request for request in batch if request[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            groups = collections.OrderedDict()
+            for request in batch:
+                try:
+                    key = self._key(request[0])
+                except Exception as e:
+                    request[2].set_exception(e)
+                    continue
+                groups.setdefault(key, []).append(request)
+
+            for key, requests in groups.items():
+                try:
+                    results = self._process(key, [request[0] for request in requests])
+                    for request, result in zip(requests, results):
+                        request[2].set_result(result)
+                except Exception as e:
+                    for request in requests:
+                        request[2].set_exception(e)
+
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['calls'] += len(groups)
+                self._stats['items'] += len(batch)
+                self._stats['rows'] += rows
+                self._stats['wait'] += sum(start - request[3] for request in batch)
+                self._batch_sizes[len(batch)] += 1
+
+    def close(self):
+        """Stop the coalescer after the batch being processed, and fail the pending requests.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            while True:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request[2].set_running_or_notify_cancel():
+                    request[2].set_exception(RuntimeError("The coalescer is closed."))
+            self._queue.put(None)
+
+    def stats(self):
+        """Get the batch fill metrics."""
+        with self._lock:
+            stats = dict(self._stats)
+            batch_sizes = dict(self._batch_sizes)
+        batches = max(stats['batches'], 1)
+        items = max(stats['items'], 1)
+        return {**stats,
+                'window': self._window, 'max_batch': self._max_batch,
+                'mean_batch_items': stats['items'] / batches,
+                'mean_batch_rows': stats['rows'] / batches,
+                'mean_fill': stats['rows'] / batches / self._max_batch,
+                'mean_wait': stats['wait'] / items,
+                'batch_sizes': batch_sizes}
+
+
+def setting_key(item):
+    """Group counterfactual requests by their canonical setting."""
+    return json.dumps(item[1], sort_keys=True, default=str)
+
+
+def batch_predict(model, dataset):
+    """Create a process function predicting a batch of query instances in one forward pass."""
+
+    def process(key, instances):
+        return model.predict(dataset.preprocess_X(instances), output='label').tolist()
+
+    return process
+
+
+def batch_counterfactuals(engine):
+    """Create a process function generating the counterfactual examples of a batch of
+    (instances, setting) items with the same setting in one engine call.
+
+    The random initialization of a batch is drawn from one generator, so a seeded item would
+    depend on the items coalesced with it. Items with a seed are generated with a call each."""
+
+    def process(key, items):
+        setting = items[0][1]
+        if setting.get('seed') is not None and len(items) > 1:
+            return [process(key, [item])[0] for item in items]
+        num = setting.get('num', 1)
+        X = [instance for instances, _ in items for instance in instances]
+        cfs = engine.generate_counterfactual_examples(X, setting).all
+        results = []
+        start = 0
+        for instances, _ in items:
+            end = start + len(instances) * num
+            results.append(cfs.iloc[start: end])
+            start = end
+        return results
+
+    return process
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .encoding import column_categories, pack_columns, arrow_ipc, compress, \
+    COLUMNS_MIMETYPE, ARROW_MIMETYPE, CSV_MIMETYPE
+
+FORMATS = {'csv': CSV_MIMETYPE, 'columns': COLUMNS_MIMETYPE, 'arrow': ARROW_MIMETYPE}
+
+
+class PredictionTable:
+    """A class to serve a prediction table held in memory as pre-encoded bytes.
+
+    Encoded bodies are memoized by (format, columns, rows, content encoding), so that repeated
+    requests of the same slice are served without re-serialization. Each body has an ETag
+    derived from the content hash of the uncompressed body.
+
+    Args:
+        data: pandas.DataFrame, the prediction table (features, target, prediction).
+        dataset: Dataset, the dataset of the table, used to dictionary-encode the categorical
+            columns in the binary formats.
+        max_entries: number, the maximal number of memoized bodies.
+    """
+
+    def __init__(self, data, dataset, max_entries=64):
+        self._data = data.reset_index(drop=True)
+        self._categories = column_categories(dataset, self._data.columns)
+        self._max_entries = max_entries
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self):
+        return list(self._data.columns)
+
+    @property
+    def nbytes(self):
+        """The size of the table and of the memoized bodies in bytes."""
+        with self._lock:
+            bodies = sum(len(body) for body, _ in self._bodies.values())
+        return int(self._data.memory_usage(deep=True).sum()) + bodies
+
+    def __len__(self):
+        return len(self._data)
+
+    def _encode(self, fmt, columns, start, stop):
+        df = self._data.iloc[start: stop]
+        if columns is not None:
+            df = df[columns]
+        if fmt == 'csv':
+            return df.to_csv(index=False).encode()
+        if fmt == 'columns':
+            return pack_columns(df, self._categories)
+        if fmt == 'arrow':
+            return arrow_ipc(df, self._categories)
+        raise ValueError("Unknown format: {}.".format(fmt))
+
+    def encode(self, fmt='csv', columns=None, start=None, stop=None, encoding=None):
+        """Get the encoded body of a slice of the table.
+
+        Args:
+            fmt: str, 'csv', 'columns' (the column-packed binary format) or 'arrow'.
+            columns: list or None, the columns to include, all columns if None.
+            start: number or None, the first row of the slice.
+            stop: number or None, the row after the last one of the slice.
+            encoding: str or None, the content encoding, 'gzip', 'br' or None.
+
+        Returns:
+            A tuple of (body bytes, ETag).
+        """
+        if columns is not None:
+            unknown = [col for col in columns if col not in self._data.columns]
+            if len(unknown) > 0:
+                raise KeyError("Unknown columns: {}.".format(unknown))
+            columns = tuple(columns)
+        start, stop, _ = slice(start, stop).indices(len(self._data))
+        key = (fmt, columns, start, stop, encoding)
+        with self._lock:
+            if key in self._bodies:
+                self._bodies.move_to_end(key)
+                return self._bodies[key]
+
+        plain_key = (fmt, columns, start, stop, None)
+        with self._lock:
+            plain = self._bodies.get(plain_key)
+        if plain is None:
+            body = self._encode(fmt, list(columns) if columns is not None else None, start, stop)
+            plain = (body, hashlib.sha1(body).hexdigest())
+            self._put(plain_key, plain)
+        if encoding is None:
+            return plain
+
+        # the compressed bodies share the ETag of the plain body, with the encoding as suffix
+        entry = (compress(plain[0], encoding), '{}-{}'.format(plain[1], encoding))
+        self._put(key, entry)
+        return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._bodies[key] = entry
+            while len(self._bodies) > self._max_entries:
+                self._bodies.popitem(last=False)
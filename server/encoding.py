@@ -0,0 +1,222 @@
+import gzip
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNS_MIMETYPE = 'application/vnd.dece.columns'
+MSGPACK_MIMETYPE = 'application/msgpack'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+CSV_MIMETYPE = 'text/csv'
+
+WIRE_FORMATS = {'json': JSON_MIMETYPE, 'columns': COLUMNS_MIMETYPE,
+                'msgpack': MSGPACK_MIMETYPE, 'arrow': ARROW_MIMETYPE}
+
+
+def column_categories(dataset, columns):
+    """Get the categories of the categorical columns of a report or of counterfactual examples
+    (features, target, prediction)."""
+    categories = {}
+    for col in columns:
+        name = dataset.target if col == dataset.prediction else col
+        if name in dataset.description and dataset.description[name]['type'] == 'categorical':
+            categories[col] = dataset.description[name]['categories']
+    return categories
+
+
+def _category_codes(values, categories):
+    """Dictionary-encode categorical values with the smallest unsigned integer type."""
+    dtype = np.uint8 if len(categories) < 2 ** 8 - 1 else np.uint16
+    codes = pd.Categorical(values, categories=categories).codes
+    return codes.astype(dtype)
+
+
+def frame_columns(df, categories):
+    """Convert a dataframe into typed column arrays without building Python lists.
+
+    Args:
+        df: pandas.DataFrame, the data.
+        categories: dict, key: name of a categorical column, value: list of its categories.
+            The other columns are numerical.
+
+    Returns:
+        A list of (name, column info, numpy array), the numerical columns in float32 and the
+        categorical columns as codes into their categories. Unknown values are stored as the
+        maximal value of the code dtype.
+    """
+    columns = []
+    for col in df.columns:
+        if col in categories:
+            cats = [str(cat) for cat in categories[col]]
+            array = _category_codes(df[col].astype(str).values, cats)
+            columns.append((col, {'type': 'categorical', 'categories': cats}, array))
+        else:
+            array = np.ascontiguousarray(df[col].values, dtype=np.float32)
+            columns.append((col, {'type': 'numerical'}, array))
+    return columns
+
+
+def _pack_buffers(df, categories, offset):
+    """Get the header columns and the 8-byte aligned buffers of the columns of a dataframe."""
+    header_columns = []
+    buffers = []
+    for name, info, array in frame_columns(df, categories):
+        data = array.astype(array.dtype.newbyteorder('<')).tobytes()
+        header_columns.append({'name': name, **info, 'dtype': array.dtype.name,
+                               'offset': offset, 'size': len(data)})
+        padding = -len(data) % 8
+        buffers.append(data + b'\0' * padding)
+        offset += len(data) + padding
+    return header_columns, buffers, offset
+
+
+def _pack(header, buffers):
+    header = json.dumps(header).encode()
+    header += b' ' * (-(len(header) + 4) % 8)
+    return struct.pack('<I', len(header)) + header + b''.join(buffers)
+
+
+def pack_columns(df, categories, meta=None):
+    """Encode a dataframe in the column-packed binary format.
+
+    The format is a 4-byte little-endian header length, a UTF-8 JSON header and the column
+    buffers, each aligned to 8 bytes. The header has the number of rows and, for each
+    column, its name, type, dtype, byte offset (from the end of the header) and categories.
+
+    Args:
+        df: pandas.DataFrame, the data.
+        categories: dict, key: name of a categorical column, value: list of its categories.
+        meta: dict or None, extra JSON-serializable fields of the header.
+    """
+    header_columns, buffers, _ = _pack_buffers(df, categories, 0)
+    return _pack({**(meta or {}), 'length': len(df), 'columns': header_columns}, buffers)
+
+
+def pack_tables(tables, categories, meta=None):
+    """Encode named dataframes in the column-packed binary format. The header has a list of
+    'tables', each with its name, number of rows and columns."""
+    header_tables = []
+    buffers = []
+    offset = 0
+    for name, df in tables:
+        header_columns, table_buffers, offset = _pack_buffers(df, categories, offset)
+        header_tables.append({'name': name, 'length': len(df), 'columns': header_columns})
+        buffers.extend(table_buffers)
+    return _pack({**(meta or {}), 'tables': header_tables}, buffers)
+
+
+def msgpack_tables(tables, categories, meta=None):
+    """Encode named dataframes as MessagePack, with each column as a raw little-endian buffer.
+    """
+    if msgpack is None:
+        raise ImportError("msgpack is required for the MessagePack format.")
+    header_tables = []
+    for name, df in tables:
+        columns = [{'name': col, **info, 'dtype': array.dtype.name,
+                    'data': array.astype(array.dtype.newbyteorder('<')).tobytes()}
+                   for col, info, array in frame_columns(df, categories)]
+        header_tables.append({'name': name, 'length': len(df), 'columns': columns})
+    return msgpack.packb({**(meta or {}), 'tables': header_tables}, use_bin_type=True)
+
+
+def _arrow_batch(df, categories):
+    arrays = []
+    for col in df.columns:
+        if col in categories:
+            cats = [str(cat) for cat in categories[col]]
+            codes = pd.Categorical(df[col].astype(str).values, categories=cats).codes
+            arrays.append(pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array(codes.astype(np.int32), mask=codes < 0), pyarrow.array(cats)))
+        else:
+            arrays.append(pyarrow.array(np.ascontiguousarray(df[col].values, dtype=np.float32)))
+    return pyarrow.RecordBatch.from_arrays(arrays, names=list(df.columns))
+
+
+def arrow_ipc(df, categories, meta=None):
+    """Encode a dataframe as an Arrow IPC stream with dictionary-encoded categorical columns.
+    The extra fields are stored as JSON in the 'meta' entry of the schema metadata."""
+    return arrow_tables([(None, df)], categories, meta)
+
+
+def arrow_tables(tables, categories, meta=None):
+    """Encode named dataframes with the same columns as one Arrow IPC stream, one record batch
+    per dataframe. The names of the dataframes are stored in the 'tables' entry of the schema
+    metadata."""
+    if pyarrow is None:
+        raise ImportError("pyarrow is required for the Arrow format.")
+    batches = [_arrow_batch(df, categories) for _, df in tables]
+    schema = batches[0].schema.with_metadata({
+        'meta': json.dumps(meta or {}),
+        'tables': json.dumps([name for name, _ in tables])})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch.replace_schema_metadata(schema.metadata))
+    return sink.getvalue().to_pybytes()
+
+
+def encode_tables(fmt, tables, categories, meta=None):
+    """Encode named dataframes in one of the binary wire formats, 'columns', 'msgpack' or
+    'arrow'."""
+    if fmt == 'columns':
+        return pack_tables(tables, categories, meta)
+    if fmt == 'msgpack':
+        return msgpack_tables(tables, categories, meta)
+    if fmt == 'arrow':
+        return arrow_tables(tables, categories, meta)
+    raise ValueError("Unknown format: {}.".format(fmt))
+
+
+def available_formats():
+    """Get the wire formats whose optional dependencies are installed."""
+    return [fmt for fmt in WIRE_FORMATS if not (fmt == 'msgpack' and msgpack is None or
+                                                 fmt == 'arrow' and pyarrow is None)]
+
+
+def negotiate_format(accept_mimetypes):
+    """Choose the wire format from a werkzeug Accept header, JSON without the header.
+
+    Raises:
+        ValueError: if the header accepts none of the available formats.
+    """
+    if not accept_mimetypes:
+        return 'json'
+    mimetypes = [WIRE_FORMATS[fmt] for fmt in available_formats()]
+    best = accept_mimetypes.best_match(mimetypes)
+    if best is None:
+        raise ValueError("None of the accepted media types is supported: {}.".format(
+            accept_mimetypes))
+    return next(fmt for fmt, mimetype in WIRE_FORMATS.items() if mimetype == best)
+
+
+def compress(body, encoding):
+    """Compress a response body with 'gzip', 'br' or None."""
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return body
+
+
+def negotiate_encoding(accept_encodings):
+    """Choose the best supported content encoding from a werkzeug Accept-Encoding header."""
+    supported = (['br'] if brotli is not None else []) + ['gzip']
+    best = accept_encodings.best_match(supported)
+    return best if best is not None and accept_encodings[best] > 0 else None
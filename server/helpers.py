@@ -31,3 +31,33 @@ def trans_data_meta(data_meta):
         "prediction": {**desc[target], "name": prediction,
                        "index": desc[target]["index"] + 1}
     }
+
+
+def trans_filters(filters, dataset):
+    """Translate the filters from the client into the subset range of the engine."""
+    num_filters = {f["name"]: {"min": f.get("extent", [0, 0])[0],
+                               "max": f.get("extent", [0, 0])[1]} for f in filters if
+                   dataset.is_num(f["name"])}
+    cat_filters = {f["name"]: {"categories": [str(cat) for cat in f['categories']]
+                               if f['categories'] is not None else 'all'}
+                   for f in filters if not dataset.is_num(f["name"])}
+    return {**num_filters, **cat_filters}
+
+
+def trans_setting(request_params, dataset):
+    """Translate the query parameters from the client into the setting of the engine."""
+    k = request_params.get('k', -1)
+    num = request_params.get('cfNum', 1)
+    attr_mask = request_params.get('attrFlex', None)
+    if attr_mask is not None:
+        changeable_attr = [dataset.features[i] for i, t in enumerate(attr_mask) if t]
+    else:
+        changeable_attr = 'all'
+    range_list = request_params.get('attrRange', [])
+    for r in range_list:
+        if 'extent' in r:
+            r['min'], r['max'] = r['extent'][0], r['extent'][1]
+    cf_range = {r["name"]: {**r} for r in range_list}
+
+    return {'changeable_attr': changeable_attr, 'cf_range': cf_range,
+            'num': num, 'k': k}
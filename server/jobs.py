@@ -0,0 +1,192 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cf_ml.utils.memory import current_rss
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled."""
+
+
+class Job:
+    """A background job with progress reporting and cooperative cancellation.
+
+    Args:
+        key: str, the canonical key of the job, jobs with the same key are deduplicated.
+        total: number or None, the number of steps of the job.
+    """
+
+    def __init__(self, key, total=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = PENDING
+        self.total = total
+        self.completed = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self._subscriptions = set()
+        self.peak_rss = None
+        self._cancel_event = threading.Event()
+
+    def subscribe(self):
+        """Add a subscriber to the job.
+
+        Returns:
+            The subscription token, which the subscriber passes to unsubscribe.
+        """
+        token = uuid.uuid4().hex
+        self._subscriptions.add(token)
+        return token
+
+    def unsubscribe(self, token):
+        """Remove a subscriber, once per token.
+
+        Returns:
+            True if the token was subscribed.
+        """
+        if token not in self._subscriptions:
+            return False
+        self._subscriptions.remove(token)
+        return True
+
+    @property
+    def subscribers(self):
+        return len(self._subscriptions)
+
+    def advance(self, step):
+        """Report a completed step, raising JobCancelled if the job has been cancelled. The
+        RSS of the whole process is sampled at each step, so peak_rss includes the memory of
+        the jobs running concurrently."""
+        self.completed.append(step)
+        rss = current_rss()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.status = CANCELLED
+            self.finished = time.time()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def active(self):
+        return self.status in (PENDING, RUNNING) and not self.cancelled
+
+    def to_dict(self):
+        return {'id': self.id, 'key': self.key, 'status': self.status,
+                'progress': {'completed': len(self.completed), 'total': self.total,
+                             'steps': list(self.completed)},
+                'error': self.error, 'created': self.created, 'started': self.started,
+                'finished': self.finished, 'peak_rss': self.peak_rss,
+                'subscribers': self.subscribers}
+
+
+class JobManager:
+    """A class to run deduplicated jobs in a bounded pool of background workers.
+
+    Args:
+        max_workers: number, the number of worker threads.
+        max_jobs: number, the number of finished jobs to keep for status and result queries.
+    """
+
+    def __init__(self, max_workers=1, max_jobs=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='dece-job')
+        self._max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._active_by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, run, total=None):
+        """Submit a job, or subscribe to the active job with the same key.
+
+        Args:
+            key: str, the canonical key of the job.
+            run: callable, receives the Job and returns the result. It should call
+                job.advance after each step, which raises JobCancelled once cancelled.
+            total: number or None, the number of steps of the job.
+
+        Returns:
+            A tuple of (the submitted or the existing Job, the subscription token of the
+            caller, see cancel).
+        """
+        with self._lock:
+            job = self._active_by_key.get(key)
+            if job is not None and job.active:
+                return job, job.subscribe()
+            job = Job(key, total)
+            token = job.subscribe()
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job
+            self._prune()
+            job.future = self._executor.submit(self._run, job, run)
+            return job, token
+
+    def _run(self, job, run):
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            job.check_cancelled()
+            job.result = run(job)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = repr(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self._active_by_key.get(job.key) is job:
+                    del self._active_by_key[job.key]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.status in (DONE, FAILED, CANCELLED)]
+        for job_id in finished[:max(0, len(self._jobs) - self._max_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Get a job by id, or None if it does not exist."""
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id, token):
+        """Unsubscribe from a job, and cancel it when no subscribers are left.
+        A running job stops after its current step. Unsubscribing again with the same token,
+        or with a token of another job, does nothing."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.unsubscribe(token) and job.subscribers == 0:
+                job.cancel()
+                if self._active_by_key.get(job.key) is job:
+                    del self._active_by_key[job.key]
+            return job
+
+    def shutdown(self, wait=True):
+        for job in list(self._jobs.values()):
+            job.cancel()
+        self._executor.shutdown(wait=wait)
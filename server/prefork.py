@@ -0,0 +1,114 @@
+import logging
+import os
+import signal
+import socket
+import time
+
+from werkzeug.serving import make_server, select_address_family
+
+
+def thread_budget(workers, cpu_count=None):
+    """Get the number of intra-op threads of each worker, so that the workers together use
+    about one thread per core."""
+    cpu_count = cpu_count if cpu_count is not None else os.cpu_count() or 1
+    return max(1, cpu_count // max(1, workers))
+
+
+def bind_socket(host, port, backlog=128):
+    """Create a listening socket which is inherited by the forked workers."""
+    sock = socket.socket(select_address_family(host, port), socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """A class to serve an app from several forked worker processes.
+
+    The app is created, and its dataset, model and engine are loaded, in the parent process
+    before the workers are forked, so that the workers share the model weights and the
+    preprocessed arrays copy-on-write. All workers accept the connections of one listening
+    socket. Workers which exit unexpectedly are restarted.
+
+    Args:
+        app: Flask, the app, with its default dataset/model pair loaded.
+        host: str, the host to listen on.
+        port: number, the port to listen on.
+        workers: number, the number of worker processes.
+        threads_per_worker: number or None, the number of torch intra-op threads of each
+            worker, the number of cores divided by the number of workers if None.
+        threaded: boolean, whether each worker handles requests in threads.
+    """
+
+    def __init__(self, app, host, port, workers, threads_per_worker=None, threaded=True):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker if threads_per_worker is not None \
+            else thread_budget(workers)
+        self.threaded = threaded
+        self._socket = None
+        self._pids = set()
+        self._stopping = False
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid != 0:
+            self._pids.add(pid)
+            return pid
+        # worker process, it never returns
+        code = 0
+        try:
+            self._serve_worker()
+        except Exception:
+            logging.exception("Worker {} failed.".format(os.getpid()))
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _serve_worker(self):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        import torch
+        torch.set_num_threads(self.threads_per_worker)
+        self.app.registry.after_fork()
+        server = make_server(self.host, self.port, self.app, threaded=self.threaded,
+                             fd=self._socket.fileno())
+        server.serve_forever()
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._pids.discard(pid)
+
+    def serve_forever(self):
+        """Fork the workers and supervise them until SIGINT or SIGTERM."""
+        self._socket = bind_socket(self.host, self.port)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        print("Serving on {}:{} with {} workers x {} threads".format(
+            self.host, self.port, self.workers, self.threads_per_worker))
+        try:
+            for _ in range(self.workers):
+                self._spawn()
+            while self._pids:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                self._pids.discard(pid)
+                if not self._stopping:
+                    logging.warning("Worker {} exited with status {}, restarting.".format(
+                        pid, status))
+                    # avoid a tight loop of restarts when the workers fail at startup
+                    time.sleep(1)
+                    self._spawn()
+        finally:
+            self._stop(None, None)
+            self._socket.close()
@@ -0,0 +1,313 @@
+import logging
+import os
+import re
+import threading
+import timeit
+from collections import OrderedDict
+
+from .coalescer import RequestCoalescer, batch_predict, batch_counterfactuals, setting_key
+from .data_table import PredictionTable
+from .jobs import JobManager
+from .response_cache import ResponseCache
+
+from cf_ml.utils.instrument import make_collector
+
+_ID_PATTERN = re.compile(r'[\w\-]+')
+
+# datasets with more training rows than this are trained with bigger batches and early stopping
+LARGE_TRAIN_ROWS = 10000
+
+
+def load_dataset(data_id, data_root=None):
+    """Load a dataset by id, either a sample dataset ('diabetes' or 'german-credit') or a
+    directory in data_root with a data.csv and a description.csv (as written by
+    SyntheticDataGenerator.save), whose last attribute is the target."""
+    # sklearn is only imported when a dataset is loaded
+    import pandas as pd
+    from cf_ml.dataset import load_diabetes_dataset, load_german_credit_dataset, \
+        load_csv_dataset
+
+    if data_id == 'diabetes':
+        return load_diabetes_dataset()
+    if data_id == 'german-credit':
+        return load_german_credit_dataset()
+    if data_root is not None and _ID_PATTERN.fullmatch(data_id):
+        data_dir = os.path.join(data_root, data_id)
+        description_path = os.path.join(data_dir, 'description.csv')
+        if os.path.exists(description_path):
+            target = pd.read_csv(description_path)['name'].iloc[-1]
+            return load_csv_dataset(data_dir, target, name=data_id)
+    raise KeyError("Dataset {} does not exist.".format(data_id))
+
+
+class ServingContext:
+    """A class holding the dataset, the model, the engine and the serving helpers of a
+    dataset/model pair.
+
+    The requests using the context acquire and release it, and closing the context is
+    deferred until the last of them releases it.
+
+    Args:
+        data_id: str, the id of the dataset, see load_dataset.
+        model_id: str, the name of the model, which is trained if it does not exist.
+        config: dict-like, the app config.
+    """
+
+    def __init__(self, data_id, model_id, config):
+        self.data_id = data_id
+        self.model_id = model_id
+        self._config = config
+        self.ready = threading.Event()
+        self.startup_error = None
+        self.startup_time = None
+        self.inference_validation = None
+        self._footprint = None
+        self._users = 0
+        self._closing = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the dataset and the model, and build the engine and the serving helpers."""
+        start = timeit.default_timer()
+        # torch is only imported here to keep the import of the server fast
+        from cf_ml.model import PytorchModelManager
+        from cf_ml.model.model_manager import OUTPUT_ROOT
+        from cf_ml.cf_engine.engine import CFEnginePytorch
+        config = self._config
+
+        # load dataset
+        self.dataset = load_dataset(self.data_id, config.get('DATA_ROOT'))
+
+        # load model
+        self.model = PytorchModelManager(self.dataset, model_name=self.model_id,
+                                         root_dir=config.get('MODEL_ROOT', OUTPUT_ROOT),
+                                         use_cache=True,
+                                         inference_precision=config.get('INFERENCE_PRECISION'))
+        self.dir_manager = self.model.dir_manager
+        try:
+            self.model.load_model()
+        except FileNotFoundError:
+            train_config = config.get('TRAIN_CONFIG')
+            if train_config is None:
+                train_config = {'batch_size': 256} \
+                    if len(self.model.train_dataset) > LARGE_TRAIN_ROWS else {}
+            self.model.train(**train_config)
+            self.model.save_model()
+
+        # report how much the reduced-precision copy used for predictions loses
+        if self.model.inference_precision is not None:
+            self.inference_validation = self.model.validate_inference_model()
+            logging.info("Inference precision of {}/{}: {}".format(
+                self.data_id, self.model_id, self.inference_validation))
+
+        # the reports and the cached r-counterfactuals are reused if the model is unchanged
+        self.model.save_reports()
+        self.dir_manager.clean_subset_cache(self.model.report_fingerprint())
+        self.prediction_table = PredictionTable(self.dir_manager.load_prediction('dataset'),
+                                                self.dataset)
+
+        # init engine
+        self.collector = make_collector(config.get('INSTRUMENT'))
+        self.cf_engine = CFEnginePytorch(self.dataset, self.model, config.get('ENGINE_CONFIG'),
+                                         collector=self.collector)
+
+        # cache the responses of identical queries
+        self.response_cache = None
+        if config.get('RESPONSE_CACHE_SIZE', 0) > 0:
+            cache_dir = config.get('RESPONSE_CACHE_DIR')
+            if cache_dir is not None:
+                cache_dir = os.path.join(cache_dir, self.data_id, self.model_id)
+            self.response_cache = ResponseCache(max_entries=config['RESPONSE_CACHE_SIZE'],
+                                                max_bytes=config.get('RESPONSE_CACHE_BYTES'),
+                                                ttl=config.get('RESPONSE_CACHE_TTL'),
+                                                cache_dir=cache_dir)
+
+        self._start_workers()
+        self.startup_time = timeit.default_timer() - start
+        self.ready.set()
+        return self
+
+    def _start_workers(self):
+        """Start the coalescers and the job manager, whose threads serve the requests."""
+        config = self._config
+        # coalesce concurrent predictions and counterfactual queries into batches
+        self.coalescers = {}
+        window = config.get('COALESCE_WINDOW_MS', 0)
+        if window > 0:
+            max_batch = config.get('COALESCE_MAX_BATCH', 64)
+            timeout = config.get('COALESCE_TIMEOUT', 300)
+            self.coalescers['predict'] = RequestCoalescer(
+                batch_predict(self.model, self.dataset), window / 1000, max_batch,
+                name='predict', timeout=timeout)
+            self.coalescers['counterfactuals'] = RequestCoalescer(
+                batch_counterfactuals(self.cf_engine), window / 1000, max_batch,
+                key=setting_key, name='counterfactuals', timeout=timeout)
+
+        # r-counterfactuals jobs run in the background
+        self.jobs = JobManager(max_workers=config.get('JOB_WORKERS', 1))
+
+    def after_fork(self):
+        """Restart the background threads in a forked worker process, since threads are not
+        inherited by fork. The loaded dataset, model and engine are shared with the parent."""
+        if self.ready.is_set():
+            self._start_workers()
+
+    def warm_up(self):
+        """Load the context, and record the error if it fails."""
+        try:
+            self.load()
+        except Exception as e:
+            logging.exception("Failed to load {}/{}.".format(self.data_id, self.model_id))
+            self.startup_error = e
+
+    def health(self):
+        if self.ready.is_set():
+            health = {'status': 'ready', 'startup_time': self.startup_time}
+            if self.inference_validation is not None:
+                health['inference'] = self.inference_validation
+            return health
+        if self.startup_error is not None:
+            return {'status': 'failed', 'error': str(self.startup_error)}
+        return {'status': 'starting'}
+
+    def footprint(self):
+        """Get an estimate of the resident memory in bytes: the data, the prediction table, the
+        model weights and tensors, and the cached responses."""
+        if not self.ready.is_set():
+            return 0
+        if self._footprint is None:
+            self._footprint = int(
+                self.dataset.data.memory_usage(deep=True).sum() +
+                self.prediction_table.nbytes)
+        cached = self.response_cache.stats()['bytes'] if self.response_cache is not None else 0
+        return self._footprint + self.model.nbytes + cached
+
+    def acquire(self):
+        """Register a user of the context, which releases it when done."""
+        with self._lock:
+            self._users += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            close = self._closing and self._users == 0
+        if close:
+            self._shutdown()
+
+    def close(self):
+        """Stop the background jobs and coalescers, once the last user releases the context.
+        """
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            close = self._users == 0
+        if close:
+            self._shutdown()
+
+    def _shutdown(self):
+        if not self.ready.is_set():
+            return
+        self.jobs.shutdown(wait=False)
+        for coalescer in self.coalescers.values():
+            coalescer.close()
+
+
+class Registry:
+    """A class to lazily load the serving contexts of dataset/model pairs by id, and keep a
+    bounded number of them resident.
+
+    The least recently used contexts are evicted when there are more than max_entries
+    contexts, or when their total memory footprint exceeds max_bytes. Pinned contexts are
+    never evicted and do not count against the bounds.
+
+    Args:
+        config: dict-like, the app config.
+        max_entries: number or None, the maximal number of resident contexts.
+        max_bytes: number or None, the maximal total footprint of the resident contexts.
+    """
+
+    def __init__(self, config, max_entries=None, max_bytes=None):
+        self._config = config
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._contexts = OrderedDict()
+        self._pinned = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'loads': 0, 'evictions': 0}
+
+    def add(self, context, pinned=False):
+        """Register a context, which is loaded or being loaded."""
+        key = (context.data_id, context.model_id)
+        with self._lock:
+            if pinned:
+                self._pinned[key] = context
+            else:
+                self._contexts[key] = context
+                self._evict()
+
+    def get(self, data_id, model_id):
+        """Get the context of a dataset/model pair, and load it if it is not resident. The
+        context is acquired, and the caller releases it when done.
+
+        Raises:
+            KeyError: if the dataset does not exist or the ids are invalid.
+        """
+        key = (data_id, model_id)
+        with self._lock:
+            context = self._pinned.get(key)
+            if context is None:
+                context = self._contexts.get(key)
+                if context is not None:
+                    self._contexts.move_to_end(key)
+            if context is not None:
+                self._stats['hits'] += 1
+                return context.acquire()
+            if not (_ID_PATTERN.fullmatch(data_id) and _ID_PATTERN.fullmatch(model_id)):
+                raise KeyError("Invalid dataset or model id: {}/{}.".format(data_id, model_id))
+            lock = self._loading.setdefault(key, threading.Lock())
+
+        # load each pair once, other requests of the same pair wait for it
+        with lock:
+            with self._lock:
+                context = self._contexts.get(key)
+                if context is not None:
+                    context.acquire()
+            if context is None:
+                try:
+                    context = ServingContext(data_id, model_id, self._config).load()
+                finally:
+                    with self._lock:
+                        self._loading.pop(key, None)
+                with self._lock:
+                    self._stats['loads'] += 1
+                    self._contexts[key] = context.acquire()
+                    self._evict()
+        return context
+
+    def after_fork(self):
+        """Restart the background threads of the resident contexts in a forked worker."""
+        with self._lock:
+            contexts = list(self._pinned.values()) + list(self._contexts.values())
+        for context in contexts:
+            context.after_fork()
+
+    def _evict(self):
+        while len(self._contexts) > 1 and (
+                self._max_entries is not None and len(self._contexts) > self._max_entries or
+                self._max_bytes is not None and
+                sum(c.footprint() for c in self._contexts.values()) > self._max_bytes):
+            _, context = self._contexts.popitem(last=False)
+            context.close()
+            self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            contexts = [{'data_id': c.data_id, 'model_id': c.model_id, 'pinned': pinned,
+                         'footprint': c.footprint(), **c.health()}
+                        for pinned, group in ((True, self._pinned), (False, self._contexts))
+                        for c in group.values()]
+            return {**self._stats, 'max_entries': self._max_entries,
+                    'max_bytes': self._max_bytes, 'contexts': contexts}
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonical_digest(*parts):
+    """Get a digest of JSON-like parts, independent of the key order of dicts."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResponseCache:
+    """An in-process LRU cache of encoded responses, optionally backed by a directory on disk.
+
+    Entries are evicted when they are older than the TTL, or when the cache exceeds its maximal
+    number of entries or bytes, from the least recently used one.
+
+    Args:
+        max_entries: number, the maximal number of entries in memory.
+        max_bytes: number or None, the maximal total size of the entries in memory.
+        ttl: number or None, the time to live of an entry in seconds.
+        cache_dir: str or None, the directory to persist the entries.
+        max_disk_entries: number or None, the maximal number of entries on disk, defaults to
+            ten times max_entries.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None, cache_dir=None,
+                 max_disk_entries=None):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._dir = cache_dir
+        self._max_disk_entries = max_disk_entries if max_disk_entries is not None \
+            else max_entries * 10
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        if self._dir is not None and not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+
+    def _expired(self, created):
+        return self._ttl is not None and time.time() - created > self._ttl
+
+    def _disk_path(self, key):
+        return os.path.join(self._dir, '{}.pkl'.format(key))
+
+    def get(self, key):
+        """Get the cached value of a key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1]):
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+                self._remove(key)
+                self._stats['expirations'] += 1
+
+        if self._dir is not None:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    value, created = pickle.load(f)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                if not self._expired(created):
+                    with self._lock:
+                        self._stats['disk_hits'] += 1
+                        self._put(key, value, created)
+                    return value
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, key, value):
+        """Cache a value (bytes or str) of a key."""
+        created = time.time()
+        with self._lock:
+            self._put(key, value, created)
+        if self._dir is not None:
+            path = self._disk_path(key)
+            tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((value, created), f)
+            os.replace(tmp_path, path)
+            self._prune_disk()
+
+    def _put(self, key, value, created):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, created)
+        self._bytes += len(value)
+        while len(self._entries) > self._max_entries or \
+                (self._max_bytes is not None and self._bytes > self._max_bytes
+                 and len(self._entries) > 1):
+            self._remove(next(iter(self._entries)))
+            self._stats['evictions'] += 1
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def _prune_disk(self):
+        files = [os.path.join(self._dir, f) for f in os.listdir(self._dir) if f.endswith('.pkl')]
+        if len(files) <= self._max_disk_entries:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self._max_disk_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._dir is not None:
+            for filename in os.listdir(self._dir):
+                if filename.endswith('.pkl'):
+                    os.remove(os.path.join(self._dir, filename))
+
+    def stats(self):
+        with self._lock:
+            requests = self._stats['hits'] + self._stats['disk_hits'] + self._stats['misses']
+            return {**self._stats, 'entries': len(self._entries), 'bytes': self._bytes,
+                    'hit_rate': (self._stats['hits'] + self._stats['disk_hits']) / requests
+                    if requests else 0}
@@ -0,0 +1,24 @@
+import pytest
+import torch
+
+from cf_ml.dataset import load_diabetes_dataset
+from cf_ml.model import PytorchModelManager
+
+# The engine runs with few iterations so that a test takes seconds.
+ENGINE_CONFIG = {'min_iter': 50, 'max_iter': 100, 'project_frequency': 50}
+
+QUERY_INSTANCE = [6, 148, 72, 35, 0, 33.6, 0.627, 50]
+
+
+@pytest.fixture(scope='session')
+def dataset():
+    return load_diabetes_dataset()
+
+
+@pytest.fixture(scope='session')
+def model(dataset, tmp_path_factory):
+    torch.manual_seed(0)
+    model = PytorchModelManager(dataset, root_dir=str(tmp_path_factory.mktemp('models')))
+    model.train(epoch=40, batch_size=64, verbose=False)
+    model.save_model()
+    return model
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from server.app import create_app
+
+from conftest import ENGINE_CONFIG
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    app = create_app({'DATASET': 'diabetes', 'MODEL': 'MLP',
+                      'MODEL_ROOT': str(tmp_path_factory.mktemp('models')),
+                      'TRAIN_CONFIG': {'epoch': 1},
+                      'ENGINE_CONFIG': dict(ENGINE_CONFIG, batch_size='auto')})
+    return app
+
+
+def test_batch_counterfactuals_with_auto_batch_size(app, dataset):
+    instances = dataset.get_subset(preprocess=False)[dataset.features].iloc[:40]
+    response = app.test_client().post('/api/counterfactuals/batch',
+                                      json={'instances': instances.values.tolist(),
+                                            'setting': {'num': 1}})
+    assert response.status_code == 200
+    messages = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert messages[-1] == {'type': 'end', 'instances': 40, 'batches': messages[-1]['batches']}
+    chunks = [m for m in messages if m['type'] == 'counterfactuals']
+    assert len(chunks) == messages[-1]['batches'] > 1
+    assert sorted(i for m in chunks for i in m['instances']) == list(range(40))
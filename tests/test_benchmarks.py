@@ -0,0 +1,17 @@
+import importlib
+import os
+import tempfile
+
+import benchmarks.suites as suites
+
+
+def test_model_root_is_created_lazily_and_cleaned_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    importlib.reload(suites)
+    assert list(tmp_path.iterdir()) == []
+
+    root = suites.model_root()
+    assert os.path.isdir(root) and suites.model_root() == root
+    suites.cleanup()
+    assert not os.path.exists(root)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from cf_ml.cf_engine import CFEngineGenetic, CFEnginePytorch
+from cf_ml.cf_engine.autotune import BatchSizeTuner
+from cf_ml.cf_engine.buffers import BufferPool
+
+from conftest import ENGINE_CONFIG
+
+
+def test_buffers_are_reused():
+    pool = BufferPool()
+    buffer = pool.get('cfs', (8, 3))
+    assert pool.get('cfs', (5, 3)).base is buffer.base
+    assert pool.allocations == 1 and pool.nbytes == 8 * 3 * 4
+    # a larger batch or another shape or dtype replaces the buffer
+    pool.get('cfs', (9, 3))
+    pool.get('cfs', (9, 3), np.float64)
+    assert pool.allocations == 3 and pool.nbytes == 9 * 3 * 8
+
+    unpooled = BufferPool(reuse=False)
+    unpooled.get('cfs', (8, 3))
+    unpooled.get('cfs', (8, 3))
+    assert unpooled.allocations == 2 and unpooled.nbytes == 0
+
+
+def test_pooled_results_equal_unpooled(dataset, model):
+    X = dataset.get_subset(preprocess=False)[dataset.features].iloc[:12]
+    setting = {'num': 2, 'seed': 0}
+    for engine_class in [CFEnginePytorch, CFEngineGenetic]:
+        config = dict(ENGINE_CONFIG, batch_size=4)
+        pooled = engine_class(dataset, model, config)
+        unpooled = engine_class(dataset, model, dict(config, reuse_buffers=False))
+        expected = unpooled.generate_counterfactual_examples(X, setting, verbose=False).all
+        pool = pooled._buffer_pool()
+        allocations = []
+        for _ in range(2):
+            cfs = pooled.generate_counterfactual_examples(X, setting, verbose=False).all
+            pd.testing.assert_frame_equal(cfs, expected)
+            allocations.append(pool.allocations)
+
+        # the buffers of the first batch are reused by the later batches and calls
+        assert allocations[0] == len(pool._buffers) and allocations[1] == allocations[0]
+
+
+def test_trial_batches_release_their_buffers(dataset, model):
+    engine = CFEnginePytorch(dataset, model, dict(ENGINE_CONFIG, batch_size='auto'))
+    # a tuner without the persisted results of the other tests
+    engine._tuner = BatchSizeTuner()
+    X = dataset.get_subset(preprocess=False)[dataset.features].iloc[:100]
+    pool = engine._buffer_pool()
+    batch_size, _ = engine._auto_batch_size(dataset.preprocess_X(X), {'num': 1})
+    # the tuning measured batches of up to 64 rows, none of them kept by the pool of the calls
+    assert engine._buffer_pool() is pool and pool.nbytes == 0
+
+    engine.generate_counterfactual_examples(X, {'num': 1}, verbose=False)
+    assert len(pool._buffers['cfs']) == batch_size
@@ -0,0 +1,31 @@
+import numpy as np
+
+from cf_ml.utils.cache import ArrayCache
+
+
+def test_arrays_are_memory_mapped_by_fingerprint(tmp_path):
+    cache = ArrayCache(str(tmp_path / 'cache'))
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    created = []
+
+    def create():
+        created.append(1)
+        return array
+
+    loaded = cache.get_or_create('X', 'a', create)
+    assert isinstance(loaded, np.memmap) and np.array_equal(loaded, array)
+    assert np.array_equal(cache.get_or_create('X', 'a', create), array)
+    assert len(created) == 1
+
+    # a stale fingerprint is never trusted, the array is created again
+    assert cache.load('X', 'b') is None
+    cache.get_or_create('X', 'b', create)
+    assert len(created) == 2 and cache.get_fingerprint('X') == 'b'
+
+    # the copy-on-write mapping is writable without changing the stored array
+    loaded = cache.load('X', 'b')
+    loaded[0, 0] = 100
+    assert cache.load('X', 'b')[0, 0] == 0
+
+    cache.clear()
+    assert cache.get_fingerprint('X') is None
@@ -0,0 +1,133 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from cf_ml.cf_engine import CFEnginePytorch
+from server.coalescer import RequestCoalescer, batch_counterfactuals, setting_key
+
+from conftest import ENGINE_CONFIG, QUERY_INSTANCE
+
+
+def test_coalescer_groups_items_by_key():
+    calls = []
+
+    def process(key, items):
+        calls.append((key, list(items)))
+        return [item * 2 for item in items]
+
+    coalescer = RequestCoalescer(process, window=0.2, key=lambda item: item % 2)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.update({i: coalescer.submit(i)}))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    coalescer.close()
+
+    assert results == {i: i * 2 for i in range(4)}
+    assert sorted(key for key, _ in calls) == [0, 1]
+    assert coalescer.stats()['items'] == 4
+
+
+@pytest.mark.parametrize('seed', [0, 7])
+def test_seeded_counterfactuals_do_not_depend_on_coalesced_requests(dataset, model, seed):
+    engine = CFEnginePytorch(dataset, model, ENGINE_CONFIG)
+    setting = {'num': 2, 'seed': seed}
+    other = [2, 100, 60, 20, 80, 25.0, 0.3, 30]
+    expected = engine.generate_counterfactual_examples([QUERY_INSTANCE], setting).all
+
+    coalescer = RequestCoalescer(batch_counterfactuals(engine), window=0.5, key=setting_key)
+    results = {}
+
+    def submit(name, instance):
+        results[name] = coalescer.submit(([instance], setting))
+
+    threads = [threading.Thread(target=submit, args=('query', QUERY_INSTANCE)),
+               threading.Thread(target=submit, args=('other', other))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    coalescer.close()
+
+    assert coalescer.stats()['batches'] == 1
+    assert results['query'].reset_index(drop=True).equals(expected.reset_index(drop=True))
+
+
+def test_close_fails_the_pending_requests():
+    started = threading.Event()
+    proceed = threading.Event()
+
+    def process(key, items):
+        started.set()
+        proceed.wait(10)
+        return items
+
+    coalescer = RequestCoalescer(process, window=0)
+    results = {}
+
+    def submit(name):
+        try:
+            results[name] = coalescer.submit(name)
+        except RuntimeError as e:
+            results[name] = e
+
+    first = threading.Thread(target=submit, args=('first',))
+    first.start()
+    started.wait(10)
+    second = threading.Thread(target=submit, args=('second',))
+    second.start()
+    while coalescer._queue.empty():
+        time.sleep(0.01)
+    coalescer.close()
+    proceed.set()
+    first.join(10)
+    second.join(10)
+
+    # the batch being processed completes, the queued request fails instead of blocking
+    assert results['first'] == 'first'
+    assert isinstance(results['second'], RuntimeError)
+    with pytest.raises(RuntimeError):
+        coalescer.submit('third')
+
+
+def test_submit_times_out():
+    proceed = threading.Event()
+
+    def process(key, items):
+        proceed.wait(10)
+        return items
+
+    coalescer = RequestCoalescer(process, window=0, timeout=0.1)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        coalescer.submit('item')
+    proceed.set()
+    coalescer.close()
+
+
+def test_timed_out_items_are_skipped():
+    started, proceed = threading.Event(), threading.Event()
+    processed = []
+
+    def process(key, items):
+        started.set()
+        proceed.wait(10)
+        processed.extend(items)
+        return items
+
+    coalescer = RequestCoalescer(process, window=0, timeout=0.2)
+    first = threading.Thread(target=lambda: pytest.raises(concurrent.futures.TimeoutError,
+                                                          coalescer.submit, 'first'))
+    first.start()
+    started.wait(10)
+    # the second item times out while the first one is processed
+    with pytest.raises(concurrent.futures.TimeoutError):
+        coalescer.submit('second')
+    first.join(10)
+    proceed.set()
+    assert coalescer.submit('third') == 'third'
+    coalescer.close()
+    assert processed == ['first', 'third']
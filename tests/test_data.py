@@ -0,0 +1,23 @@
+import pytest
+
+from server.app import create_app
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    return create_app({'DATASET': 'diabetes', 'MODEL': 'MLP',
+                       'MODEL_ROOT': str(tmp_path_factory.mktemp('models')),
+                       'TRAIN_CONFIG': {'epoch': 1}})
+
+
+def test_data_is_revalidated_by_etag(app):
+    client = app.test_client()
+    response = client.get('/api/data?format=csv&stop=10')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert len(response.get_data(as_text=True).splitlines()) == 11
+
+    response = client.get('/api/data?format=csv&stop=10', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.get_data() == b''
+    response = client.get('/api/data?format=csv&stop=20', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
@@ -0,0 +1,109 @@
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from server.api import ApiError, _wire_format
+from server.encoding import available_formats, encode_tables, negotiate_format, WIRE_FORMATS
+
+msgpack = pytest.importorskip('msgpack')
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.ipc  # noqa: E402
+
+CATEGORIES = {'Outcome': ['negative', 'positive'],
+              'Outcome_pred': ['negative', 'positive']}
+TABLES = [('Glucose', pd.DataFrame({'Glucose': [148., 85.5, 183.], 'Age': [50, 31, 32],
+                                    'Outcome': ['positive', 'negative', 'positive'],
+                                    'Outcome_pred': ['negative', 'negative', 'positive']})),
+          ('Age', pd.DataFrame({'Glucose': [89.], 'Age': [21],
+                                'Outcome': ['negative'], 'Outcome_pred': ['positive']}))]
+
+
+def _frame(columns):
+    """Build a dataframe from (name, column info, numpy array) tuples."""
+    data = {}
+    for name, info, array in columns:
+        if info['type'] == 'categorical':
+            data[name] = pd.Categorical.from_codes(array.astype(np.int64), info['categories'])
+        else:
+            data[name] = array
+    return pd.DataFrame(data)
+
+
+def _decode_columns(body):
+    length, = struct.unpack('<I', body[:4])
+    header = json.loads(body[4: 4 + length])
+    data = body[4 + length:]
+    tables = []
+    for table in header.pop('tables'):
+        tables.append((table['name'], _frame(
+            (col['name'], col, np.frombuffer(data[col['offset']: col['offset'] + col['size']],
+                                             dtype=np.dtype(col['dtype']).newbyteorder('<')))
+            for col in table['columns'])))
+    return tables, header
+
+
+def _decode_msgpack(body):
+    header = msgpack.unpackb(body, raw=False)
+    tables = [(table['name'], _frame(
+        (col['name'], col, np.frombuffer(col['data'], dtype=np.dtype(col['dtype'])))
+        for col in table['columns'])) for table in header.pop('tables')]
+    return tables, header
+
+
+def _decode_arrow(body):
+    reader = pyarrow.ipc.open_stream(body)
+    metadata = reader.schema.metadata
+    names = json.loads(metadata[b'tables'])
+    tables = [(name, batch.to_pandas()) for name, batch in zip(names, reader)]
+    return tables, json.loads(metadata[b'meta'])
+
+
+def _expected(df):
+    """The dataframe as sent: float32 numerical columns and categorical columns."""
+    return pd.DataFrame({col: pd.Categorical(df[col], categories=CATEGORIES[col])
+                         if col in CATEGORIES else df[col].astype(np.float32)
+                         for col in df.columns})
+
+
+@pytest.mark.parametrize('fmt, decode', [('columns', _decode_columns),
+                                         ('msgpack', _decode_msgpack),
+                                         ('arrow', _decode_arrow)])
+def test_tables_round_trip(fmt, decode):
+    body = encode_tables(fmt, TABLES, CATEGORIES, {'index': [0, 2, 5]})
+    tables, meta = decode(body)
+    assert meta == {'index': [0, 2, 5]}
+    assert [name for name, _ in tables] == [name for name, _ in TABLES]
+    for (_, df), (_, expected) in zip(tables, TABLES):
+        pd.testing.assert_frame_equal(df, _expected(expected))
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        encode_tables('xml', TABLES, CATEGORIES)
+
+
+def test_negotiate_format():
+    assert available_formats() == list(WIRE_FORMATS)
+    for fmt, mimetype in WIRE_FORMATS.items():
+        accept = parse_accept_header('{}, application/json;q=0.5'.format(mimetype), MIMEAccept)
+        assert negotiate_format(accept) == fmt
+    assert negotiate_format(parse_accept_header('*/*', MIMEAccept)) == 'json'
+
+
+def test_unknown_accept_header_is_rejected():
+    assert negotiate_format(parse_accept_header('', MIMEAccept)) == 'json'
+    with pytest.raises(ValueError):
+        negotiate_format(parse_accept_header('application/xml', MIMEAccept))
+
+    app = Flask(__name__)
+    for query, headers in [('?format=xml', {}), ('', {'Accept': 'application/xml'})]:
+        with app.test_request_context('/' + query, headers=headers):
+            with pytest.raises(ApiError) as error:
+                _wire_format()
+            assert error.value.status_code == 406
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from cf_ml.cf_engine import CFEnginePytorch
+
+from conftest import ENGINE_CONFIG, QUERY_INSTANCE
+
+
+def test_profile_flag_of_a_call(dataset, model):
+    engine = CFEnginePytorch(dataset, model, ENGINE_CONFIG)
+    profile_dir = model.dir_manager.profile_dir
+    before = set(os.listdir(profile_dir)) if os.path.exists(profile_dir) else set()
+
+    engine.generate_counterfactual_examples([QUERY_INSTANCE], config={'profile': True})
+    files = set(os.listdir(profile_dir)) - before
+    assert any(f.endswith('generate_counterfactual_examples.pstats') for f in files)
+    assert not engine.config['profile']
+
+    engine.generate_counterfactual_examples([QUERY_INSTANCE])
+    assert set(os.listdir(profile_dir)) - before == files
+
+
+def test_compiled_step_matches_the_eager_one(dataset, model):
+    setting = {'num': 2, 'seed': 0}
+    eager = CFEnginePytorch(dataset, model, ENGINE_CONFIG)
+    scripted = CFEnginePytorch(dataset, model, dict(ENGINE_CONFIG, compile_step='script'))
+    expected = eager.generate_counterfactual_examples([QUERY_INSTANCE], setting).all
+    cfs = scripted.generate_counterfactual_examples([QUERY_INSTANCE], setting).all
+    assert cfs.shape == expected.shape
+    assert (cfs[dataset.prediction] == expected[dataset.prediction]).all()
+
+
+def test_unknown_compile_mode(dataset, model):
+    engine = CFEnginePytorch(dataset, model, dict(ENGINE_CONFIG, compile_step='compile'))
+    with pytest.raises(ValueError):
+        engine.generate_counterfactual_examples([QUERY_INSTANCE])
+
+
+def test_auto_batch_size_is_tuned_and_cached(dataset, model):
+    engine = CFEnginePytorch(dataset, model, dict(ENGINE_CONFIG, batch_size='auto'))
+    X = dataset.get_subset(preprocess=False)[dataset.features].iloc[:100]
+    batch_size, row_bytes = engine._auto_batch_size(dataset.preprocess_X(X), {'num': 1})
+    assert batch_size in (16, 64) and row_bytes > 0
+    assert engine._auto_batch_size(dataset.preprocess_X(X), {'num': 1}) == \
+        (batch_size, row_bytes)
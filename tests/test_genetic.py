@@ -0,0 +1,29 @@
+import numpy as np
+
+from cf_ml.cf_engine import CFEngineGenetic
+
+from conftest import QUERY_INSTANCE
+
+CONFIG = {'population': 32, 'elites': 8, 'generations': 30}
+
+
+def test_genetic_counterfactuals_are_valid_and_within_the_setting(dataset, model):
+    engine = CFEngineGenetic(dataset, model, CONFIG)
+    X = dataset.get_subset(preprocess=False)[dataset.features].iloc[:20]
+    setting = {'num': 2, 'seed': 0, 'changeable_attr': ['Glucose', 'BMI'],
+               'cf_range': {'Glucose': {'min': 50, 'max': 180}}}
+    cfs = engine.generate_counterfactual_examples(X, setting, verbose=False).all
+
+    assert len(cfs) == 40
+    assert len(cfs[cfs[dataset.target] == cfs[dataset.prediction]]) / len(cfs) >= 0.8
+    fixed = [f for f in dataset.features if f not in setting['changeable_attr']]
+    assert np.allclose(cfs[fixed].values.astype(float),
+                       np.repeat(X[fixed].values.astype(float), 2, axis=0))
+    assert cfs['Glucose'].between(50, 180).all()
+
+
+def test_genetic_counterfactuals_are_seeded(dataset, model):
+    engine = CFEngineGenetic(dataset, model, CONFIG)
+    first = engine.generate_counterfactual_examples([QUERY_INSTANCE], {'seed': 1}).all
+    second = engine.generate_counterfactual_examples([QUERY_INSTANCE], {'seed': 1}).all
+    assert first.equals(second)
@@ -0,0 +1,78 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from cf_ml.model import PytorchModelManager
+from cf_ml.utils import combine_fingerprints
+
+
+def _manager(dataset, model, root_dir, precision, **kwargs):
+    return PytorchModelManager(dataset, root_dir=str(root_dir), model=copy.deepcopy(model.model),
+                               inference_precision=precision, **kwargs)
+
+
+@pytest.mark.parametrize('precision', ['int8', 'bfloat16'])
+def test_inference_copy(dataset, model, tmp_path, precision):
+    manager = _manager(dataset, model, tmp_path, precision)
+    X = manager.test_dataset.tensors[0]
+    proba = manager.predict(X, output='proba', batch_size=64)
+
+    copied = manager._get_inference_model()
+    assert manager._get_inference_model() is copied and copied is not manager.model
+    if precision == 'int8':
+        assert any(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in copied.modules())
+    else:
+        assert all(p.dtype == torch.bfloat16 for p in copied.parameters())
+    # the float model is untouched
+    assert all(p.dtype == torch.float32 for p in manager.model.parameters())
+
+    expected = model.predict(X, output='proba')
+    assert not np.array_equal(proba, expected)
+    np.testing.assert_allclose(proba, expected, atol=0.05)
+    # exact predictions are the ones of the float model
+    np.testing.assert_array_equal(manager.predict(X, output='proba', exact=True), expected)
+
+    validation = manager.validate_inference_model()
+    assert validation['precision'] == precision and validation['agreement'] >= 0.95
+    assert validation['float_accuracy'] == pytest.approx(model.evaluate('test'))
+    assert abs(validation['accuracy_delta']) <= 0.05
+
+
+def test_unknown_inference_precision(dataset, tmp_path):
+    with pytest.raises(ValueError):
+        PytorchModelManager(dataset, root_dir=str(tmp_path), inference_precision='float16')
+
+
+def test_training_and_loading_rebuild_the_copy(dataset, model, tmp_path):
+    manager = _manager(dataset, model, tmp_path, 'int8')
+    manager.save_model()
+    X = manager.test_dataset.tensors[0]
+    copied = manager._get_inference_model()
+
+    manager.train(epoch=1, patience=None, verbose=False, save_result=False)
+    assert manager._inference_model is None
+    retrained = manager._get_inference_model()
+    assert retrained is not copied
+    np.testing.assert_allclose(manager.predict(X, output='proba'),
+                               manager.predict(X, output='proba', exact=True), atol=0.05)
+
+    manager.load_model()
+    assert manager._inference_model is None
+    np.testing.assert_allclose(manager.predict(X, output='proba'),
+                               model.predict(X, output='proba'), atol=0.05)
+
+
+def test_cached_reports_depend_on_the_precision(dataset, model, tmp_path):
+    exact = _manager(dataset, model, tmp_path, None, use_cache=True)
+    exact.save_reports()
+    fingerprint = exact.report_fingerprint()
+    cache = exact.dir_manager.cache
+    assert cache.contains('pred_dataset', fingerprint)
+
+    reduced = _manager(dataset, model, tmp_path, 'int8', use_cache=True)
+    assert reduced.report_fingerprint() == fingerprint
+    assert not cache.contains('pred_dataset', combine_fingerprints(fingerprint, 'int8'))
+    reduced.save_reports()
+    assert cache.contains('pred_dataset', combine_fingerprints(fingerprint, 'int8'))
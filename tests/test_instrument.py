@@ -0,0 +1,101 @@
+import json
+import logging
+
+import pytest
+
+from cf_ml.cf_engine import CFEnginePytorch
+from cf_ml.utils.instrument import JsonLinesCollector, LoggingCollector, MemoryCollector, \
+    make_collector, make_instrument, NULL_INSTRUMENT
+
+from conftest import ENGINE_CONFIG
+
+ROWS, BATCH_SIZE = 10, 4
+
+
+def _generate(dataset, model, collector):
+    engine = CFEnginePytorch(dataset, model, dict(ENGINE_CONFIG, batch_size=BATCH_SIZE),
+                             collector=collector)
+    X = dataset.get_subset(preprocess=False)[dataset.features].iloc[:ROWS]
+    return engine.generate_counterfactual_examples(X, {'num': 2, 'seed': 0}, verbose=False)
+
+
+def test_instrument_times_phases_and_counts():
+    collector = MemoryCollector()
+    instrument = make_instrument(collector, 'run', rows=3)
+    for _ in range(2):
+        with instrument.phase('outer'):
+            with instrument.phase('inner'):
+                instrument.count('steps', 2)
+    instrument.tag(batch_size=4)
+    instrument.finish()
+
+    record, = collector.records
+    assert record['name'] == 'run' and record['tags'] == {'rows': 3, 'batch_size': 4}
+    assert record['phase_counts'] == {'outer': 2, 'inner': 2}
+    assert record['total'] >= record['phases']['outer'] >= record['phases']['inner'] > 0
+    assert record['counters'] == {'steps': 4}
+
+    make_instrument(collector, 'run').finish()
+    summary = collector.summary()
+    assert summary['runs'] == {'run': 2} and summary['counters'] == {'run.steps': 4}
+    assert summary['phases']['run.outer']['count'] == 2
+    assert summary['phases']['run.outer']['mean'] == pytest.approx(record['phases']['outer'] / 2)
+    collector.reset()
+    assert collector.records == [] and collector.summary()['runs'] == {}
+    assert make_instrument(None, 'run') is NULL_INSTRUMENT
+
+
+def test_make_collector(tmp_path):
+    collector = MemoryCollector()
+    assert make_collector(None) is None and make_collector(collector) is collector
+    assert isinstance(make_collector('memory'), MemoryCollector)
+    assert isinstance(make_collector('logging'), LoggingCollector)
+    path = str(tmp_path / 'records.jsonl')
+    assert isinstance(make_collector('jsonl:' + path), JsonLinesCollector)
+    with pytest.raises(ValueError):
+        make_collector('statsd')
+
+
+def test_memory_collector_of_an_engine_call(dataset, model):
+    collector = MemoryCollector()
+    _generate(dataset, model, collector)
+
+    record, = collector.records
+    batches = -(-ROWS // BATCH_SIZE)
+    assert record['name'] == 'generate_counterfactual_examples'
+    assert record['tags']['rows'] == ROWS and record['tags']['batch_size'] == BATCH_SIZE
+    # the preprocessing of the call and of each batch
+    assert record['phase_counts']['preprocess'] == batches + 1
+    assert record['phase_counts']['optimize'] == batches
+    assert record['phase_counts']['refine'] == batches
+    assert record['total'] >= sum(record['phases'][phase]
+                                  for phase in ['mask', 'optimize', 'refine'])
+    counters = record['counters']
+    assert counters['batches'] == batches
+    assert counters['iterations'] >= ENGINE_CONFIG['min_iter'] * batches
+    assert counters['forward'] > counters['iterations']
+    assert 0 <= counters['converged'] <= ROWS * 2
+
+
+def test_jsonl_collector_of_engine_calls(dataset, model, tmp_path):
+    path = str(tmp_path / 'records.jsonl')
+    collector = make_collector('jsonl:' + path)
+    _generate(dataset, model, collector)
+    _generate(dataset, model, collector)
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2
+    for line in lines:
+        record = json.loads(line)
+        assert record['name'] == 'generate_counterfactual_examples'
+        assert record['counters']['batches'] == -(-ROWS // BATCH_SIZE)
+
+
+def test_logging_collector_of_an_engine_call(dataset, model, caplog):
+    with caplog.at_level(logging.INFO, logger='cf_ml.instrument'):
+        _generate(dataset, model, make_collector('logging'))
+    record, = [r for r in caplog.records if r.name == 'cf_ml.instrument']
+    message = record.getMessage()
+    assert message.startswith('generate_counterfactual_examples ')
+    assert 'optimize=' in message and 'batches=3' in message
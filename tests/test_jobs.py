@@ -0,0 +1,82 @@
+import threading
+
+from server.jobs import CANCELLED, DONE, FAILED, JobManager
+
+
+def _wait(job, timeout=10):
+    job.future.result(timeout)
+    return job
+
+
+def test_jobs_with_the_same_key_are_deduplicated():
+    manager = JobManager()
+    proceed = threading.Event()
+
+    def run(job):
+        proceed.wait(10)
+        for step in range(3):
+            job.advance(step)
+        return 'result'
+
+    job, token = manager.submit('key', run, total=3)
+    same, other_token = manager.submit('key', run)
+    assert same is job and other_token != token and job.subscribers == 2
+    proceed.set()
+    _wait(job)
+    assert job.status == DONE and job.result == 'result' and job.completed == [0, 1, 2]
+    assert manager.submit('key', run)[0] is not job
+    manager.shutdown()
+
+
+def test_a_job_is_cancelled_by_its_last_subscriber():
+    manager = JobManager()
+    started, proceed = threading.Event(), threading.Event()
+
+    def run(job):
+        started.set()
+        proceed.wait(10)
+        job.advance(0)
+        return 'result'
+
+    job, token = manager.submit('key', run)
+    _, other_token = manager.submit('key', run)
+    started.wait(10)
+    manager.cancel(job.id, token)
+    assert not job.cancelled
+    manager.cancel(job.id, other_token)
+    proceed.set()
+    # the running job stops at its next step
+    assert _wait(job).status == CANCELLED
+    manager.shutdown()
+
+
+def test_failed_jobs_report_their_error():
+    manager = JobManager()
+
+    def run(job):
+        raise ValueError('boom')
+
+    job = _wait(manager.submit('key', run)[0])
+    assert job.status == FAILED and 'boom' in job.error
+    manager.shutdown()
+
+
+def test_unsubscribing_twice_leaves_the_job_running():
+    manager = JobManager()
+    proceed = threading.Event()
+
+    def run(job):
+        proceed.wait(10)
+        job.advance(0)
+        return 'result'
+
+    job, token = manager.submit('key', run)
+    manager.submit('key', run)
+    # a repeated or foreign cancellation does not unsubscribe the other client
+    manager.cancel(job.id, token)
+    manager.cancel(job.id, token)
+    manager.cancel(job.id, 'unknown')
+    assert job.subscribers == 1 and not job.cancelled
+    proceed.set()
+    assert _wait(job).status == DONE
+    manager.shutdown()
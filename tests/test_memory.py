@@ -0,0 +1,39 @@
+import threading
+import tracemalloc
+
+import pytest
+import torch
+
+from cf_ml.cf_engine import CFEnginePytorch
+from cf_ml.utils.memory import current_rss, peak_rss, reset_peak_rss, PEAK_RSS_LOCK
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="the peak RSS cannot be reset")
+def test_peak_rss_measures_torch_allocations():
+    tracemalloc.start()
+    try:
+        base = current_rss()
+        reset_peak_rss()
+        tensor = torch.ones(16 * 2 ** 20)
+        del tensor
+        traced = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # the 64MB tensor is not traced by tracemalloc but is counted in the peak RSS
+    assert traced < 2 ** 20
+    assert peak_rss() - base >= 60 * 2 ** 20
+
+
+def test_measurements_of_the_peak_rss_are_serialized(dataset, model):
+    engine = CFEnginePytorch(dataset, model)
+    X = dataset.get_subset(preprocess=False)[dataset.features].iloc[:4]
+    result = []
+    with PEAK_RSS_LOCK:
+        thread = threading.Thread(
+            target=lambda: result.append(engine._measure_batch(X, {'num': 1}, 4)))
+        thread.start()
+        thread.join(1)
+        # the trial batch waits for the measurement holding the lock
+        assert thread.is_alive() and result == []
+    thread.join(60)
+    assert len(result) == 1 and result[0][1] > 0
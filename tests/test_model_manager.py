@@ -0,0 +1,15 @@
+from cf_ml.model import PytorchModelManager
+
+
+def test_report_fingerprint_without_cache(model):
+    fingerprint = model.report_fingerprint()
+    assert isinstance(fingerprint, str) and fingerprint == model.report_fingerprint()
+
+
+def test_report_fingerprint_identifies_the_weights(dataset, model, tmp_path):
+    other = PytorchModelManager(dataset, root_dir=str(tmp_path))
+    assert other.report_fingerprint() != model.report_fingerprint()
+
+    same = PytorchModelManager(dataset, root_dir=str(tmp_path), model=model.model,
+                               use_cache=True)
+    assert same.report_fingerprint() == model.report_fingerprint()
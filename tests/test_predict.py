@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import torch
+
+
+@pytest.fixture(scope='module')
+def X(dataset):
+    return dataset.preprocess_X(dataset.get_subset(preprocess=False)[dataset.features].iloc[:50])
+
+
+def test_predict_into_a_preallocated_buffer(model, X):
+    out = np.zeros((len(X), 2), dtype=np.float32)
+    assert model.predict(X, output='proba', out=out) is out
+    assert ((out >= 0) & (out <= 1)).all() and out.any()
+    classes = np.zeros(len(X), dtype=np.int64)
+    assert model.predict(X, out=classes) is classes
+    np.testing.assert_array_equal(classes, out.argmax(axis=1))
+
+
+@pytest.mark.parametrize('output, shape, dtype', [('proba', (50, 2), np.float64),
+                                                  ('proba', (49, 2), np.float32),
+                                                  ('proba', (50,), np.float32),
+                                                  ('class', (50,), np.int32),
+                                                  ('class', (50, 1), np.int64)])
+def test_predict_checks_the_buffer(model, X, output, shape, dtype):
+    with pytest.raises(ValueError):
+        model.predict(X, output=output, out=np.zeros(shape, dtype=dtype))
+
+
+def test_predict_unknown_output(model, X):
+    with pytest.raises(ValueError):
+        model.predict(X, output='logits')
+
+
+def test_batched_predict_equals_unbatched(model, X):
+    proba = model.predict(X, output='proba')
+    for batch_size in [1, 7, 50, 64]:
+        np.testing.assert_allclose(model.predict(X, output='proba', batch_size=batch_size),
+                                   proba, atol=1e-6)
+        np.testing.assert_array_equal(model.predict(X, batch_size=batch_size),
+                                      proba.argmax(axis=1))
+    # the input types are equivalent
+    np.testing.assert_array_equal(model.predict(X.values, output='proba'), proba)
+    np.testing.assert_array_equal(model.predict(torch.from_numpy(X.values), output='proba'),
+                                  proba)
+
+
+def test_predict_labels(dataset, model, X):
+    labels = model.predict(X, output='label', batch_size=16)
+    categories = dataset.description[dataset.target]['categories']
+    assert labels.shape == (len(X),) and set(labels) <= set(categories)
+    np.testing.assert_array_equal(labels, np.array(categories)[model.predict(X)])
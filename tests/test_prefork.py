@@ -0,0 +1,71 @@
+import argparse
+import os
+
+import pytest
+
+from server import prefork
+from server.app import add_arguments_server
+from server.prefork import bind_socket, PreforkServer, thread_budget
+
+
+def test_thread_budget(monkeypatch):
+    assert thread_budget(4, cpu_count=8) == 2
+    assert thread_budget(3, cpu_count=8) == 2
+    assert thread_budget(16, cpu_count=8) == 1
+    assert thread_budget(0, cpu_count=8) == 8
+    monkeypatch.setattr(os, 'cpu_count', lambda: 12)
+    assert thread_budget(4) == 3
+    monkeypatch.setattr(os, 'cpu_count', lambda: None)
+    assert thread_budget(4) == 1
+
+
+def test_threads_per_worker_override(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    assert PreforkServer(None, '127.0.0.1', 0, 2).threads_per_worker == 4
+    assert PreforkServer(None, '127.0.0.1', 0, 2, threads_per_worker=3).threads_per_worker == 3
+
+    parser = argparse.ArgumentParser()
+    add_arguments_server(parser)
+    assert parser.parse_args(['--workers', '2']).threads_per_worker is None
+    assert parser.parse_args(['--workers', '2', '--threads-per-worker', '3']).threads_per_worker \
+        == 3
+
+
+class _Registry:
+
+    def __init__(self, path):
+        self.path = path
+
+    def after_fork(self):
+        import torch
+        with open(self.path, 'w') as f:
+            f.write('{} {}'.format(os.getpid(), torch.get_num_threads()))
+
+
+class _App:
+
+    def __init__(self, path):
+        self.registry = _Registry(path)
+
+
+class _Server:
+
+    def serve_forever(self):
+        pass
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="fork is not available")
+def test_worker_restarts_the_registry_after_fork(monkeypatch, tmp_path):
+    path = str(tmp_path / 'after_fork')
+    monkeypatch.setattr(prefork, 'make_server', lambda *args, **kwargs: _Server())
+    server = PreforkServer(_App(path), '127.0.0.1', 0, 1, threads_per_worker=2)
+    server._socket = bind_socket('127.0.0.1', 0)
+    try:
+        pid = server._spawn()
+        _, status = os.waitpid(pid, 0)
+    finally:
+        server._socket.close()
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    # the hook ran in the child, with the thread budget of the worker
+    with open(path) as f:
+        assert f.read() == '{} 2'.format(pid)
@@ -0,0 +1,40 @@
+import os
+import threading
+
+from cf_ml.utils.profiler import Profiler
+
+
+def test_concurrent_profilers_share_the_torch_session(tmp_path):
+    first_started = threading.Event()
+    second_done = threading.Event()
+    files = {}
+
+    def first():
+        with Profiler(str(tmp_path), 'first') as profiler:
+            first_started.set()
+            second_done.wait(10)
+        files['first'] = profiler.files
+
+    def second():
+        first_started.wait(10)
+        with Profiler(str(tmp_path), 'second') as profiler:
+            sum(range(1000))
+        files['second'] = profiler.files
+        second_done.set()
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    # the second profiler skips the torch trace but still captures the python profile
+    assert any(f.endswith('.trace.json') for f in files['first'])
+    assert not any(f.endswith('.trace.json') for f in files['second'])
+    assert any(f.endswith('.pstats') for f in files['second'])
+    assert all(os.path.exists(f) for f in files['first'] + files['second'])
+
+    # the session is released, a later profiler captures a torch trace again
+    with Profiler(str(tmp_path), 'third') as profiler:
+        pass
+    assert any(f.endswith('.trace.json') for f in profiler.files)
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from server.registry import Registry
+
+CONFIG = {'TRAIN_CONFIG': {'epoch': 1}, 'COALESCE_WINDOW_MS': 200}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return Registry(dict(CONFIG, MODEL_ROOT=str(tmp_path)), max_entries=1)
+
+
+def test_eviction_during_an_in_flight_request(registry):
+    context = registry.get('diabetes', 'first')
+    coalescer = context.coalescers['predict']
+    results = {}
+    thread = threading.Thread(
+        target=lambda: results.update(label=coalescer.submit([6, 148, 72, 35, 0, 33.6,
+                                                               0.627, 50])))
+    thread.start()
+
+    # loading another model evicts the context while the request is coalesced
+    registry.get('diabetes', 'second').release()
+    assert registry.stats()['evictions'] == 1
+    thread.join(30)
+    assert results['label'] in context.dataset.description['Outcome']['categories']
+
+    # the evicted context is closed once the request releases it
+    coalescer.submit([6, 148, 72, 35, 0, 33.6, 0.627, 50])
+    context.release()
+    with pytest.raises(RuntimeError):
+        coalescer.submit([6, 148, 72, 35, 0, 33.6, 0.627, 50])
+
+
+def test_footprint_includes_the_model_tensors(registry):
+    context = registry.get('diabetes', 'first')
+    model = context.model
+    tensor_bytes = sum(t.numel() * t.element_size()
+                       for t in model.train_dataset.tensors + model.test_dataset.tensors)
+    assert model.nbytes > tensor_bytes
+    assert context.footprint() > model.nbytes
+    context.release()
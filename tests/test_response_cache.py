@@ -0,0 +1,35 @@
+import time
+
+from server.response_cache import ResponseCache
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    assert cache.get('a') == b'1234'
+    cache.set('c', b'1234')
+    # 'b' is the least recently used entry
+    assert cache.get('b') is None
+    cache.set('d', b'12345678')
+    assert cache.get('a') is None and cache.get('d') == b'12345678'
+    stats = cache.stats()
+    assert stats['evictions'] == 3 and stats['bytes'] == 8
+
+
+def test_expired_entries_are_dropped():
+    cache = ResponseCache(ttl=0.05)
+    cache.set('a', 'value')
+    assert cache.get('a') == 'value'
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_entries_persist_on_disk(tmp_path):
+    ResponseCache(cache_dir=str(tmp_path)).set('a', b'value')
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    assert cache.get('a') == b'value'
+    assert cache.stats()['disk_hits'] == 1
+    cache.clear()
+    assert ResponseCache(cache_dir=str(tmp_path)).get('a') is None
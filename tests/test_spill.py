@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+import pytest
+
+from cf_ml.cf_engine import CFEngineGenetic, CFEnginePytorch, CounterfactualExample, \
+    SpilledCounterfactualExample
+from cf_ml.utils.instrument import MemoryCollector
+
+from conftest import ENGINE_CONFIG
+
+# half of the budget holds about a hundred report rows
+
+BUDGET = 2 ** 16
+
+
+@pytest.fixture
+def X(dataset):
+    return dataset.get_subset(preprocess=False)[dataset.features].iloc[:200]
+
+
+@pytest.mark.parametrize('engine_class', [CFEnginePytorch, CFEngineGenetic])
+def test_spilled_results_stay_on_disk(dataset, model, X, tmp_path, engine_class):
+    collector = MemoryCollector()
+    # the budget is tiny, and so are the batches: a few iterations keep the test fast
+    config = dict(ENGINE_CONFIG, memory_budget=BUDGET, spill_dir=str(tmp_path), min_iter=5,
+                  max_iter=5, project_frequency=5, post_steps=1, population=16, elites=4,
+                  generations=5)
+    engine = engine_class(dataset, model, config, collector=collector)
+    cfs = engine.generate_counterfactual_examples(X, {'num': 2, 'seed': 0}, verbose=False)
+
+    record = collector.records[-1]
+    assert record['counters']['spills'] >= 2
+    assert isinstance(cfs, SpilledCounterfactualExample)
+    assert len(os.listdir(str(tmp_path))) == record['counters']['spills']
+
+    # the batches are bounded by half of the budget, and so are the parts held in memory
+    row_bytes = engine._row_footprint(2)
+    assert record['tags']['batch_size'] <= BUDGET / 2 // row_bytes
+    parts = list(cfs.parts())
+    assert all(part.memory_usage(deep=True).sum() <= BUDGET for part in parts)
+    assert sum(len(part) for part in parts) == len(X) * 2
+    assert len(cfs.all) == len(X) * 2
+
+    del cfs, parts
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_spilled_example_parts(dataset, tmp_path):
+    meta = {'features': dataset.features, 'target': dataset.target,
+            'prediction': dataset.prediction}
+    data = dataset.get_subset(preprocess=False).iloc[:10].copy()
+    data[dataset.prediction] = data[dataset.target]
+    cfs = SpilledCounterfactualExample(meta, spill_dir=str(tmp_path))
+    assert len(cfs.all) == 0 and os.listdir(str(tmp_path)) == []
+
+    cfs.append(data.iloc[:4])
+    cfs.append(data.iloc[4:])
+    assert [len(part) for part in cfs.parts()] == [4, 6]
+    pd.testing.assert_frame_equal(cfs.all, data[cfs.all.columns])
+    assert len(cfs.valid) == 10
+
+
+def test_spilled_example_reads_each_part_once(dataset, tmp_path, monkeypatch):
+    meta = {'features': dataset.features, 'target': dataset.target,
+            'prediction': dataset.prediction}
+    data = dataset.get_subset(preprocess=False).iloc[:10].copy()
+    data[dataset.prediction] = data[dataset.target].values[::-1]
+    cfs = SpilledCounterfactualExample(meta, spill_dir=str(tmp_path))
+    for start in range(0, 10, 3):
+        cfs.append(data.iloc[start: start + 3])
+    reads = []
+    read_pickle = pd.read_pickle
+
+    def counted_read_pickle(path):
+        reads.append(path)
+        return read_pickle(path)
+
+    monkeypatch.setattr(pd, 'read_pickle', counted_read_pickle)
+    expected = CounterfactualExample(meta, data)
+    for name in ['valid', 'invalid']:
+        del reads[:]
+        result = getattr(cfs, name)
+        assert len(reads) == 4
+        pd.testing.assert_frame_equal(result, getattr(expected, name))
+
+
+def test_measured_memory_bounds_the_batch_size():
+    # the measured memory of an instance bounds the next batches when it exceeds the estimate
+    assert CFEnginePytorch._bound_batch_size(1000, 100, 50, 10 ** 5) == (1000, 100)
+    assert CFEnginePytorch._bound_batch_size(1000, 100, 500, 10 ** 5) == (100, 500)
+    assert CFEnginePytorch._bound_batch_size(1000, 100, 10 ** 6, 10 ** 5) == (1, 10 ** 6)
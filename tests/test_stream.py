@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from server.app import create_app
+
+from conftest import ENGINE_CONFIG
+
+# a few instances, so that the r-counterfactuals of each feature take a fraction of a second
+FILTERS = [{'name': 'Glucose', 'extent': [180, 199]}, {'name': 'Age', 'extent': [40, 60]}]
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    return create_app({'DATASET': 'diabetes', 'MODEL': 'MLP',
+                       'MODEL_ROOT': str(tmp_path_factory.mktemp('models')),
+                       'TRAIN_CONFIG': {'epoch': 1}, 'ENGINE_CONFIG': ENGINE_CONFIG})
+
+
+def test_stream_sends_a_chunk_per_subset(app, dataset):
+    client = app.test_client()
+    response = client.post('/api/r_counterfactuals/stream', json={'filters': FILTERS})
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    messages = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [m['type'] for m in messages] == \
+        ['index'] + ['counterfactuals'] * len(dataset.features) + ['end']
+    assert [m['feature'] for m in messages[1:-1]] == dataset.features
+
+    # the concatenated chunks are the non-streamed response, which is read back from the cache
+    # written by the stream, up to the rounding of the cached values
+    expected = client.post('/api/r_counterfactuals', json={'filters': FILTERS}).get_json()
+    assert len(expected['index']) > 0 and messages[0]['index'] == expected['index']
+    rows = [row for m in messages[1:-1] for row in m['counterfactuals']]
+    expected_rows = [row for cfs in expected['counterfactuals'] for row in cfs]
+    assert len(rows) == len(expected_rows) > 0
+    assert all(row == pytest.approx(expected_row) for row, expected_row in zip(rows, expected_rows))
+    assert [len(m['counterfactuals']) for m in messages[1:-1]] == \
+        [len(cfs) for cfs in expected['counterfactuals']]
+
+
+def test_stream_as_server_sent_events(app, dataset):
+    response = app.test_client().post('/api/r_counterfactuals/stream',
+                                      json={'filters': FILTERS},
+                                      headers={'Accept': 'text/event-stream'})
+    assert response.mimetype == 'text/event-stream'
+    events = response.get_data(as_text=True).split('\n\n')[:-1]
+    assert len(events) == len(dataset.features) + 2
+    assert events[0].startswith('event: index\ndata: ')
+    assert events[-1] == 'event: end\ndata: {"type": "end"}'
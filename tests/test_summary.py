@@ -0,0 +1,105 @@
+import collections
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cf_ml.cf_engine import CounterfactualExampleBySubset, summarize_r_counterfactuals
+from cf_ml.dataset import load_german_credit_dataset
+
+NUM = 2
+
+
+@pytest.fixture(scope='module')
+def german_credit():
+    return load_german_credit_dataset()
+
+
+@pytest.fixture(scope='module')
+def r_counterfactuals(german_credit):
+    dataset = german_credit
+    meta = {'features': dataset.features, 'target': dataset.target,
+            'prediction': dataset.prediction}
+    original = dataset.data[dataset.features].iloc[:3]
+    r_counterfactuals = CounterfactualExampleBySubset(meta, {}, original)
+    for feature, values in [('Age', [67, 30, 22, 22, 49, 76]),
+                            ('Housing', ['rent', 'own', 'own', 'free', 'rent', 'own'])]:
+        cfs = original.loc[original.index.repeat(NUM)].reset_index(drop=True)
+        cfs[feature] = values
+        cfs['Credit amount'] = [1169, 1169, 5951, 18425, 250, 2096]
+        cfs[dataset.target] = ['bad', 'bad', 'good', 'good', 'bad', 'bad']
+        cfs[dataset.prediction] = ['bad', 'good', 'good', 'bad', 'bad', 'good']
+        r_counterfactuals.append_counterfactuals(feature, cfs)
+    return r_counterfactuals
+
+
+def _bin(edges, value):
+    """The index of the bin of a value, the last bin being closed."""
+    value = min(max(value, edges[0]), edges[-1])
+    return min(sum(edge <= value for edge in edges) - 1, len(edges) - 2)
+
+
+def test_summary_matches_direct_counts(german_credit, r_counterfactuals):
+    dataset = german_credit
+    original = r_counterfactuals.original_instances
+    features = ['Age', 'Housing', 'Credit amount']
+    summary = summarize_r_counterfactuals(dataset, original, r_counterfactuals, features,
+                                          n_bins=10)
+    assert list(summary) == ['Age', 'Housing']
+    universal_range = dataset.get_universal_range()
+
+    for released, subset_cf in r_counterfactuals.subsets.items():
+        cfs = subset_cf.all
+        rows = list(zip(original.loc[original.index.repeat(NUM)].to_dict('records'),
+                        cfs.to_dict('records')))
+        valid = [cf[dataset.target] == cf[dataset.prediction] for _, cf in rows]
+        subset_summary = summary[released]
+        assert subset_summary['instances'] == 3 and subset_summary['counterfactuals'] == 6
+        assert subset_summary['valid_rate'] == pytest.approx(sum(valid) / 6)
+
+        for feature in features:
+            feature_summary = subset_summary['features'][feature]
+            changed = [o[feature] != cf[feature] for o, cf in rows]
+            assert feature_summary['change_rate'] == pytest.approx(sum(changed) / 6)
+            assert feature_summary['valid_change_rate'] == pytest.approx(
+                sum(c for c, v in zip(changed, valid) if v) / sum(valid))
+
+            bins = feature_summary['bins']
+            values = [cf[feature] for _, cf in rows]
+            valid_values = [value for value, v in zip(values, valid) if v]
+            if dataset.is_num(feature):
+                # at most 10 bins covering the universal range
+                assert len(bins) <= 11
+                assert bins[0] <= universal_range[feature]['min']
+                assert bins[-1] >= universal_range[feature]['max']
+                count = collections.Counter(_bin(bins, value) for value in values)
+                expected = [count[i] for i in range(len(bins) - 1)]
+                original_count = collections.Counter(
+                    _bin(bins, value) for value in original[feature])
+                expected_original = [original_count[i] for i in range(len(bins) - 1)]
+            else:
+                assert bins == universal_range[feature]['categories']
+                count = collections.Counter(values)
+                expected = [count[cat] for cat in bins]
+                expected_original = [list(original[feature]).count(cat) for cat in bins]
+                transitions = collections.Counter((o[feature], cf[feature])
+                                                  for (o, cf), v in zip(rows, valid) if v)
+                np.testing.assert_array_equal(
+                    feature_summary['transitions'],
+                    [[transitions[(a, b)] for b in bins] for a in bins])
+            np.testing.assert_array_equal(feature_summary['counterfactual'], expected)
+            np.testing.assert_array_equal(feature_summary['original'], expected_original)
+            assert feature_summary['valid_counterfactual'].sum() == len(valid_values)
+
+
+def test_summary_of_an_empty_subset(german_credit):
+    dataset = german_credit
+    meta = {'features': dataset.features, 'target': dataset.target,
+            'prediction': dataset.prediction}
+    r_counterfactuals = CounterfactualExampleBySubset(meta, {})
+    r_counterfactuals.append_counterfactuals(
+        'Age', pd.DataFrame(columns=dataset.features + [dataset.target, dataset.prediction]))
+    summary = summarize_r_counterfactuals(dataset, dataset.data[dataset.features].iloc[:0],
+                                          r_counterfactuals, ['Age'])
+    assert summary['Age']['counterfactuals'] == 0 and summary['Age']['valid_rate'] == 0.
+    assert summary['Age']['features']['Age']['counterfactual'].sum() == 0
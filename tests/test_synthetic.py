@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from cf_ml.dataset import load_csv_dataset, load_german_credit_dataset
+from cf_ml.dataset.synthetic import SyntheticDataGenerator, description_from_dataset
+
+
+@pytest.fixture(scope='module')
+def german_credit():
+    return load_german_credit_dataset()
+
+
+def _generator(dataset, **kwargs):
+    return SyntheticDataGenerator(description_from_dataset(dataset), dataset.target,
+                                  reference=dataset.data, **kwargs)
+
+
+def test_description_from_dataset(german_credit):
+    description = description_from_dataset(german_credit)
+    assert list(description) == german_credit.columns
+    for col, info in description.items():
+        if german_credit.is_num(col):
+            assert set(info) == {'type', 'min', 'max', 'decile'} and info['type'] == 'numerical'
+            assert info['min'] <= german_credit.data[col].min()
+            assert info['max'] >= german_credit.data[col].max()
+        else:
+            assert set(info) == {'type', 'category'} and info['type'] == 'categorical'
+            assert set(german_credit.data[col].astype(str)) <= set(info['category'])
+
+
+def test_generated_data_follows_the_description(german_credit, tmp_path):
+    generator = _generator(german_credit, seed=1)
+    data = generator.generate(1000, chunk_size=300)
+    assert list(data.columns) == german_credit.features + [german_credit.target]
+    assert len(data) == 1000 and list(data.index) == list(range(1000))
+    for col, info in generator.description.items():
+        if info['type'] == 'numerical':
+            assert data[col].between(info['min'], info['max']).all()
+            if info['decile'] == 0:
+                assert (data[col] == data[col].round()).all()
+        else:
+            assert set(data[col]) <= set(info['category'])
+
+    # the data is reproducible from the seed and the chunk size
+    assert generator.generate(1000, chunk_size=300).equals(data)
+    assert not _generator(german_credit, seed=2).generate(1000, chunk_size=300).equals(data)
+
+    # the saved data and description load as a dataset
+    generator.save(1000, str(tmp_path), chunk_size=300)
+    dataset = load_csv_dataset(str(tmp_path), german_credit.target)
+    assert dataset.features == german_credit.features and len(dataset.data) == 1000
+
+
+def test_extra_features_copy_the_described_ones(dataset):
+    generator = _generator(dataset, n_features=len(dataset.features) + 2)
+    first, second = dataset.features[:2]
+    assert generator.features == dataset.features + [first + '_1', second + '_1']
+    assert generator.description[first + '_1'] == generator.description[first]
+    data = generator.to_dataset(500).data
+    assert list(data.columns) == generator.features + [dataset.target]
+
+
+def test_marginals_and_correlations_are_preserved(dataset):
+    reference = dataset.data
+    data = _generator(dataset).generate(20000)
+    for col in dataset.numerical_features:
+        scale = reference[col].max() - reference[col].min()
+        for q in [0.1, 0.25, 0.5, 0.75, 0.9]:
+            assert abs(data[col].quantile(q) - reference[col].quantile(q)) <= 0.05 * scale
+    balance = data[dataset.target].astype(str).value_counts(normalize=True)
+    expected = reference[dataset.target].astype(str).value_counts(normalize=True)
+    assert np.allclose(balance[expected.index], expected, atol=0.02)
+
+    # the copula preserves the rank correlations but for the ties of the reference
+    columns = dataset.numerical_features
+    expected = reference[columns].corr(method='spearman').values
+    correlation = data[columns].corr(method='spearman').values
+    assert np.abs(correlation - expected).max() < 0.15
+    strong = np.abs(expected) > 0.3
+    assert strong.sum() > len(columns) and \
+        (np.sign(correlation[strong]) == np.sign(expected[strong])).all()
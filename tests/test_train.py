@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import torch
+from sklearn.metrics import confusion_matrix, f1_score, roc_auc_score
+
+from cf_ml.model import PytorchModelManager
+
+TARGET = np.eye(2)[[0, 0, 1, 1, 1, 0]]
+PROBA = np.array([[0.9, 0.1], [0.4, 0.6], [0.3, 0.7], [0.2, 0.8], [0.6, 0.4], [0.7, 0.3]])
+
+
+@pytest.fixture
+def manager(dataset, tmp_path):
+    torch.manual_seed(0)
+    return PytorchModelManager(dataset, root_dir=str(tmp_path))
+
+
+def test_metrics(manager):
+    target_class, pred_class = [0, 0, 1, 1, 1, 0], [0, 1, 1, 1, 0, 0]
+    assert manager._metric('accuracy', TARGET, PROBA) == pytest.approx(4 / 6)
+    assert manager._metric('f1', TARGET, PROBA) == pytest.approx(
+        f1_score(target_class, pred_class))
+    assert manager._metric('auc', TARGET, PROBA) == pytest.approx(
+        roc_auc_score(target_class, PROBA[:, 1]))
+    np.testing.assert_array_equal(manager._metric('confusion_matrix', TARGET, PROBA),
+                                  confusion_matrix(target_class, pred_class))
+    # the targets of a single class have no AUC
+    assert np.isnan(manager._metric('auc', np.eye(2)[[1, 1]], PROBA[:2]))
+
+
+def test_train_restores_the_best_state(manager, monkeypatch):
+    scores = iter([0.5, 0.9, 0.4, 0.3, 0.2])
+    states = []
+
+    def metric(metric, target, proba):
+        states.append({k: v.clone() for k, v in manager.model.state_dict().items()})
+        return next(scores)
+
+    monkeypatch.setattr(manager, '_metric', metric)
+    manager.train(epoch=10, patience=3, verbose=False, save_result=False)
+    # stopped after three epochs without improvement on the second one
+    assert len(states) == 5
+    state = manager.model.state_dict()
+    assert all(torch.equal(value, states[1][key]) for key, value in state.items())
+    assert not all(torch.equal(value, states[-1][key]) for key, value in state.items())
+
+
+def test_train_restores_the_number_of_threads(manager, monkeypatch):
+    default_threads = torch.get_num_threads()
+    threads = []
+
+    def metric(metric, target, proba):
+        threads.append(torch.get_num_threads())
+        raise RuntimeError('interrupted')
+
+    monkeypatch.setattr(manager, '_metric', metric)
+    try:
+        torch.set_num_threads(2)
+        with pytest.raises(RuntimeError, match='interrupted'):
+            manager.train(epoch=1, patience=1, num_threads=1, verbose=False,
+                          save_result=False)
+        assert threads == [1] and torch.get_num_threads() == 2
+    finally:
+        torch.set_num_threads(default_threads)